@@ -0,0 +1,27 @@
+"""
+Length batches keep within their budget of padded samples and cover every utterance once.
+"""
+
+import numpy as np
+
+from uk1e2.eval.batching import length_batches
+
+
+def test_budget_and_coverage():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 1000, 500)
+    batches = length_batches(lengths, max_samples=4000, max_batch_size=16)
+    for batch in batches:
+        assert len(batch) * lengths[batch].max() <= 4000
+        assert len(batch) <= 16
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+
+
+def test_oversize_utterance_has_its_own_batch():
+    batches = length_batches([10, 5000, 20, 30], max_samples=100)
+    assert [batch.tolist() for batch in batches] == [[1], [3, 2, 0]]
+
+
+def test_empty():
+    assert length_batches([], max_samples=100) == []
+    assert length_batches(np.zeros(0, dtype=np.int64)) == []
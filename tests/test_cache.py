@@ -0,0 +1,54 @@
+"""
+Lookups in the media cache when the server's ETag and size are known on one side only.
+"""
+
+import pytest
+
+from uk1e2.cache import MediaCache
+
+
+URL = 'https://example.org/a.mp3'
+BODY = b'media' * 1000
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(tmp_path / 'cache')
+
+
+def cached(cache, tmp_path, etag):
+    path = tmp_path / 'download'
+    path.write_bytes(BODY)
+    return cache.insert(URL, path, etag=etag)
+
+
+def test_unknown_cached_etag_matches_on_size(cache, tmp_path):
+    path = cached(cache, tmp_path, etag=None)
+    assert cache.lookup(URL, etag='"v1"', size=len(BODY)) == path
+    assert cache.lookup(URL, etag='"v1"', size=len(BODY) + 1) is None
+
+
+def test_hit_records_the_etag(cache, tmp_path):
+    path = cached(cache, tmp_path, etag=None)
+    assert cache.lookup(URL, etag='"v1"', size=len(BODY)) == path
+    assert cache.lookup(URL, etag='"v2"', size=len(BODY)) is None
+
+
+def test_changed_etag_misses(cache, tmp_path):
+    cached(cache, tmp_path, etag='"v1"')
+    assert cache.lookup(URL, etag='"v2"', size=len(BODY)) is None
+
+
+def test_verify_refetches_corrupted_objects(tmp_path):
+    cache = MediaCache(tmp_path / 'cache', verify=True)
+    path = cached(cache, tmp_path, etag=None)
+    path.write_bytes(BODY[::-1])
+    assert cache.lookup(URL) is None
+    downloads = []
+
+    def download(partial):
+        downloads.append(partial)
+        partial.write_bytes(BODY)
+    cache.fetch(URL, tmp_path / 'a.mp3', download)
+    assert len(downloads) == 1
+    assert (tmp_path / 'a.mp3').read_bytes() == BODY
@@ -0,0 +1,69 @@
+"""
+Re-runs of cut_all_files read inputs only when their size or mtime changed.
+"""
+
+import json
+import os
+
+import pytest
+
+from uk1e2 import cut_all_files as module
+
+
+def count_cut(segments_folder, audio, alignment, single_pass):
+    "a line in the folder for every cut instead of segments, picklable for the pool"
+    segments_folder.mkdir(parents=True, exist_ok=True)
+    with open(segments_folder / 'cuts', 'a') as f:
+        f.write('cut\n')
+    return 0.
+
+
+@pytest.fixture
+def news(tmp_path, monkeypatch):
+    (tmp_path / 'align').mkdir()
+    (tmp_path / 'webm').mkdir()
+    rows = []
+    for id in ('1', '2'):
+        (tmp_path / 'align' / f'{id}.json').write_text('{}')
+        (tmp_path / 'webm' / f'{id}.webm').write_bytes(id.encode() * 100)
+        rows.append([id, 'channel', 'title', 'date', '10.0', f'https://example.org/{id}.webm', ''])
+    (tmp_path / 'index.json').write_text(json.dumps({'rows': rows}))
+
+    hashed = []
+
+    def sha256sum(path):
+        hashed.append(path.name)
+        return path.read_bytes().hex()
+    monkeypatch.setattr(module, 'sha256sum', sha256sum)
+
+    monkeypatch.setattr(module, 'cut', count_cut)
+
+    def run():
+        hashed.clear()
+        module.cut_all_files(tmp_path / 'index.json', tmp_path / 'align', tmp_path / 'webm', tmp_path / 'segments', jobs=1)
+        cuts = {id: len((tmp_path / 'segments' / id / 'cuts').read_text().splitlines()) for id in ('1', '2')}
+        return sorted(hashed), cuts
+    return tmp_path, run
+
+
+def test_rerun_does_not_hash(news):
+    tmp_path, run = news
+    assert run() == (['1.json', '1.webm', '2.json', '2.webm'], {'1': 1, '2': 1})
+    assert run() == ([], {'1': 1, '2': 1})
+
+
+def test_touched_input_is_hashed_not_cut(news):
+    tmp_path, run = news
+    run()
+    webm = tmp_path / 'webm' / '1.webm'
+    stat = webm.stat()
+    os.utime(webm, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run() == (['1.json', '1.webm'], {'1': 1, '2': 1})
+    assert run() == ([], {'1': 1, '2': 1})
+
+
+def test_changed_input_is_cut_again(news):
+    tmp_path, run = news
+    run()
+    (tmp_path / 'align' / '2.json').write_text('{"words": []}')
+    assert run() == (['2.json', '2.webm'], {'1': 1, '2': 2})
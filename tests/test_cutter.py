@@ -0,0 +1,53 @@
+"""
+Single-pass cutting out of a memory map, with ffmpeg standing in by writing PCM itself.
+"""
+
+import wave
+
+import numpy as np
+import pytest
+
+from uk1e2 import cutter
+
+
+PCM = (np.arange(3 * cutter.SAMPLE_RATE) % 30000).astype('<i2')
+
+
+@pytest.fixture
+def parts(tmp_path, monkeypatch):
+    parts = [{'start': start / 1000, 'end': end / 1000, 'start_ms': start, 'end_ms': end,
+              'transcript_original': f'part {i}',
+              'save_as_audio': str(tmp_path / f'x_{i}.wav'), 'save_as_txt': str(tmp_path / f'x_{i}.txt')}
+             for i, (start, end) in enumerate([(0, 500), (250, 1750), (2000, 3000)])]
+    monkeypatch.setattr(cutter, 'load_audio_parts', lambda *args: parts)
+
+    def ffmpeg(args):
+        with open(args[-1], 'wb') as f:
+            f.write(PCM.tobytes())
+    monkeypatch.setattr(cutter.subprocess, 'check_output', ffmpeg)
+    return parts
+
+
+def test_single_pass_cuts_slices(parts, tmp_path):
+    cutter.extract_segments_single_pass(tmp_path, tmp_path / 'x.webm', tmp_path / 'x.json', jobs=2)
+    for part in parts:
+        with wave.open(part['save_as_audio']) as w:
+            assert w.getframerate() == cutter.SAMPLE_RATE
+            frames = np.frombuffer(w.readframes(w.getnframes()), dtype='<i2')
+        start, end = int(part['start_ms']) * 16, int(part['end_ms']) * 16
+        assert np.array_equal(frames, PCM[start:end])
+        with open(part['save_as_txt']) as f:
+            assert f.read() == part['transcript_original']
+
+
+def test_writer_error_is_not_hidden(parts, tmp_path, monkeypatch):
+    write_wav = cutter.write_wav
+
+    def failing(path, frames, *args):
+        if path.endswith('_1.wav'):
+            raise OSError('disk full')
+        write_wav(path, frames, *args)
+    monkeypatch.setattr(cutter, 'write_wav', failing)
+
+    with pytest.raises(OSError, match='disk full'):
+        cutter.extract_segments_single_pass(tmp_path, tmp_path / 'x.webm', tmp_path / 'x.json', jobs=2)
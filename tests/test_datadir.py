@@ -0,0 +1,61 @@
+"""
+Data directories written through external sorts of tiny runs pass the checks of validate_data_dir.sh.
+"""
+
+import pytest
+
+from uk1e2.datadir import DataDirWriter, ExternalSorter, validate_data_dir
+
+
+def test_external_sort_last_value_wins():
+    sorter = ExternalSorter(run_size=2)
+    for key, value in [('c', '1'), ('a', '1'), ('b', '1'), ('a', '2'), ('d', '1'), ('c', '2'), ('a', '3')]:
+        sorter.add(key, value)
+    assert len(sorter.runs) == 3
+    assert list(sorter) == [('a', '3'), ('b', '1'), ('c', '2'), ('d', '1')]
+    sorter.close()
+
+
+@pytest.fixture
+def datadir(tmp_path):
+    writer = DataDirWriter(tmp_path / 'data', run_size=2)
+    for utterance_id, speaker_id, text, recording_id in [
+        ('s2-r2-U0000001', 's2', 'два', 'r2'),
+        ('s1-r1-U0000002', 's1', 'один два', 'r1'),
+        ('s1-r1-U0000001', 's1', 'старий', 'r1'),
+        ('s1-r1-U0000001', 's1', 'один', 'r1'),  # added again, the last one is kept
+        ('s2-r1-U0000003', 's2', 'три', 'r1'),
+    ]:
+        writer.add(utterance_id, speaker_id, text, recording_id, f'/audio/{recording_id}.wav', 1.5, 2.5)
+    writer.close()
+    return tmp_path / 'data'
+
+
+def test_written_files(datadir):
+    assert (datadir / 'text').read_text() == ('s1-r1-U0000001 один\n'
+                                              's1-r1-U0000002 один два\n'
+                                              's2-r1-U0000003 три\n'
+                                              's2-r2-U0000001 два\n')
+    assert (datadir / 'spk2utt').read_text() == ('s1 s1-r1-U0000001 s1-r1-U0000002\n'
+                                                 's2 s2-r1-U0000003 s2-r2-U0000001\n')
+    assert (datadir / 'wav.scp').read_text() == 'r1 /audio/r1.wav\nr2 /audio/r2.wav\n'
+    assert (datadir / 'segments').read_text().splitlines()[0] == 's1-r1-U0000001 r1 1.5 2.5'
+    validate_data_dir(datadir)
+
+
+def rewrite(path, replace):
+    path.write_bytes(replace(path.read_bytes()))
+
+
+@pytest.mark.parametrize('filename, replace, error', [
+    ('utt2spk', lambda data: b''.join(reversed(data.splitlines(keepends=True))), 'not sorted'),
+    ('utt2spk', lambda data: data.splitlines(keepends=True)[0] + data, 'not unique'),
+    ('text', lambda data: data.replace(b'\n', b'\r\n'), 'DOS line endings'),
+    ('segments', lambda data: data.replace(b'1.5 2.5', b'2.5 2.5', 1), 'bad line'),
+    ('wav.scp', lambda data: data.replace(b'r2 ', b'r3 '), 'recording-ids'),
+    ('spk2utt', lambda data: data.replace(b' s2-r2-U0000001', b''), 'do not seem to match'),
+])
+def test_invalid_data_dir(datadir, filename, replace, error):
+    rewrite(datadir / filename, replace)
+    with pytest.raises(ValueError, match=error):
+        validate_data_dir(datadir)
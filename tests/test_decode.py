@@ -0,0 +1,60 @@
+"""
+A DecoderPool decodes in the order of its tasks, with the weights of every task.
+"""
+
+import numpy as np
+import pytest
+
+from uk1e2.eval.decode import DecoderPool
+
+
+LABELS = ['', ' ', 'а', 'б', 'в']
+
+
+class WeightsDecoder:
+    "stands in for pyctcdecode: the text is the weights it was reset to and the best label of the first frame"
+
+    def reset_params(self, alpha, beta):
+        self.alpha, self.beta = alpha, beta
+
+    def decode(self, log_probs, beam_width):
+        return f'{self.alpha} {self.beta} {LABELS[int(log_probs[0].argmax())]}'
+
+
+def one_hot(labels):
+    return [np.eye(len(LABELS), dtype=np.float32)[[LABELS.index(label)] * 3] for label in labels]
+
+
+def test_decode_keeps_order_and_weights():
+    with DecoderPool(WeightsDecoder(), 2, alpha=0.5, beta=1.5) as pool:
+        assert pool.decode(one_hot('абвба')) == ['0.5 1.5 а', '0.5 1.5 б', '0.5 1.5 в', '0.5 1.5 б', '0.5 1.5 а']
+        assert pool.decode(one_hot('аб'), alpha=0.1, beta=0.2) == ['0.1 0.2 а', '0.1 0.2 б']
+
+
+def test_search_slices_the_grid():
+    # a target is what every decoder gives with alpha=0.7 and beta=1.0
+    log_probs = one_hot('абв')
+    targets = ['0.7 1.0 а', '0.7 1.0 б', '0.7 1.0 в']
+    with DecoderPool(WeightsDecoder(), 2, log_probs=log_probs) as pool:
+        grid = pool.search(targets, [0.3, 0.7], [0.5, 1.0])
+    assert [(alpha, beta) for alpha, beta, _ in grid] == [(0.3, 0.5), (0.3, 1.0), (0.7, 0.5), (0.7, 1.0)]
+    assert [wer for _, _, wer in grid] == [2 / 3, 1 / 3, 1 / 3, 0.]
+
+
+def test_same_texts_as_pyctcdecode():
+    pyctcdecode = pytest.importorskip('pyctcdecode')
+    decoder = pyctcdecode.build_ctcdecoder(LABELS)
+    rng = np.random.default_rng(0)
+    log_probs = [np.log(rng.dirichlet(np.ones(len(LABELS)) * 0.3, size=rng.integers(1, 30))).astype(np.float32)
+                 for _ in range(20)]
+    expected = [decoder.decode(lp, beam_width=8) for lp in log_probs]
+    with DecoderPool(decoder, 3) as pool:
+        assert pool.decode(log_probs, beam_width=8) == expected
+
+
+def test_terminate_on_error():
+    with pytest.raises(KeyboardInterrupt):
+        with DecoderPool(WeightsDecoder(), 2) as pool:
+            raise KeyboardInterrupt
+    with pytest.raises(ValueError):
+        pool.decode(one_hot('а'))  # the pool is no longer running
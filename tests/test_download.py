@@ -0,0 +1,132 @@
+"""
+Downloads against a local http.server stand-in that speaks Range, or ignores it like some servers do.
+"""
+
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import re
+import shutil
+import threading
+
+import pytest
+
+from uk1e2 import download
+from uk1e2.download import Downloader, Record, fetch_url
+
+
+BODY = bytes(range(256)) * 4096  # 1 MiB
+
+
+class Handler(BaseHTTPRequestHandler):
+    def __init__(self, *args, honor_range=True, requests=None, **kwargs):
+        self.honor_range = honor_range
+        self.requests = requests
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if match and self.honor_range:
+            start = int(match.group(1))
+            if start >= len(BODY):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(BODY)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(BODY) - 1}/{len(BODY)}')
+        else:
+            start = 0
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        self.wfile.write(BODY[start:])
+
+
+def serve(honor_range):
+    requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(Handler, honor_range=honor_range, requests=requests))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, requests
+
+
+@pytest.fixture
+def server():
+    server, requests = serve(honor_range=True)
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+
+
+@pytest.fixture
+def no_range_server():
+    server, requests = serve(honor_range=False)
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+
+
+def test_fresh_download(server, tmp_path):
+    url, requests = server
+    target = tmp_path / 'a.mp3'
+    fetch_url(f'{url}/a.mp3', target)
+    assert target.read_bytes() == BODY
+    assert not (tmp_path / 'a.mp3.part').exists()
+    assert requests == [('/a.mp3', None)]
+
+
+def test_resume_part(server, tmp_path):
+    url, requests = server
+    target = tmp_path / 'a.mp3'
+    (tmp_path / 'a.mp3.part').write_bytes(BODY[:12345])
+    fetch_url(f'{url}/a.mp3', target)
+    assert target.read_bytes() == BODY
+    assert requests == [('/a.mp3', 'bytes=12345-')]
+
+
+def test_complete_part_416(server, tmp_path):
+    url, requests = server
+    target = tmp_path / 'a.mp3'
+    (tmp_path / 'a.mp3.part').write_bytes(BODY)
+    fetch_url(f'{url}/a.mp3', target)
+    assert target.read_bytes() == BODY
+    assert requests == [('/a.mp3', f'bytes={len(BODY)}-')]
+
+
+def test_server_ignores_range(no_range_server, tmp_path):
+    url, requests = no_range_server
+    target = tmp_path / 'a.mp3'
+    (tmp_path / 'a.mp3.part').write_bytes(b'stale bytes of an older file')
+    fetch_url(f'{url}/a.mp3', target)
+    assert target.read_bytes() == BODY  # rewritten from the start, not appended
+    assert requests == [('/a.mp3', 'bytes=28-')]
+
+
+def test_error_keeps_part(server, tmp_path, monkeypatch):
+    url, _ = server
+    monkeypatch.setattr(Handler, 'do_GET', lambda self: self.send_error(500))
+    (tmp_path / 'a.mp3.part').write_bytes(BODY[:10])
+    with pytest.raises(ConnectionError):
+        fetch_url(f'{url}/a.mp3', tmp_path / 'a.mp3')
+    assert (tmp_path / 'a.mp3.part').read_bytes() == BODY[:10]
+    assert not (tmp_path / 'a.mp3').exists()
+
+
+def test_downloader_fetches_a_path_once(server, tmp_path, monkeypatch):
+    url, requests = server
+    # stand in for ffmpeg
+    monkeypatch.setattr(download, 'to_wav', lambda src, dst: shutil.copyfile(src, dst))
+    records = [Record(f'{url}/news/{name}.mp3') for name in ('one', 'one', 'two')]
+    for record, source in zip(records, ('one', 'one', 'two')):
+        record.locate_(tmp_path, source, domain='news')
+    with Downloader(jobs=2) as downloader:
+        for record in records:
+            downloader.submit(record)
+        downloader.wait()
+    assert sorted(path for path, _ in requests) == ['/news/one.mp3', '/news/two.mp3']
+    for record in records:
+        assert Path(record.path).read_bytes() == BODY
@@ -0,0 +1,31 @@
+"""
+Merging result files of shards of an evaluation.
+"""
+
+import numpy as np
+import pytest
+
+from uk1e2.eval.evaluate import merge, shard_file
+from uk1e2.eval.store import AudioStoreWriter
+
+
+@pytest.fixture
+def shards(tmp_path):
+    with AudioStoreWriter(tmp_path / 'segment.audio') as writer:
+        for name in ('a', 'b', 'c'):
+            writer.add({'path': f'/data/{name}.wav', 'text': name}, np.zeros(10, dtype=np.float32))
+    save_to = tmp_path / 'results.txt'
+    shard_file(save_to, 0, 2).write_text('c|c|c|0.0|0.0\na|a|a|0.0|0.0\n')
+    shard_file(save_to, 1, 2).write_text('b|b|b|0.0|0.0\n')
+    return save_to
+
+
+def test_merge_in_dataset_order(shards, tmp_path):
+    assert merge(shards, 2, tmp_path / 'segment.audio') == 3
+    assert [line.split('|')[0] for line in shards.read_text().splitlines()] == ['a', 'b', 'c']
+
+
+def test_missing_dataset_is_an_error(shards, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        merge(shards, 2, tmp_path / 'missing.audio')
+    assert not shards.exists()
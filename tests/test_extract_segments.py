@@ -0,0 +1,35 @@
+"""
+Segments cut by the python engine are the bytes Kaldi's extract-segments writes.
+
+tests/data/extract_segments/segments has a segment whose start and end land on a different
+sample in single precision, one that runs to the end, a small overshoot that is truncated
+and segments that Kaldi skips: too far past the end, too short, starting after the end and
+ending before they start.
+"""
+
+from pathlib import Path
+import shutil
+
+import pytest
+
+from uk1e2.extract_segments import extract_segments
+
+
+DATA = Path(__file__).parent / 'data' / 'extract_segments'
+
+
+def run(tmp_path, engine):
+    wav_scp = tmp_path / 'source.scp'
+    wav_scp.write_text(f'rec {DATA / "rec.wav"}\n')
+    extract_segments(tmp_path / 'out', wav_scp, DATA / 'segments', engine=engine, jobs=1)
+    return {path.stem: path.read_bytes() for path in (tmp_path / 'out' / 'wav').glob('*.wav')}
+
+
+def test_python_engine_writes_expected_bytes(tmp_path):
+    expected = {path.stem: path.read_bytes() for path in (DATA / 'expected').glob('*.wav')}
+    assert run(tmp_path, 'python') == expected
+
+
+@pytest.mark.skipif(shutil.which('extract-segments') is None, reason='needs Kaldi on PATH')
+def test_same_bytes_as_kaldi(tmp_path):
+    assert run(tmp_path / 'python', 'python') == run(tmp_path / 'kaldi', 'kaldi')
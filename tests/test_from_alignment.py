@@ -0,0 +1,49 @@
+"""
+Record.from_alignment cuts committed news alignments into the same utterances as before.
+
+tests/data/from_alignment/sha256sums.tsv has the number of utterances and the sha256 of
+the JSON lines, with sorted keys, that the quadratic implementation made of every alignment
+in news/align. The utterances of a short alignment, the longest one and the two with the
+most words not found in the audio are there in full, to show what differs.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import pytest
+
+from uk1e2.download import Record
+
+
+DATA = Path(__file__).parent / 'data' / 'from_alignment'
+ALIGN = Path(__file__).parents[1] / 'news' / 'align'
+
+
+def utterances(id):
+    with open(ALIGN / f'{id}.json') as f:
+        ja = json.load(f)
+    r = Record(f'https://example.org/{id}.mp4', name=id, path=f'{id}.wav')
+    r.from_alignment(ja, recording_id=id, domain='news')
+    return [json.loads(u.to_json()) for u in r.utterances]
+
+
+def read_sums():
+    with open(DATA / 'sha256sums.tsv') as f:
+        return [line.rstrip('\n').split('\t') for line in f]
+
+
+def test_every_alignment_has_a_sum():
+    assert sorted(id for id, *_ in read_sums()) == sorted(path.stem for path in ALIGN.glob('*.json'))
+
+
+@pytest.mark.parametrize('id, count, digest', [pytest.param(*row, id=row[0]) for row in read_sums()])
+def test_same_utterances(id, count, digest):
+    found = utterances(id)
+    lines = ''.join(json.dumps(u, ensure_ascii=False, sort_keys=True) + '\n' for u in found)
+    assert (len(found), hashlib.sha256(lines.encode('utf-8')).hexdigest()) == (int(count), digest)
+
+
+@pytest.mark.parametrize('expected', sorted(DATA.glob('*.jsonl')), ids=lambda path: path.stem)
+def test_same_utterances_in_full(expected):
+    assert utterances(expected.stem) == [json.loads(line) for line in expected.read_text().splitlines()]
@@ -0,0 +1,68 @@
+"""
+Audio given to NeMo as padded arrays gives what asr_model.transcribe gives for temporary wav files.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from uk1e2.eval import frontend
+
+
+def speech(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.standard_normal(length) * 0.1).astype(np.float32) for length in lengths]
+
+
+def test_pad_batch():
+    batch = speech([3, 5, 1])
+    signal, lengths = frontend.pad_batch(batch)
+    assert signal.shape == (3, 5) and signal.dtype == torch.float32
+    assert lengths.tolist() == [3, 5, 1]
+    for row, s in zip(signal.numpy(), batch):
+        assert np.array_equal(row[:len(s)], s)
+        assert not row[len(s):].any()
+
+
+def test_pad_empty_batch():
+    signal, lengths = frontend.pad_batch([])
+    assert signal.shape == (0, 0) and lengths.shape == (0,)
+
+
+@pytest.fixture(scope='module')
+def asr_model():
+    pytest.importorskip('nemo.collections.asr')
+    torch.manual_seed(0)
+    return frontend.tiny_nemo_model()
+
+
+@pytest.fixture
+def wavs():
+    batch = speech([16_000, 9_000, 23_456])
+    # temporary wavs keep float32 samples, so both paths see the same audio
+    files = frontend.write_temp_wavs(batch)
+    yield batch, files
+    for f in files:
+        os.unlink(f)
+
+
+def test_same_as_transcribe(asr_model, wavs):
+    batch, files = wavs
+    expected = asr_model.transcribe(files, batch_size=len(files), verbose=False)
+    if isinstance(expected, tuple):  # NeMo 1.x returns best and all hypotheses
+        expected = expected[0]
+    expected = [getattr(hypothesis, 'text', hypothesis) for hypothesis in expected]
+    assert frontend.nemo_transcribe(asr_model, batch) == expected
+    assert frontend.nemo_decode(asr_model, frontend.nemo_log_probs(asr_model, batch)) == expected
+
+
+def test_same_log_probs_as_transcribe(asr_model, wavs):
+    batch, files = wavs
+    hypotheses = asr_model.transcribe(files, batch_size=len(files), return_hypotheses=True, verbose=False)
+    if isinstance(hypotheses, tuple):
+        hypotheses = hypotheses[0]
+    for log_probs, hypothesis in zip(frontend.nemo_log_probs(asr_model, batch), hypotheses):
+        np.testing.assert_allclose(log_probs, hypothesis.y_sequence.cpu().numpy(), rtol=1e-5, atol=1e-5)
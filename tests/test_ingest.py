@@ -0,0 +1,56 @@
+"""
+uk1e2.ingest builds the same databases as the jq and sqlite-utils recipes it replaced.
+"""
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from uk1e2.ingest import (SQLITE_UTILS_INDEX, SQLITE_UTILS_INTERMEDIATE, build_index, build_intermediate,
+                          dump)
+
+
+pytestmark = pytest.mark.skipif(not (shutil.which('jq') and shutil.which('sqlite-utils')),
+                                reason='needs jq and sqlite-utils')
+
+
+# jq prints whole floats as integers, so start was an INTEGER column
+LOCAL_UTTERANCES = [
+    {'id': 'S1-r1-U0000000-0000000-0000150', 'domain': 'news', 'text': 'Не «так», а так.',
+     'normalized_text': 'не так а так', 'start': 0.0, 'end': 1.5, 'speaker_id': 'S1'},
+    {'id': 'S1-r1-U0000001-0000200-0007500', 'domain': 'news', 'text': 'Слово',
+     'normalized_text': 'слово', 'start': 2.0, 'end': 75.0, 'speaker_id': 'S1'},
+    {'id': 'S2-r2-U0000000-0000000-0000042', 'domain': 'youtube', 'text': "м'ята не 'цитата'",
+     'normalized_text': "м'ята не цитата", 'start': 0, 'end': 0.42},
+]
+
+# the second source brings new columns, one of them empty in its first rows
+SOURCES = [
+    [{'text': 'перший не', 'start': 0.5, 'end': 1}, {'text': 'другий', 'start': 1, 'end': 2}],
+    [{'text': 'третій', 'duration': None, 'tags': ['a', 'б']}] * 120
+    + [{'text': 'не четвертий', 'duration': 1.25, 'speaker': 7}],
+]
+
+
+def write_jsonl(path, rows):
+    path.write_text(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+    return path
+
+
+def test_index(tmp_path):
+    local_utterances = write_jsonl(tmp_path / 'local_utterances.jsonl', LOCAL_UTTERANCES)
+    subprocess.run(SQLITE_UTILS_INDEX.format(local_utterances=local_utterances, output=tmp_path / 'old.db'),
+                   shell=True, check=True)
+    assert build_index(tmp_path / 'new.db', local_utterances) == len(LOCAL_UTTERANCES)
+    assert dump(tmp_path / 'new.db') == dump(tmp_path / 'old.db')
+
+
+def test_intermediate(tmp_path):
+    sources = [write_jsonl(tmp_path / f'source{i}.jsonl', rows) for i, rows in enumerate(SOURCES)]
+    subprocess.run(SQLITE_UTILS_INTERMEDIATE.format(first=sources[0], rest=' '.join(map(str, sources[1:])),
+                                                    output=tmp_path / 'old.db'),
+                   shell=True, check=True)
+    assert build_intermediate(tmp_path / 'new.db', sources) == sum(map(len, SOURCES))
+    assert dump(tmp_path / 'new.db') == dump(tmp_path / 'old.db')
@@ -0,0 +1,82 @@
+"""
+Logit stores keep float32 frames by default, start over for another model file or audio store
+and take in the stores of shards of a run.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from uk1e2.eval.logits import LogitStore, merge_logits, model_folder, open_logits
+
+
+FRAMES = np.linspace(-1, 1, 5 * 3, dtype=np.float32).reshape(5, 3) / 3
+
+
+@pytest.fixture
+def sources(tmp_path):
+    model = tmp_path / 'model.nemo'
+    model.write_bytes(b'weights')
+    dataset = tmp_path / 'segment.audio'
+    dataset.mkdir()
+    (dataset / 'meta.json').write_text('{}')
+    return model, dataset
+
+
+def stored(tmp_path, model, dataset):
+    with LogitStore(tmp_path / 'logits', str(model), dataset=dataset) as store:
+        ids = list(store.index)
+        if 'u1' not in store:
+            store.add('u1', FRAMES)
+        return ids, store.get('u1')
+
+
+def test_float32_by_default(tmp_path, sources):
+    _, frames = stored(tmp_path, *sources)
+    assert np.array_equal(frames, FRAMES)
+
+
+def test_same_source_is_reused(tmp_path, sources):
+    stored(tmp_path, *sources)
+    assert stored(tmp_path, *sources)[0] == ['u1']
+
+
+def test_changed_model_file_starts_over(tmp_path, sources):
+    model, dataset = sources
+    stored(tmp_path, *sources)
+    model.write_bytes(b'fine-tuned weights')
+    assert stored(tmp_path, *sources)[0] == []
+    assert stored(tmp_path, *sources)[0] == ['u1']
+
+
+def test_changed_dataset_starts_over(tmp_path, sources):
+    model, dataset = sources
+    stored(tmp_path, *sources)
+    stat = (dataset / 'meta.json').stat()
+    os.utime(dataset / 'meta.json', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert stored(tmp_path, *sources)[0] == []
+    assert stored(tmp_path, *sources)[0] == ['u1']
+
+
+def test_shards_read_and_merge_into_the_model_store(tmp_path, sources):
+    model, dataset = sources
+    folder = tmp_path / 'logits'
+    stored(tmp_path, *sources)
+    runs = []
+
+    def forward(speech):
+        runs.append(len(speech))
+        return [FRAMES * 2 for _ in speech]
+    for index in range(2):
+        with open_logits(folder, str(model), dataset=dataset, shard=(index, 2)) as store:
+            ids = ['u1', f'u{index + 2}']
+            frames = store.compute(ids, [None, None], forward)
+    assert runs == [1, 1]  # u1 is read from the store of the model
+    assert np.array_equal(frames[0], FRAMES)
+
+    assert merge_logits(folder, str(model), 2, dataset) == 2
+    assert not model_folder(folder, str(model), (0, 2)).exists()
+    with LogitStore(folder, str(model), dataset=dataset) as store:
+        assert sorted(store.index) == ['u1', 'u2', 'u3']
+        assert np.array_equal(store.get('u3'), FRAMES * 2)
@@ -0,0 +1,64 @@
+"""
+g2p_batch sends phonetisaurus only the words its cache has not seen with the same model and lexicon.
+"""
+
+import pytest
+
+from uk1e2 import phonetisaurus
+from uk1e2.phonetisaurus import PronunciationCache, g2p_batch
+
+
+PRONS = {'кіт': ['k i t'], 'йоулупуккі': ['j o u l u p u k k i', 'j o u l u p u k i']}
+
+
+@pytest.fixture
+def predicted(tmp_path, monkeypatch):
+    "stand-in for phonetisaurus that records the words it was asked about"
+    monkeypatch.chdir(tmp_path)
+    dict_dir = tmp_path / 'data' / 'local' / 'dict'
+    dict_dir.mkdir(parents=True)
+    (dict_dir / 'g2p.fst').write_bytes(b'model')
+    (dict_dir / 'uk_pron.v3.vcb').write_text('кіт k i t\n')
+    predicted = []
+
+    def predict(words, model, lexicon):
+        predicted.extend(words)
+        return {word: PRONS[word] for word in words if word in PRONS}
+
+    monkeypatch.setattr(phonetisaurus, 'predict', predict)
+    return predicted
+
+
+def expected(words):
+    return {word: dict.fromkeys(PRONS[word], True) for word in words if word in PRONS}
+
+
+def test_cache_hit(predicted):
+    words = ['кіт', 'йоулупуккі', 'ъ']
+    assert g2p_batch(words, jobs=2) == expected(words)
+    assert sorted(predicted) == sorted(words)
+
+    predicted.clear()
+    assert g2p_batch(words, jobs=2) == expected(words)
+    # a word without pronunciations is remembered too
+    assert predicted == []
+
+    assert g2p_batch(words + ['пес']) == expected(words)
+    assert predicted == ['пес']
+
+
+def test_model_change_misses(predicted, tmp_path):
+    words = ['кіт', 'йоулупуккі']
+    g2p_batch(words)
+    predicted.clear()
+    (tmp_path / 'data' / 'local' / 'dict' / 'g2p.fst').write_bytes(b'another model')
+    assert g2p_batch(words) == expected(words)
+    assert sorted(predicted) == sorted(words)
+
+
+def test_models_do_not_share_entries(tmp_path):
+    first = PronunciationCache(tmp_path / 'cache.sqlite', 'first')
+    first.save({'кіт': ['k i t'], 'ъ': []})
+    first.close()
+    assert PronunciationCache(tmp_path / 'cache.sqlite', 'second').load() == {}
+    assert PronunciationCache(tmp_path / 'cache.sqlite', 'first').load() == {'кіт': ['k i t'], 'ъ': []}
@@ -0,0 +1,78 @@
+"""
+uk1e2.pipeline writes the same bytes as the awk, jq and pandas recipes it replaced, on a few rows of the committed transcripts.
+"""
+
+import csv
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from uk1e2.pipeline import (MAKEFILE_UK1E2, MAKEFILE_YOUTUBE, _json_encode, add_urls, csv_utterances, pandas_json,
+                            transcript_rows, youtube_utterances, zip_normalized)
+
+
+ROOT = Path(__file__).parents[1]
+
+needs_recipes = pytest.mark.skipif(not shutil.which('jq'), reason='needs jq')
+
+
+def old(recipe: str, output: Path) -> bytes:
+    "run a former Makefile recipe from the root of the repository, where its scripts are"
+    pytest.importorskip('pandas')
+    subprocess.run(recipe, shell=True, check=True, cwd=ROOT)
+    return output.read_bytes()
+
+
+def new(lines) -> bytes:
+    return ''.join(f'{line}\n' for line in lines).encode()
+
+
+def test_transcript():
+    with open(ROOT / 'youtube2.txt', encoding='utf-8') as f:
+        assert new(transcript_rows(f, first_id=20000)) == (ROOT / 'youtube2.tsv').read_bytes()
+
+
+@needs_recipes
+@pytest.mark.parametrize('tsv, normalized, start, stop', [
+    ('youtube2.tsv', 'youtube2_normalized.csv', 0, 50),   # repeats to collapse
+    ('youtube1.tsv', 'youtube_normalized.csv', 300, 340),  # another video starts
+])
+def test_youtube(tmp_path, tsv, normalized, start, stop):
+    with open(ROOT / tsv, encoding='utf-8') as f:
+        lines = f.readlines()[start:stop]
+    (tmp_path / 'youtube.tsv').write_text(''.join(lines), encoding='utf-8')
+    ids = {u['utterance_id'] for u in youtube_utterances(tmp_path / 'youtube.tsv')}
+    with open(ROOT / normalized, newline='', encoding='utf-8') as f, \
+            open(tmp_path / 'normalized.csv', 'w', newline='', encoding='utf-8') as out:
+        rows = csv.reader(f)
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(next(rows))
+        writer.writerows(row for row in rows if int(row[3]) in ids)
+
+    expected = old(MAKEFILE_YOUTUBE.format(tsv=tmp_path / 'youtube.tsv', normalized=tmp_path / 'normalized.csv',
+                                           tmp=tmp_path, output=tmp_path / 'old.jsonl'),
+                   tmp_path / 'old.jsonl')
+    assert new(map(pandas_json, zip_normalized(youtube_utterances(tmp_path / 'youtube.tsv'),
+                                               tmp_path / 'normalized.csv'))) == expected
+
+
+@needs_recipes
+def test_uk1e2(tmp_path):
+    # the normalized file is a row short, so pandas pads it with a missing text
+    (tmp_path / 'uk1e2.csv').write_text(
+        'domain;source;utterance_id;start_time;speaker_id;text\n'
+        'uk1e2;a1;1;0:00:01;Ведучий;Добрий вечір.\n'
+        'uk1e2;a1;2;0:00:04;;"Так; і ні / може"\n'
+        'uk1e2;b2;3;0:01:00;NA;Шалом.\n', encoding='utf-8')
+    (tmp_path / 'normalized.csv').write_text(
+        'normalized_rowid;normalized_text\n'
+        '1;добрий вечір\n'
+        '2;так і ні може\n', encoding='utf-8')
+
+    expected = old(MAKEFILE_UK1E2.format(csv=tmp_path / 'uk1e2.csv', normalized=tmp_path / 'normalized.csv',
+                                         output=tmp_path / 'old.jsonl'),
+                   tmp_path / 'old.jsonl')
+    assert new(map(_json_encode, add_urls(csv_utterances(tmp_path / 'uk1e2.csv', tmp_path / 'normalized.csv')))) \
+        == expected
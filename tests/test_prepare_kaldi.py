@@ -0,0 +1,70 @@
+"""
+An incremental run over a data directory writes what a full run over the same utterances writes.
+"""
+
+import pytest
+
+datasets = pytest.importorskip('datasets')
+
+from uk1e2 import prepare_kaldi as module
+
+
+FILES = ['text', 'utt2spk', 'spk2utt', 'segments', 'wav.scp', 'lexicon.txt']
+
+
+def utterance(speaker, recording, number, text):
+    return {'id': f'{speaker}-{recording}-U{number:07d}-0000000-0000100', 'speaker_id': speaker,
+            'text': text, 'normalized_text': text, 'recording_path': f'/audio/{recording}.wav',
+            'start': float(number), 'end': float(number) + 1.}
+
+
+BEFORE = [
+    utterance('s1', 'r1', 1, 'добрий день'),
+    utterance('s1', 'r1', 2, 'як справи'),
+    utterance('s2', 'r2', 1, 'слава україні'),
+]
+AFTER = [
+    utterance('s1', 'r1', 1, 'добрий вечір'),  # changed
+    utterance('s2', 'r2', 1, 'слава україні'),  # the same
+    utterance('s2', 'r3', 4, 'героям слава'),  # new; s1-r1-U0000002 is gone
+]
+
+
+def verbalize_batch(batch, linguistic=False):
+    batch['words'] = [text.split() for text in batch['normalized_text']]
+    batch['unk'] = [[] for _ in batch['normalized_text']]
+    return batch
+
+
+@pytest.fixture
+def prepare(monkeypatch):
+    monkeypatch.setattr(module, 'verbalize_batch', verbalize_batch)
+    monkeypatch.setattr(module, 'g2p_batch', lambda lexicon: {word: [' '.join(word)] for word in lexicon if not lexicon[word]})
+
+    def dataset(rows):
+        return datasets.Dataset.from_list(rows).map(module.hash_batch, batched=True, load_from_cache_file=False)
+
+    def full(rows, datadir):
+        module.prepare(dataset(rows).map(verbalize_batch, batched=True, load_from_cache_file=False), datadir)
+
+    def incremental(rows, datadir):
+        module.prepare_incremental(dataset(rows), datadir, {'load_from_cache_file': False})
+    return full, incremental
+
+
+def test_incremental_same_as_full(tmp_path, prepare):
+    full, incremental = prepare
+    full(AFTER, tmp_path / 'full')
+    full(BEFORE, tmp_path / 'incremental')
+    incremental(AFTER, tmp_path / 'incremental')
+    for name in FILES:
+        assert (tmp_path / 'incremental' / name).read_text() == (tmp_path / 'full' / name).read_text(), name
+    assert 'вечір' in (tmp_path / 'incremental' / 'lexicon.txt').read_text()
+    module.validate_data_dir(tmp_path / 'incremental')
+
+
+def test_merge_scp(tmp_path):
+    path = tmp_path / 'text'
+    path.write_text('a 1\nb 2\nd 4\n')
+    module.merge_scp(path, {'b', 'd'}, {'c': '3', 'd': '5', 'e': '6'})
+    assert path.read_text() == 'a 1\nc 3\nd 5\ne 6\n'
@@ -0,0 +1,85 @@
+"""
+Result files written on a thread resume after a crash without duplicate ids and end up in dataset order.
+"""
+
+import time
+
+import pytest
+
+from uk1e2.eval.results import ResultWriter, skipped_file, written_ids
+
+
+ORDER = ['a', 'b', 'c', 'd']
+
+
+def format_lines(results):
+    for utterance_id, text, ok in zip(results['id'], results['text'], results.get('checked', [True] * len(results['id']))):
+        yield utterance_id, f'{utterance_id}|{text}|{text}|0.0|0.0\n' if ok else None
+
+
+def batch(*ids, checked=None):
+    results = {'id': list(ids), 'text': [f'text {utterance_id}' for utterance_id in ids]}
+    if checked is not None:
+        results['checked'] = checked
+    return results
+
+
+def test_torn_last_line_is_cut_off(tmp_path):
+    path = tmp_path / 'results.txt'
+    path.write_text('a|x|x|0.0|0.0\nb|x|x')
+    assert written_ids(path) == {'a'}
+    assert path.read_text() == 'a|x|x|0.0|0.0\n'
+
+
+def test_pending_skips_written_ids(tmp_path):
+    path = tmp_path / 'results.txt'
+    path.write_text('c|x|x|0.0|0.0\na|x|x|0.0|0.0\n')
+    with ResultWriter(path, format_lines, order=ORDER) as writer:
+        assert writer.pending().tolist() == [1, 3]
+
+
+def test_stopped_run_resumes_in_order(tmp_path):
+    path = tmp_path / 'results.txt'
+    with pytest.raises(KeyboardInterrupt):
+        with ResultWriter(path, format_lines, order=ORDER) as writer:
+            writer.put(batch('c', 'a'))
+            raise KeyboardInterrupt
+    assert [line.split('|')[0] for line in path.read_text().splitlines()] == ['c', 'a']  # not sorted yet
+
+    with ResultWriter(path, format_lines, order=ORDER) as writer:
+        pending = writer.pending()
+        writer.put(batch(*[ORDER[i] for i in pending]))
+    assert pending.tolist() == [1, 3]
+    assert path.read_text() == ''.join(f'{x}|text {x}|text {x}|0.0|0.0\n' for x in ORDER)
+
+
+def test_skipped_utterances_are_not_pending(tmp_path):
+    path = tmp_path / 'results.txt'
+    with ResultWriter(path, format_lines, order=ORDER) as writer:
+        writer.put(batch('a', 'b', checked=[True, False]))
+    assert [line.split('|')[0] for line in path.read_text().splitlines()] == ['a']
+    assert skipped_file(path).read_text() == 'b\n'
+    with ResultWriter(path, format_lines, order=ORDER) as writer:
+        assert writer.pending().tolist() == [2, 3]
+
+
+def failing(results):
+    raise ValueError('bad batch')
+
+
+def test_format_error_surfaces_from_put(tmp_path):
+    writer = ResultWriter(tmp_path / 'results.txt', failing, order=ORDER)
+    writer.put(batch('a'))
+    while writer.error is None:
+        time.sleep(0.01)
+    with pytest.raises(ValueError, match='bad batch'):
+        writer.put(batch('b'))
+    with pytest.raises(ValueError, match='bad batch'):
+        writer.close()
+
+
+def test_format_error_surfaces_from_close(tmp_path):
+    writer = ResultWriter(tmp_path / 'results.txt', failing, order=ORDER)
+    writer.put(batch('a'))
+    with pytest.raises(ValueError, match='bad batch'):
+        writer.close()
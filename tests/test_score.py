@@ -0,0 +1,57 @@
+"""
+Batched edit distances count what the line by line port of Kaldi's LevenshteinEditDistance counts.
+"""
+
+import numpy as np
+import pytest
+
+from uk1e2.eval.score import Report, edit_distances, edit_stats, kaldi_edit_distance, score
+
+
+def random_pairs(seed, count=150, max_length=150, vocabulary=6):
+    "pairs of every length from empty to past two 64-token words, from a small vocabulary so tokens repeat"
+    rng = np.random.default_rng(seed)
+    refs, hyps = [], []
+    for _ in range(count):
+        ref = rng.integers(0, vocabulary, rng.integers(0, max_length)).astype(np.int32)
+        if rng.random() < 0.5:  # a hypothesis with a few edits of the reference
+            hyp = ref.copy()
+            for _ in range(rng.integers(0, 10)):
+                position = rng.integers(0, len(hyp) + 1)
+                edit = rng.integers(0, 3)
+                if edit == 0:
+                    hyp = np.insert(hyp, position, rng.integers(0, vocabulary))
+                elif position < len(hyp):
+                    hyp = np.delete(hyp, position) if edit == 1 else np.where(np.arange(len(hyp)) == position, vocabulary, hyp)
+        else:
+            hyp = rng.integers(0, vocabulary, rng.integers(0, max_length))
+        refs.append(ref)
+        hyps.append(hyp.astype(np.int32))
+    refs += [np.zeros(0, dtype=np.int32), np.arange(70, dtype=np.int32), np.zeros(0, dtype=np.int32)]
+    hyps += [np.arange(3, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)]
+    return refs, hyps
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_same_as_kaldi(seed):
+    refs, hyps = random_pairs(seed)
+    expected = np.array([kaldi_edit_distance(ref, hyp) for ref, hyp in zip(refs, hyps)]).T
+    assert np.array_equal(edit_stats(refs, hyps, batch_size=37), expected)
+    assert np.array_equal(edit_distances(refs, hyps, batch_size=37), expected[0])
+
+
+def test_report():
+    ref = [('u1', ['a', 'b', 'c']), ('u2', ['d']), ('u3', ['x'])]
+    report, ids, stats = score(ref, {'u1': ['a', 'x', 'c', 'e'], 'u2': ['d']})
+    assert ids == ['u1', 'u2']
+    assert stats.T.tolist() == [[2, 1, 0, 1], [0, 0, 0, 0]]
+    assert str(report) == ('%WER 50.00 [ 2 / 4, 1 ins, 0 del, 1 sub ] [PARTIAL]\n'
+                           '%SER 50.00 [ 1 / 2 ]\n'
+                           'Scored 2 sentences, 1 not present in hyp.\n')
+
+
+def test_report_of_no_words():
+    # 0 / 0 is printed as glibc prints the NaN of x86
+    assert str(Report()) == ('%WER -nan [ 0 / 0, 0 ins, 0 del, 0 sub ]\n'
+                             '%SER -nan [ 0 / 0 ]\n'
+                             'Scored 0 sentences, 0 not present in hyp.\n')
@@ -0,0 +1,32 @@
+"""
+Alignments segmented in a pool of processes give the records of segmenting them one by one.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from uk1e2.download import Corpus, Record
+
+
+ALIGN = Path(__file__).parents[1] / 'news' / 'align'
+
+
+def records():
+    return [(path.stem, Record(f'https://example.org/{path.stem}.mp4', name=path.stem, path=f'{path.stem}.wav'), str(path))
+            for path in sorted(ALIGN.glob('*.json'))[:24]]
+
+
+def segmented(segment_jobs, ordered=True):
+    corpus = Corpus(Path('.'))
+    corpus.segment_jobs = segment_jobs
+    return [(r.name, [u.to_json() for u in r.utterances])
+            for r in corpus.segment_records(records(), 'news', ordered=ordered)]
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_pool_same_as_serial(ordered):
+    serial = segmented(1)
+    parallel = segmented(2, ordered=ordered)
+    assert (parallel if ordered else sorted(parallel)) == serial
+    assert sum(len(utterances) for _, utterances in serial) > 24
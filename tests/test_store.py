@@ -0,0 +1,38 @@
+"""
+An audio store is complete only when its writer finished without an error.
+"""
+
+import numpy as np
+import pytest
+
+from uk1e2.eval.store import AudioStore, AudioStoreWriter
+
+
+def write(folder, texts, fail=False):
+    with AudioStoreWriter(folder) as writer:
+        for i, text in enumerate(texts):
+            writer.add({'text': text}, np.full(100 * (i + 1), 0.5, dtype=np.float32))
+        if fail:
+            raise RuntimeError('decoding failed')
+
+
+def test_complete_store(tmp_path):
+    write(tmp_path / 'store', ['a', 'b'])
+    store = AudioStore(tmp_path / 'store')
+    assert [row['text'] for row in store.rows] == ['a', 'b']
+    assert np.array_equal(store.speech(1), np.full(200, 0.5, dtype=np.float32))
+
+
+def test_failed_writer_leaves_incomplete_store(tmp_path):
+    with pytest.raises(RuntimeError, match='decoding failed'):
+        write(tmp_path / 'store', ['a', 'b'], fail=True)
+    with pytest.raises(FileNotFoundError, match='not a complete audio store'):
+        AudioStore(tmp_path / 'store')
+
+
+def test_failed_rewrite_invalidates_old_store(tmp_path):
+    write(tmp_path / 'store', ['a', 'b'])
+    with pytest.raises(RuntimeError, match='decoding failed'):
+        write(tmp_path / 'store', ['c'], fail=True)
+    with pytest.raises(FileNotFoundError, match='not a complete audio store'):
+        AudioStore(tmp_path / 'store')
@@ -0,0 +1,67 @@
+"""
+UtteranceTable writes the same rows as the Utterance objects it was filled from.
+"""
+
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from uk1e2.download import Record, Utterance
+from uk1e2.table import COLUMNS, UtteranceTable
+
+
+ALIGN = Path(__file__).parents[1] / 'news' / 'align'
+
+
+def aligned_utterances(count=3):
+    utterances = []
+    for filename in sorted(ALIGN.glob('*.json'))[:count]:
+        id = filename.stem
+        with open(filename) as f:
+            ja = json.load(f)
+        r = Record(f'https://example.org/{id}.mp4', name=id, path=f'{id}.wav')
+        r.from_alignment(ja, recording_id=id, domain='news')
+        utterances.extend(r.utterances)
+    return utterances
+
+
+@pytest.fixture(scope='module')
+def utterances():
+    utterances = aligned_utterances()
+    for u in utterances:
+        u.utterance_url = f'{u.utterance_url}?start={u.start}&end={u.end}'
+    utterances.append(Utterance(recording_id='r1', text='«Лапки» і \\ слеш', normalized_text='лапки і слеш',
+                                start=0.5, end=1.25, speaker_id='', utterance_id='U0000000', domain='',
+                                source='r1', utterance_url='https://example.org/r1.wav?start=0.5&end=1.25',
+                                recording_path='r1.wav'))
+    return utterances
+
+
+@pytest.fixture(scope='module')
+def table(utterances):
+    table = UtteranceTable()
+    table.extend(utterances)
+    return table
+
+
+def test_jsonl(utterances, table):
+    f = io.StringIO()
+    table.to_jsonl(f)
+    assert len(table) == len(utterances)
+    assert f.getvalue() == ''.join(u.to_json() + '\n' for u in utterances)
+
+
+def test_urls_are_not_pooled(utterances, table):
+    urls = {u.utterance_url for u in utterances}
+    assert len(urls) == len(utterances)
+    assert not urls & set(table.pool.strings)
+
+
+def test_arrow(utterances, table):
+    pytest.importorskip('pyarrow')
+    columns = table.to_arrow().to_pydict()
+    assert list(columns) == list(COLUMNS)
+    assert [dict(zip(columns, row)) for row in zip(*columns.values())] == \
+        [json.loads(u.to_json()) for u in utterances]
@@ -0,0 +1,37 @@
+"""
+normalize_batch gives the same texts as keep_useful_characters(ftfy.fix_text(text)) one text at a time.
+"""
+
+from pathlib import Path
+
+import ftfy
+import pytest
+
+from uk1e2.tokenize_text import keep_useful_characters, normalize_batch, read_texts
+
+
+ROOT = Path(__file__).parents[1]
+
+
+def reference(texts):
+    return [keep_useful_characters(ftfy.fix_text(text)) for text in texts]
+
+
+@pytest.mark.parametrize('filename', ['youtube1.tsv', 'youtube2.tsv', 'news/text.jsonl'])
+def test_committed_transcripts(filename):
+    texts = read_texts(str(ROOT / filename))
+    assert normalize_batch(texts) == reference(texts)
+
+
+def test_quotes_and_accents():
+    texts = [
+        "Пам’ять, м`ята і ՚ще",
+        'ЇЖАК Ёлка Ѓ ѐ й Й',
+        'Café déjà vu, naïve',
+        'за́мок — замо́к',
+        '—\'-«Так»-\'',
+        'ÐŸÑ€Ð¸Ð²Ñ–Ñ‚',
+        '&amp; \x00 ',
+        '',
+    ]
+    assert normalize_batch(texts) == reference(texts)
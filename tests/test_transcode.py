@@ -0,0 +1,99 @@
+"""
+Transcoder decodes a source again only when its contents or its output changed.
+"""
+
+import json
+import os
+
+import pytest
+
+from uk1e2 import transcode
+from uk1e2.transcode import MANIFEST, Transcoder
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    "stand-in for ffmpeg that copies the source and records what it decoded"
+    decoded = []
+
+    def to_wav(v, a):
+        decoded.append(v.name)
+        a.write_bytes(v.read_bytes())
+
+    monkeypatch.setattr(transcode, 'to_wav', to_wav)
+    return decoded
+
+
+@pytest.fixture
+def sources(tmp_path):
+    sources = []
+    for name, body in [('a', b'first'), ('b', b'second')]:
+        path = tmp_path / f'{name}.webm'
+        path.write_bytes(body)
+        sources.append((name, path))
+    return sources
+
+
+def run(tmp_path, sources, decoded):
+    "decode in a fresh Transcoder, as a new process would, and return what it decoded"
+    decoded.clear()
+    wavscp = Transcoder(tmp_path / 'wav', jobs=2).run(sources)
+    assert all(wavscp[id].read_bytes() == source.read_bytes() for id, source in sources)
+    return sorted(decoded)
+
+
+def manifest(tmp_path):
+    return json.loads((tmp_path / 'wav' / MANIFEST).read_text())
+
+
+def test_unchanged_sources_are_skipped(tmp_path, sources, decoded, monkeypatch):
+    saves = []
+    monkeypatch.setattr(Transcoder, 'save', lambda self, save=Transcoder.save: saves.append(save(self)))
+    assert run(tmp_path, sources, decoded) == ['a.webm', 'b.webm']
+    assert len(saves) == 1
+    assert sorted(manifest(tmp_path)) == ['a.wav', 'b.wav']
+    assert run(tmp_path, sources, decoded) == []
+
+
+def test_touched_source_is_skipped_and_recorded(tmp_path, sources, decoded):
+    run(tmp_path, sources, decoded)
+    _, a = sources[0]
+    stat = a.stat()
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run(tmp_path, sources, decoded) == []
+    assert manifest(tmp_path)['a.wav']['mtime_ns'] == stat.st_mtime_ns + 10**9
+
+
+def test_changed_source_is_decoded_again(tmp_path, sources, decoded):
+    run(tmp_path, sources, decoded)
+    _, a = sources[0]
+    stat = a.stat()
+    a.write_bytes(b'FIRST')
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run(tmp_path, sources, decoded) == ['a.webm']
+
+
+def test_missing_output_is_decoded_again(tmp_path, sources, decoded):
+    run(tmp_path, sources, decoded)
+    (tmp_path / 'wav' / 'b.wav').unlink()
+    assert run(tmp_path, sources, decoded) == ['b.webm']
+
+
+def test_other_source_is_decoded(tmp_path, sources, decoded):
+    run(tmp_path, sources, decoded)
+    c = tmp_path / 'c.webm'
+    c.write_bytes(b'first')
+    assert run(tmp_path, [('a', c), sources[1]], decoded) == ['c.webm']
+
+
+def test_failed_run_keeps_finished_outputs(tmp_path, sources, decoded, monkeypatch):
+    def to_wav(v, a):
+        if v.name == 'b.webm':
+            raise RuntimeError('ffmpeg failed')
+        decoded.append(v.name)
+        a.write_bytes(v.read_bytes())
+
+    monkeypatch.setattr(transcode, 'to_wav', to_wav)
+    with pytest.raises(RuntimeError):
+        Transcoder(tmp_path / 'wav', jobs=1).run(sources)
+    assert list(manifest(tmp_path)) == ['a.wav']
@@ -0,0 +1,155 @@
+"""
+Content-addressed cache of downloaded media that can be shared between runs and checkouts.
+
+    <root>/objects/ab/abcdef...  media files named by sha256 of their content
+    <root>/partial/              downloads in progress, resumed after a crash
+    <root>/index.json            url -> etag, size, sha256 and last use of its content
+
+The same content fetched from different urls is stored once. When the cache grows
+over its size limit, the least recently used objects are evicted.
+"""
+
+from contextlib import suppress
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+import requests
+
+from .transcode import sha256sum
+
+
+class MediaCache:
+    def __init__(self, root: Path, max_bytes: int = 0, verify: bool = False, revalidate: bool = False):
+        """
+        max_bytes of 0 means unbounded, verify rehashes objects on every hit.
+
+        Without revalidate a cached url is trusted and no network requests are made;
+        with revalidate its ETag and Content-Length are checked with a HEAD request first.
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.revalidate = revalidate
+        (self.root / 'objects').mkdir(parents=True, exist_ok=True)
+        (self.root / 'partial').mkdir(exist_ok=True)
+        self.index_path = self.root / 'index.json'
+        self.lock_path = self.root / 'index.lock'
+        self.thread_lock = threading.Lock()
+
+    def object_path(self, digest: str) -> Path:
+        return self.root / 'objects' / digest[:2] / digest
+
+    def _read_index(self) -> Dict[str, Dict]:
+        if self.index_path.exists():
+            return json.loads(self.index_path.read_text())
+        return {}
+
+    def _write_index(self, index: Dict[str, Dict]):
+        tmp = self.index_path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(index, indent=1))
+        os.replace(tmp, self.index_path)
+
+    def _update_index(self, update: Callable[[Dict[str, Dict]], None]):
+        "read-modify-write the index, excluding other threads and processes sharing the cache"
+        with self.thread_lock, open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            update(index)
+            self._write_index(index)
+
+    def lookup(self, url: str, etag: Optional[str] = None, size: Optional[int] = None) -> Optional[Path]:
+        "path of a valid cached object for url; etag and size, when known on both sides, must match too"
+        entry = self._read_index().get(url)
+        if entry is None:
+            return None
+        # a server that sent no ETag when the url was cached only has its size to compare
+        if (etag is not None and entry['etag'] is not None and entry['etag'] != etag) or \
+                (size is not None and entry['size'] != size):
+            return None
+        path = self.object_path(entry['sha256'])
+        if not path.exists() or path.stat().st_size != entry['size']:
+            logger.warning('cache object for {} is missing or truncated', url)
+            return None
+        if self.verify and sha256sum(path) != entry['sha256']:
+            logger.warning('cache object for {} is corrupted', url)
+            path.unlink()
+            return None
+
+        def touch(index):
+            if url in index:
+                index[url]['atime'] = time.time()
+                if etag is not None:
+                    index[url]['etag'] = etag
+        self._update_index(touch)
+        return path
+
+    def insert(self, url: str, path: Path, etag: Optional[str] = None) -> Path:
+        "move a completely downloaded file into the cache"
+        digest = sha256sum(path)
+        size = path.stat().st_size
+        target = self.object_path(digest)
+        target.parent.mkdir(exist_ok=True)
+        if target.exists() and target.stat().st_size == size:
+            path.unlink()  # same content is already cached under another url
+        else:
+            os.replace(path, target)
+
+        def add(index):
+            index[url] = {'sha256': digest, 'size': size, 'etag': etag, 'atime': time.time()}
+            self._evict(index, keep=digest)
+        self._update_index(add)
+        return target
+
+    def _evict(self, index: Dict[str, Dict], keep: str):
+        if not self.max_bytes:
+            return
+        objects = {}  # sha256 -> (last use, size)
+        for entry in index.values():
+            atime, _ = objects.get(entry['sha256'], (0., 0))
+            objects[entry['sha256']] = (max(atime, entry['atime']), entry['size'])
+        total = sum(size for _, size in objects.values())
+        for digest, (_, size) in sorted(objects.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            logger.info('evicting {} ({} bytes) from the media cache', digest, size)
+            with suppress(FileNotFoundError):
+                self.object_path(digest).unlink()
+            for url in [url for url, entry in index.items() if entry['sha256'] == digest]:
+                del index[url]
+            total -= size
+
+    def fetch(self, url: str, target: Path, download: Callable[[Path], None], *, session=None, auth=None):
+        "place the content of url at target, calling download(path) only on a cache miss"
+        etag = size = None
+        if self.revalidate:
+            r = (session or requests).head(url, auth=auth, allow_redirects=True)
+            if r.ok:
+                etag = r.headers.get('ETag')
+                size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+
+        path = self.lookup(url, etag=etag, size=size)
+        if path is None:
+            partial = self.root / 'partial' / hashlib.sha256(url.encode('utf-8')).hexdigest()
+            download(partial)
+            path = self.insert(url, partial, etag=etag)
+        else:
+            logger.info('{} is cached as {}', url, path)
+
+        tmp = target.with_name(target.name + '.tmp')
+        with suppress(FileNotFoundError):
+            tmp.unlink()
+        try:
+            os.link(path, tmp)
+        except OSError:  # another filesystem
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
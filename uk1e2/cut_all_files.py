@@ -1,59 +1,130 @@
-import subprocess
+"""
+Cut every aligned news recording into segments using a pool of workers.
+
+    python -m uk1e2.cut_all_files --audio-dir news/webm -o segments
+
+A manifest in the output directory keeps hashes of the inputs of every finished
+recording, so that re-runs only cut recordings that are new or changed. Inputs
+are only hashed when their size or mtime differ from the manifest.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
 import json
 import os
-from os.path import exists
-
-FILES_PATH = './files'
-
-# load index
-with open('./uk1e2/news/index.json') as f:
-    index = json.loads(f.read())
-
-# iterate over rows
-for row in index['rows']:
-    id, channel, title, date, duration, file_url, type_url = row
-
-    json_metadata = f'./uk1e2/news/align/{id}.json'
-    if not exists(json_metadata):
-        continue
-
-    audio_local_filename = f'{FILES_PATH}/{id}.webm'
-    if not exists(audio_local_filename):
-        continue
-
-    # print(json_metadata)
-    # print(audio_local_filename)
-    # print('---')
-
-    segments_folder = f'segments/{id}'
-
-    if exists(segments_folder):
-        print(f'Already processed: {segments_folder}')
-        continue
-
-    os.makedirs(segments_folder)
-
-    bashCommand = ' '.join([
-        '/opt/miniconda3/bin/python',
-        '/Users/yehorsmoliakov/Work/irtc/cut-gentle-files/cutter_v3.py',
-        '-o',
-        segments_folder,
-        '-w',
-        audio_local_filename,
-        '-j',
-        json_metadata,
-    ])
-    process = subprocess.Popen(bashCommand.split(), stdout=subprocess.PIPE)
-    output, error = process.communicate()
-
-    if error:
-        print('*****')
-        print('ERRORR!!!!!1111')
-        print(error)
-        print('*****')
-    else:
-        print('FINISHED:')
-        print()
-        print(bashCommand)
-        # print(output)
-        print('---')
\ No newline at end of file
+from pathlib import Path
+import shutil
+import time
+
+from loguru import logger
+
+from .cutter import extract_segments, extract_segments_single_pass
+from .transcode import sha256sum
+
+
+MANIFEST = 'manifest.json'
+
+
+def file_stats(*paths: Path):
+    "size and mtime of files, to tell they have not changed without reading them"
+    return [[path.stat().st_size, path.stat().st_mtime_ns] for path in paths]
+
+
+def cut(segments_folder: Path, audio: Path, alignment: Path, single_pass: bool) -> float:
+    t0 = time.time()
+    if segments_folder.exists():
+        shutil.rmtree(segments_folder)
+    segments_folder.mkdir(parents=True)
+    # the cutter is chatty about every segment
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if single_pass:
+            extract_segments_single_pass(segments_folder, audio, alignment, jobs=1)
+        else:
+            extract_segments(segments_folder, audio, alignment)
+    return time.time() - t0
+
+
+def cut_all_files(index_path: Path, align_dir: Path, audio_dir: Path, output_dir: Path,
+                  jobs: int = os.cpu_count() or 1, single_pass: bool = False):
+    with open(index_path) as f:
+        index = json.load(f)
+
+    manifest_path = output_dir / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    def save_manifest():
+        tmp = manifest_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(manifest, indent=1))
+        os.replace(tmp, manifest_path)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs_by_id = {}
+    touched = False
+    for row in index['rows']:
+        id, channel, title, date, duration, file_url, type_url = row
+
+        alignment = align_dir / f'{id}.json'
+        audio = audio_dir / f'{id}.webm'
+        if not alignment.exists() or not audio.exists():
+            continue
+
+        segments_folder = output_dir / id
+        stats = file_stats(audio, alignment)
+        done = manifest.get(id) if segments_folder.exists() else None
+        if done is not None and done.get('stats') == stats:
+            logger.debug('already processed: {}', segments_folder)
+            continue
+        inputs = {'audio': sha256sum(audio), 'alignment': sha256sum(alignment)}
+        if done is not None and done['inputs'] == inputs:
+            # touched, but not changed
+            done['stats'] = stats
+            touched = True
+            continue
+
+        jobs_by_id[id] = (segments_folder, audio, alignment, inputs, stats, float(duration))
+
+    if touched:
+        save_manifest()
+
+    logger.info('cutting {} recordings with {} workers', len(jobs_by_id), jobs)
+
+    t0 = time.time()
+    audio_seconds = 0.
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(cut, segments_folder, audio, alignment, single_pass): id
+                   for id, (segments_folder, audio, alignment, *_) in jobs_by_id.items()}
+        for future in as_completed(futures):
+            id = futures[future]
+            segments_folder, audio, alignment, inputs, stats, duration = jobs_by_id[id]
+            try:
+                wall_time = future.result()
+            except Exception:
+                logger.exception('failed to cut {}', audio)
+                failed += 1
+                continue
+            audio_seconds += duration
+            manifest[id] = {'inputs': inputs, 'stats': stats, 'duration': duration, 'wall_time': round(wall_time, 3)}
+            save_manifest()
+            logger.info('finished {} ({:.1f}s of audio) in {:.2f}s', id, duration, wall_time)
+
+    t = time.time() - t0
+    logger.info('cut {} recordings ({:.2f}h of audio) in {:.1f}s: {:.4f} audio hours/sec, {} failed',
+                len(jobs_by_id) - failed, audio_seconds / 3600, t, audio_seconds / 3600 / t if t else 0., failed)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index', type=Path, default=Path('news/index.json'))
+    parser.add_argument('--align-dir', type=Path, default=Path('news/align'))
+    parser.add_argument('--audio-dir', type=Path, default=Path('news/webm'))
+    parser.add_argument('-o', '--output-dir', type=Path, default=Path('segments'))
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--single-pass', action='store_true', help='see uk1e2.cutter --single-pass')
+    args = parser.parse_args()
+
+    cut_all_files(args.index, args.align_dir, args.audio_dir, args.output_dir,
+                  jobs=args.jobs, single_pass=args.single_pass)
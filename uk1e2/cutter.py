@@ -12,11 +12,15 @@ pip install pydub==0.25.1
 
 
 
+from concurrent.futures import ThreadPoolExecutor
 import json
+import mmap
 from pprint import pprint
-from pydub import AudioSegment
 from pathlib import Path
 import os
+import subprocess
+import tempfile
+import wave
 def trim_tails(full_transcript, start_text_offset, end_text_offset, words):
 
     # find new start_text_offset
@@ -85,19 +89,8 @@ def trim_tails(full_transcript, start_text_offset, end_text_offset, words):
     return audio_part_trimmed
 
 
-def extract_segments(output_data_dir: Path, source_webm_file: Path, source_json_file: Path):
-    # Get file name
-    basename = os.path.basename(source_webm_file)
-    filename, _ = os.path.splitext(basename)
-
-    # Load the file
-    audio_file = AudioSegment.from_file(source_webm_file)
-    print(audio_file)
-
-    # Load the JSON metadata
-    with open(source_json_file) as x:
-        metadata = json.loads(x.read())
-        words = metadata['words']
+def find_audio_parts(metadata):
+    words = metadata['words']
 
     # Our container for audio parts
     audio_parts = []
@@ -167,34 +160,111 @@ def extract_segments(output_data_dir: Path, source_webm_file: Path, source_json_
                 full_transcript, start_text_offset, end_text_offset, words)
             audio_parts.append(audio_part_trimmed)
 
-    # We extract audio parts and save them into inpedendent files
-    for idx, audio_part in enumerate(audio_parts):
+    return audio_parts
+
+
+def load_audio_parts(output_data_dir: Path, source_webm_file: Path, source_json_file: Path):
+    # Get file name
+    basename = os.path.basename(source_webm_file)
+    filename, _ = os.path.splitext(basename)
+
+    # Load the JSON metadata
+    with open(source_json_file) as x:
+        metadata = json.loads(x.read())
+
+    audio_parts = []
+    for idx, audio_part in enumerate(find_audio_parts(metadata)):
         # Do not save empty transcripts
         if not audio_part['transcript_original']:
             continue
 
         # TODO: add skipping long segments (> 30s)
 
-        # get audio part from the original file
-        audio_segment = audio_file[audio_part['start_ms']: audio_part['end_ms']]
-
         # set filenames
         audio_part['save_as_audio'] = f"{output_data_dir}/{filename}_{idx}.wav"
         audio_part['save_as_txt'] = f"{output_data_dir}/{filename}_{idx}.txt"
+        audio_parts.append(audio_part)
+    return audio_parts
+
+
+def save_text(audio_part):
+    with open(audio_part['save_as_txt'], 'w') as x:
+        fixed_transcript = audio_part['transcript_original'].replace(
+            '\n', ' ')
+        x.write(fixed_transcript)
+    print()
+    print()
+    pprint(audio_part)
+    dur = audio_part['end'] - audio_part['start']
+    print(dur)
+
+
+def extract_segments(output_data_dir: Path, source_webm_file: Path, source_json_file: Path):
+    from pydub import AudioSegment
+
+    audio_parts = load_audio_parts(output_data_dir, source_webm_file, source_json_file)
+
+    # Load the file
+    audio_file = AudioSegment.from_file(source_webm_file)
+    print(audio_file)
+
+    # We extract audio parts and save them into inpedendent files
+    for audio_part in audio_parts:
+        # get audio part from the original file
+        audio_segment = audio_file[audio_part['start_ms']: audio_part['end_ms']]
 
         # save audio
         audio_segment.export(audio_part['save_as_audio'], format="wav")
 
         # save text
-        with open(audio_part['save_as_txt'], 'w') as x:
-            fixed_transcript = audio_part['transcript_original'].replace(
-                '\n', ' ')
-            x.write(fixed_transcript)
-        print()
-        print()
-        pprint(audio_part)
-        dur = audio_part['end'] - audio_part['start']
-        print(dur)
+        save_text(audio_part)
+
+
+SAMPLE_RATE = 16000
+
+
+def write_wav(path, frames: memoryview, sample_rate=SAMPLE_RATE):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(frames)
+
+
+def extract_segments_single_pass(output_data_dir: Path, source_webm_file: Path, source_json_file: Path, jobs=4):
+    """
+    Decode the source once into 16 kHz mono PCM and cut all segments out of a memory map.
+
+    Segments are written as slices of the mapped file, so memory use does not grow with
+    the recording length: pages are loaded as segments are written and can be reclaimed.
+    """
+    audio_parts = load_audio_parts(output_data_dir, source_webm_file, source_json_file)
+
+    with tempfile.NamedTemporaryFile(dir=output_data_dir, suffix='.pcm') as pcm:
+        subprocess.check_output(['ffmpeg', '-y', '-loglevel', 'quiet', '-i', str(source_webm_file), '-vn',
+                                 '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+                                 '--', pcm.name])
+        if os.path.getsize(pcm.name) == 0:
+            raise ValueError(f'no audio decoded from {source_webm_file}')
+
+        with mmap.mmap(pcm.fileno(), 0, access=mmap.ACCESS_READ) as audio, memoryview(audio) as buf:
+            samples = buf.cast('B')
+            per_ms = SAMPLE_RATE // 1000
+
+            def cut(audio_part):
+                start = int(audio_part['start_ms'] * per_ms) * 2
+                end = int(audio_part['end_ms'] * per_ms) * 2
+                with samples[start:end] as part:
+                    write_wav(audio_part['save_as_audio'], part)
+                return audio_part
+
+            # views are released even when a writer fails, or closing the map hides its error behind a BufferError
+            try:
+                with ThreadPoolExecutor(max_workers=jobs) as pool:
+                    for audio_part in pool.map(cut, audio_parts):
+                        save_text(audio_part)
+            finally:
+                samples.release()
 
 
 if __name__ == '__main__':
@@ -208,8 +278,15 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output-data-dir', type=Path)
     parser.add_argument('-w', '--source-webm-file', type=Path)
     parser.add_argument('-j', '--source-json-file', type=Path)
+    parser.add_argument('--single-pass', action='store_true',
+                        help='decode once to 16 kHz mono and cut all segments from a memory map')
+    parser.add_argument('--jobs', type=int, default=4, help='threads writing segments in --single-pass mode')
 
     args = parser.parse_args()
 
-    extract_segments(args.output_data_dir,
-                     args.source_webm_file, args.source_json_file)
+    if args.single_pass:
+        extract_segments_single_pass(args.output_data_dir,
+                                     args.source_webm_file, args.source_json_file, jobs=args.jobs)
+    else:
+        extract_segments(args.output_data_dir,
+                         args.source_webm_file, args.source_json_file)
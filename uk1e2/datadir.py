@@ -0,0 +1,229 @@
+"""
+Write and check Kaldi data directories in bounded memory.
+
+Entries are sorted externally: whenever a file accumulates enough entries,
+they are sorted and spilled to a temporary run on disk, and the runs
+are merged into the final file in a single k-way pass.
+
+    python -m uk1e2.datadir data/local
+"""
+
+import heapq
+from itertools import groupby
+from pathlib import Path
+import tempfile
+import unicodedata
+from typing import IO, Iterator, List, Tuple
+
+from loguru import logger
+
+
+RUN_SIZE = 1_000_000
+WRITE_BUFFER = 1024 * 1024
+
+
+class ExternalSorter:
+    "sort (key, value) pairs by key; when a key is added more than once, the last value wins"
+
+    def __init__(self, run_size: int = RUN_SIZE, tmpdir: Path = None):
+        self.run_size = run_size
+        self.tmpdir = tmpdir
+        self.entries: List[Tuple[str, int, str]] = []
+        self.runs: List[IO[str]] = []
+        self.seq = 0
+
+    def __len__(self):
+        return self.seq
+
+    def add(self, key: str, value: str):
+        self.entries.append((key, self.seq, value))
+        self.seq += 1
+        if len(self.entries) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        self.entries.sort()
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', dir=self.tmpdir, buffering=WRITE_BUFFER)
+        run.writelines(f'{key}\t{seq}\t{value}\n' for key, seq, value in self.entries)
+        self.runs.append(run)
+        self.entries = []
+
+    @staticmethod
+    def read_run(run) -> Iterator[Tuple[str, int, str]]:
+        for line in run:
+            key, seq, value = line.rstrip('\n').split('\t', 2)
+            yield key, int(seq), value
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        "sorted entries, merged from all runs"
+        self.entries.sort()
+        for run in self.runs:
+            run.seek(0)
+        merged = heapq.merge(*map(self.read_run, self.runs), iter(self.entries))
+        for key, entries in groupby(merged, key=lambda entry: entry[0]):
+            *_, (_, _, value) = entries
+            yield key, value
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs, self.entries = [], []
+
+
+def write_sorted(sorter: ExternalSorter, filename: Path):
+    with open(filename, 'w', buffering=WRITE_BUFFER) as f:
+        f.writelines(f'{key} {value}\n' for key, value in sorter)
+
+
+def write_spk2utt(utt2spk: ExternalSorter, filename: Path, run_size: int = RUN_SIZE):
+    "group utterances by speaker, both sorted, like utils/utt2spk_to_spk2utt.pl on a sorted utt2spk"
+    pairs = ExternalSorter(run_size=run_size)
+    for utterance_id, speaker_id in utt2spk:
+        pairs.add(f'{speaker_id} {utterance_id}', '')
+    with open(filename, 'w', buffering=WRITE_BUFFER) as f:
+        for speaker_id, group in groupby((key.split(' ', 1) for key, _ in pairs), key=lambda pair: pair[0]):
+            f.write(speaker_id)
+            f.writelines(f' {utterance_id}' for _, utterance_id in group)
+            f.write('\n')
+    pairs.close()
+
+
+class DataDirWriter:
+    "collect utterances in any order, write text, utt2spk, spk2utt, segments and wav.scp sorted"
+
+    def __init__(self, datadir: Path, run_size: int = RUN_SIZE):
+        self.datadir = datadir
+        self.run_size = run_size
+        self.text = ExternalSorter(run_size)
+        self.utt2spk = ExternalSorter(run_size)
+        self.segments = ExternalSorter(run_size)
+        self.wavscp = ExternalSorter(run_size)
+
+    def add(self, utterance_id: str, speaker_id: str, kaldi_text: str,
+            recording_id: str, recording_path: str, start: float, end: float):
+        self.text.add(utterance_id, kaldi_text)
+        self.utt2spk.add(utterance_id, speaker_id)
+        self.segments.add(utterance_id, f'{recording_id} {start} {end}')
+        self.wavscp.add(recording_id, recording_path)
+
+    def close(self):
+        self.datadir.mkdir(parents=True, exist_ok=True)
+        write_sorted(self.text, self.datadir / 'text')
+        write_sorted(self.utt2spk, self.datadir / 'utt2spk')
+        write_spk2utt(self.utt2spk, self.datadir / 'spk2utt', run_size=self.run_size)
+        write_sorted(self.wavscp, self.datadir / 'wav.scp')
+        if len(self.segments):
+            write_sorted(self.segments, self.datadir / 'segments')
+        for sorter in (self.text, self.utt2spk, self.segments, self.wavscp):
+            sorter.close()
+
+
+def read_lines(filename: Path) -> Iterator[List[str]]:
+    with open(filename, encoding='utf-8', newline='') as f:  # keep \r\n to find it
+        for line in f:
+            if line.endswith('\r\n'):
+                raise ValueError(f'{filename} has DOS line endings')
+            yield line.split()
+
+
+def check_sorted_and_uniq(filename: Path) -> Iterator[List[str]]:
+    "fields of every line, checking that first fields are sorted and unique"
+    previous = None
+    for fields in read_lines(filename):
+        if not fields:
+            raise ValueError(f'{filename} has an empty line')
+        if previous is not None and fields[0] <= previous:
+            what = 'not unique' if fields[0] == previous else 'not sorted'
+            raise ValueError(f'{filename} is {what}: {previous} is followed by {fields[0]}')
+        previous = fields[0]
+        yield fields
+
+
+def compare_keys(a: Path, b: Path, keys_a: Iterator[str], keys_b: Iterator[str]):
+    for key_a, key_b in zip(keys_a, keys_b):
+        if key_a != key_b:
+            raise ValueError(f'{a} and {b} have different utterance lists: {key_a} vs {key_b}')
+    rest_a, rest_b = next(keys_a, None), next(keys_b, None)
+    if rest_a is not None or rest_b is not None:
+        raise ValueError(f'{a} and {b} have different utterance lists: {rest_a} vs {rest_b}')
+
+
+def validate_text(fields: List[str], filename: Path) -> str:
+    for word in fields[1:]:
+        if any(unicodedata.category(c) in ('Cc', 'Cf') for c in word):
+            raise ValueError(f'{filename} has non-printable characters in {fields[0]}')
+    return fields[0]
+
+
+def validate_data_dir(datadir: Path):
+    """
+    Check the format rules of Kaldi's utils/validate_data_dir.sh --no-feats
+    in a single streaming pass over each file, raising ValueError on the first error.
+    """
+    utt2spk = datadir / 'utt2spk'
+    spk2utt = datadir / 'spk2utt'
+    text = datadir / 'text'
+    segments = datadir / 'segments'
+    wavscp = datadir / 'wav.scp'
+    for filename in (utt2spk, spk2utt, wavscp):
+        if not filename.exists():
+            raise ValueError(f'no such file {filename}')
+
+    def utt2spk_keys():
+        previous = None
+        for fields in check_sorted_and_uniq(utt2spk):
+            if len(fields) != 2:
+                raise ValueError(f'{utt2spk} has wrong format: {" ".join(fields)}')
+            if previous is not None and fields[::-1] < previous:
+                raise ValueError(f'{utt2spk} is not in sorted order when sorted first on speaker-id '
+                                 '(fix this by making speaker-ids prefixes of utt-ids)')
+            previous = fields[::-1]
+            yield fields
+
+    # spk2utt must be what utils/utt2spk_to_spk2utt.pl makes of utt2spk
+    expected = ((speaker_id, [utterance_id for utterance_id, _ in group])
+                for speaker_id, group in groupby(utt2spk_keys(), key=lambda fields: fields[1]))
+    speakers = 0
+    for fields, (speaker_id, utterance_ids) in zip(check_sorted_and_uniq(spk2utt), expected):
+        if fields[0] != speaker_id or fields[1:] != utterance_ids:
+            raise ValueError(f'{spk2utt} and {utt2spk} do not seem to match at speaker {fields[0]}')
+        speakers += 1
+    if next(expected, None) is not None or speakers != sum(1 for _ in read_lines(spk2utt)):
+        raise ValueError(f'{spk2utt} and {utt2spk} do not seem to match')
+    if speakers == 1:
+        logger.warning('{} has only one speaker, this may be a problem for cmvn', datadir)
+
+    def utterances():
+        return (fields[0] for fields in read_lines(utt2spk))
+
+    if text.exists():
+        compare_keys(utt2spk, text, utterances(),
+                     (validate_text(fields, text) for fields in check_sorted_and_uniq(text)))
+
+    recordings = set()
+    if segments.exists():
+        def segment_keys():
+            for fields in check_sorted_and_uniq(segments):
+                if len(fields) not in (4, 5) or float(fields[3]) <= float(fields[2]):
+                    raise ValueError(f'bad line in {segments}: {" ".join(fields)}')
+                recordings.add(fields[1])
+                yield fields[0]
+        compare_keys(utt2spk, segments, utterances(), segment_keys())
+        wav_recordings = {fields[0] for fields in check_sorted_and_uniq(wavscp)}
+        if recordings != wav_recordings:
+            difference = sorted(recordings ^ wav_recordings)[:5]
+            raise ValueError(f'recording-ids extracted from {segments} and {wavscp} differ, e.g. {difference}')
+    else:
+        compare_keys(utt2spk, wavscp, utterances(), (fields[0] for fields in check_sorted_and_uniq(wavscp)))
+
+    logger.info('{} is a valid data directory with {} speakers', datadir, speakers)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('datadir', type=Path, help='Kaldi data directory to validate')
+    args = parser.parse_args()
+
+    validate_data_dir(args.datadir)
@@ -1,7 +1,11 @@
 import argparse
-from dataclasses import dataclass, field, asdict
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields
 import csv
+import itertools
 import json
+import multiprocessing
 import os
 from pathlib import Path
 import requests
@@ -10,7 +14,11 @@ import sys
 
 import yt_dlp
 
-from typing import List, Dict, AnyStr, Iterable, Union
+from typing import List, Dict, AnyStr, Iterable, Tuple, Union
+
+from .cache import MediaCache
+from .table import UtteranceTable
+from .transcode import to_wav
 
 try:
     from .tokenize_text import Verbalizer
@@ -18,6 +26,23 @@ except Exception as e:
     print(f"WARNING: while importing: {e}", file=sys.stderr)
 
 
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def add_slots(cls):
+    "recreate a dataclass with __slots__, like dataclass(slots=True) does since Python 3.10"
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = tuple(f.name for f in fields(cls))
+    for name in cls_dict['__slots__']:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    slotted = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted.__qualname__ = cls.__qualname__
+    return slotted
+
+
+@add_slots
 @dataclass
 class Utterance:
     recording_id: str
@@ -34,6 +59,12 @@ class Utterance:
     recording_path: str
 
     def __post_init__(self):
+        # these repeat across utterances of a recording or a corpus: keep one copy of each
+        self.recording_id = sys.intern(self.recording_id)
+        self.speaker_id = sys.intern(self.speaker_id)
+        self.domain = sys.intern(self.domain)
+        self.source = sys.intern(self.source)
+        self.recording_path = sys.intern(self.recording_path)
         self.update_id()
         #s, e = self.start, self.end
         #self.id = f'{self.speaker_id}-{self.recording_id}-{self.utterance_id}-{int(s*100):07d}-{int(e*100):07d}'
@@ -44,6 +75,23 @@ class Utterance:
         
     def duration(self):
         return self.end - self.start
+
+    def to_json(self) -> str:
+        "same as json.dumps(asdict(self)) without recursive copying"
+        return _json_encode({
+            "recording_id": self.recording_id,
+            "id": self.id,
+            "text": self.text,
+            "normalized_text": self.normalized_text,
+            "start": self.start,
+            "end": self.end,
+            "speaker_id": self.speaker_id,
+            "utterance_id": self.utterance_id,
+            "domain": self.domain,
+            "source": self.source,
+            "utterance_url": self.utterance_url,
+            "recording_path": self.recording_path,
+        })
     
     def try_append(self, other: "Utterance"):
         if self.speaker_id != other.speaker_id or self.source != other.source or self.start < other.start:
@@ -72,7 +120,7 @@ class Record:
     name: str = ''
     path: str = ''
     utterances: List[Utterance] = field(default_factory=list)
-    stats = {}  # store here some optional stats
+    stats: Dict[str, int] = field(default_factory=dict)  # store here some optional stats
         
     def add_utterance(self, s: Utterance):
         self.utterances.append(s)
@@ -104,22 +152,32 @@ class Record:
         }[domain]
         return f'{domain_code}{x}'
 
-    def download_(self, root, source, *, domain, auth, audio_codec="wav"):
+    def locate_(self, root, source, *, domain, audio_codec="wav"):
+        "assign a recording id and a local audio path without touching the network"
         root = Path(root) if isinstance(root, str) else root
+        self.name = self.make_recording_id(source, domain)
+        if "youtu" in self.recording_url:
+            self.path = (root / (source + '.m4a')).with_suffix('.wav')
+        else:
+            self.path = root / (self.name + "." + audio_codec)
+
+    def fetch_(self, *, auth=None, session=None, cache=None):
+        "make sure audio for this record is present at self.path"
+        path = Path(self.path)
+        if "youtu" in self.recording_url:
+            if not path.exists():
+                m4a = path.with_suffix('.m4a')
+                if not m4a.exists():
+                    yt_dl(self.recording_url, path.parent)
+                to_wav(m4a, path)
+        else:
+            print(f"Downloading: {self.recording_url} --> {path}", file=sys.stderr)
+            download_file(self.recording_url, path, auth=auth, session=session, cache=cache)
+
+    def download_(self, root, source, *, domain, auth, audio_codec="wav", session=None):
         if self.name == "":  # a new record
-            self.name = self.make_recording_id(source, domain)
-            if "youtu" in self.recording_url:
-                self.path = root / (source + '.m4a')
-                wav = self.path.with_suffix('.wav')
-                if not wav.exists():
-                    if not self.path.exists():
-                        yt_dl(self.recording_url, root)
-                    to_wav(self.path, wav)
-                self.path = wav
-            else:
-                self.path = root / (self.name + "." + audio_codec)
-                print(f"Downloading: {self.recording_url} --> {self.path}", file=sys.stderr)
-                download_file(self.recording_url, self.path, auth=auth)
+            self.locate_(root, source, domain=domain, audio_codec=audio_codec)
+            self.fetch_(auth=auth, session=session)
 
         """{
   "transcript": "\nКатерина КЕЛЬБУС: == Україна хоче провести мирний саміт до кінця лютого, і зробити це планують в ООН"
@@ -162,8 +220,23 @@ class Record:
             text = " " + text[1:]
         words = ja.get("words", [])
         speaker_label_hyp_on = False  # TODO: try detect speaker labels by "==" marker even if some word(s) from the label aligned
+
+        # Word i is only ever modified during iteration i, so lookups around it can be
+        # answered from state kept in one pass: words before i are final, words after i
+        # are untouched, so forward lookups use next_start computed upfront.
+        next_start = self._next_start_indexes(words)
+        prev_aligned_word_index = -1  # last aligned word before i
+        utt_first_start_index = -1  # first word with a start time in the current utterance
+        utt_prev_aligned_word_index = -1  # last aligned word before the current utterance
+
         # for i, w in enumerate(words):
         for i in range(len(words) + 1):
+            if i > 0:
+                prev = words[i-1]
+                if "start" in prev and "end" in prev:
+                    prev_aligned_word_index = i - 1
+                if utt_start_index >= 0 and utt_first_start_index < 0 and "start" in prev:
+                    utt_first_start_index = i - 1
             w = words[i] if i < len(words) else None
             is_first_in_utt = False if i < len(words) else True
             is_last_in_utt = True if i + 1 >= len(words) else False
@@ -197,7 +270,7 @@ class Record:
                 else:
                     w["startOffset"] = next_word_start
                     w["word"] = text_segment
-                    start_time = self._get_start_time(words, i, i+20)
+                    start_time = self._get_start_time(words, next_start[i], prev_aligned_word_index)
                     if start_time is None:
                         print(f"    WARNING: None start_time for {i}-th {w}", file=sys.stderr)
                         continue
@@ -224,7 +297,6 @@ class Record:
 
             is_first_in_utt = True if i == 0 else is_first_in_utt  # needed to fix speakerless label
             
-            prev_aligned_word_index = self._get_prev_aligned_word_index(words, i)
             prev_aligned_word = words[prev_aligned_word_index] if prev_aligned_word_index >= 0 else None
             if w is not None and not("start" in w and "end" in w):
                 print(f" {i}/{len(words)-1} is not aligned: {w}", file=sys.stderr)
@@ -255,7 +327,13 @@ class Record:
                 if utt_start_index >= 0:
                     start_word = words[utt_start_index]
                     utt_stop_index = i if cur_speaker_name_start_index < 0 else cur_speaker_name_start_index
-                    start_time = self._get_start_time(words, utt_start_index, utt_stop_index)
+                    if utt_first_start_index >= 0:
+                        start_index = utt_first_start_index
+                    elif w is not None and "start" in w:
+                        start_index = i
+                    else:
+                        start_index = next_start[i+1] if i < len(words) else -1
+                    start_time = self._get_start_time(words, start_index, utt_prev_aligned_word_index)
                     if start_time is not None:
                         utt_text = self._subtext_by_json_words(text, words, utt_start_index, utt_stop_index, retain_skipped=True)
                         utt_word_sequence_text = self._subtext_by_json_words(text, words, utt_start_index, utt_stop_index, 
@@ -278,6 +356,8 @@ class Record:
                     else:
                         print(f"   WARNING: no start time in utterance between {utt_start_index}-th and {utt_stop_index}-th words - skipping it")
                 utt_start_index = i
+                utt_first_start_index = -1
+                utt_prev_aligned_word_index = prev_aligned_word_index
                 cur_min_pause = min_pause  # restore cur_min_pause
                 is_first_in_utt = False
             cur_end_time = cur_time
@@ -297,31 +377,26 @@ class Record:
         self.utterances = result
     
     @staticmethod
-    def _get_start_time(words: List[Dict], cur_index: int, stop_index: int) -> Union[Dict, None]:
-        i = cur_index
-        while i < len(words):  # TODO: stop_index
-            w = words[i]
-            if "start" in w:
-                return w["start"]
-            i += 1
-        # try previous
-        i = Record._get_prev_aligned_word_index(words, cur_index)
-        if i >= 0:
-            return words[i]["end"]
-        return None
-            
+    def _next_start_indexes(words: List[Dict]) -> List[int]:
+        "for every position, index of the first word at or after it that has a start time, or -1"
+        next_start = [-1] * (len(words) + 1)
+        for i in range(len(words) - 1, -1, -1):
+            next_start[i] = i if "start" in words[i] else next_start[i+1]
+        return next_start
+
     @staticmethod
-    def _get_prev_aligned_word_index(words: List[Dict], i: int) -> Union[Dict, None]:
-        while i > 0:
-            i -= 1
-            w = words[i]
-            if "start" in w and "end" in w:
-                return i
-        return -1
+    def _get_start_time(words: List[Dict], next_start_index: int, prev_aligned_word_index: int) -> Union[float, None]:
+        "start of the next word that has one, otherwise end of the previous aligned word"
+        if next_start_index >= 0:
+            return words[next_start_index]["start"]
+        if prev_aligned_word_index >= 0:
+            return words[prev_aligned_word_index]["end"]
+        return None
     
     @staticmethod
     def _subtext_by_json_words(text: str, words: List[Dict], start: int, stop: int, *, retain_skipped=False, keep_decoration=True):
-        result = ""
+        result = []
+        last_char = ""
         for i in range(max(start, 0), stop):
             if len(words) <= i:
                 print(f"WARNING: index {i} <= {stop} is beyond word count", file=sys.stderr)
@@ -343,10 +418,13 @@ class Record:
                 t = "" if t=="<unk>" else t
                 if not t and "word" in w:
                     t = w["word"]
-            if result and not result.endswith(" "):
-                result += " "
-            result += t
-        return result
+            if last_char and last_char != " ":
+                result.append(" ")
+                last_char = " "
+            if t:
+                result.append(t)
+                last_char = t[-1]
+        return "".join(result)
             
     
     @staticmethod
@@ -362,31 +440,80 @@ class Record:
         return False if i >= 0 else True
 
 
+class Downloader:
+    """
+    Fetch recordings with a bounded pool of workers sharing one HTTP connection pool.
+
+    Every unique local path is fetched once. Transcoding runs inside the workers,
+    so ffmpeg for one recording overlaps with downloads of the others.
+    """
+    def __init__(self, jobs: int = 8, auth=None, cache: MediaCache = None):
+        self.auth = auth
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.futures: Dict[str, Future] = {}
+
+    def submit(self, record: Record) -> Future:
+        key = str(record.path)
+        if key not in self.futures:
+            self.futures[key] = self.pool.submit(record.fetch_, auth=self.auth, session=self.session, cache=self.cache)
+        return self.futures[key]
+
+    def wait(self):
+        "block until every submitted record is on disk, re-raising the first failure"
+        for future in self.futures.values():
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+
 class Corpus:
-    def __init__(self, root: Path):
+    def __init__(self, root: Path, jobs: int = 8):
         self.root = root
         self.url2record: Dict[str, Record] = {}
         self.host_creds = None
         self.audio_codec = "wav"
         self.speakers = {}
+        self.jobs = jobs
+        self.segment_jobs = 1
+        self.cache = None
         
     def get_global_speaker_id(self, recording_id, speaker_id):
         key = (recording_id, speaker_id)
         if not key in self.speakers:
             self.speakers[key] = len(self.speakers)
-        return f'S{self.speakers[key]:05d}' 
+        return sys.intern(f'S{self.speakers[key]:05d}')
     
     def globalize_speaker_ids(self):
         for url, record in self.url2record.items():
-            local2global_speaker_id = {}
-            for utt in record.utterances:
-                global_speaker_id = self.get_global_speaker_id(utt.recording_id, utt.speaker_id)
-                if utt.speaker_id not in local2global_speaker_id:
-                    print(f"   {record.name}, {utt.speaker_id} --> {global_speaker_id}", file=sys.stderr)
-                    local2global_speaker_id[utt.speaker_id] = global_speaker_id
-                utt.speaker_id = global_speaker_id
-                utt.update_id()
+            self.globalize_record(record)
+
+    def globalize_record(self, record: Record):
+        "replace local speaker ids of a record with corpus-wide ones, allocating new ids as needed"
+        local2global_speaker_id = {}
+        for utt in record.utterances:
+            global_speaker_id = self.get_global_speaker_id(utt.recording_id, utt.speaker_id)
+            if utt.speaker_id not in local2global_speaker_id:
+                print(f"   {record.name}, {utt.speaker_id} --> {global_speaker_id}", file=sys.stderr)
+                local2global_speaker_id[utt.speaker_id] = global_speaker_id
+            utt.speaker_id = global_speaker_id
+            utt.update_id()
     
+    def to_table(self) -> UtteranceTable:
+        table = UtteranceTable()
+        for record in self.url2record.values():
+            table.extend(record.utterances)
+        return table
+
     def record_by_utterance_url(self, utterance_url: str):
         recording_url, _ = utterance_url.split("?", 1)
         if not recording_url in self.url2record:
@@ -394,16 +521,25 @@ class Corpus:
         return self.url2record[recording_url]
         
     def from_dir(self, dir_path: AnyStr, domain="news", max_records=-1, valid_ids=None):
+        for r in self.iter_dir(dir_path, domain=domain, max_records=max_records, valid_ids=valid_ids):
+            self.url2record[r.recording_url] = r
+
+    def iter_dir(self, dir_path: AnyStr, domain="news", max_records=-1, valid_ids=None, ordered=True) -> Iterable[Record]:
+        """
+        Yield records with global speaker ids as soon as they are segmented and their audio is on disk.
+
+        With ordered=False records come in order of completion and speaker ids depend on timing.
+        """
         # {"recording_id": "Ro0dlb0_0VeI", "id": "S00250-Ro0dlb0_0VeI-U0107190-0121300-0121300", "text": "Угу", "normalized_text": "Угу", "start": 1213.0, "end": 1213.0, "speaker_id": "S00250", "utterance_id": "U0107190", "domain": "youtube", "source": "o0dlb0_-VeI", "utterance_url": "https://www.youtube.com/embed/o0dlb0_-VeI?start=1213&end=1213", "recording_path": "data/corpus/o0dlb0_-VeI.wav"}
         # read urls from dir_path/urls
         alignment_dir = os.path.join(dir_path, 'align')
         print(f"Reading urls from {dir_path}/urls by alignments in {alignment_dir} to: {self.root}", file=sys.stderr)
         missing_alignments = []
-        with open(os.path.join(dir_path, "urls")) as urls:
-            utt_count = 0
+        with open(os.path.join(dir_path, "urls")) as urls, Downloader(self.jobs, auth=self.host_creds, cache=self.cache) as downloader:
+            records = []  # (url, record, alignment path) in the order of urls
             for i, url in enumerate(urls):
-                if 0 <= max_records <= len(self.url2record):
-                    print(f"Reached maximum of requested records: {len(self.url2record)}", file=sys.stderr)
+                if 0 <= max_records <= len(records):
+                    print(f"Reached maximum of requested records: {len(records)}", file=sys.stderr)
                     break
                 url = url.strip()
                 name = url.split("/")[-1] # os.path.basename(url)
@@ -420,41 +556,91 @@ class Corpus:
                     continue
                 print(f" [{i}] {url} ({stem})", file=sys.stderr)
 
-                with open(align_path) as f:
-                    aj = json.loads(f.read())  # alignment json
+                r = Record(recording_url=url, name=Record.make_recording_id(stem, domain))
 
-                    r = Record(recording_url=url, name=Record.make_recording_id(stem, domain))
+                if self.root:  # audio is fetched in the background while we segment
+                    r.locate_(self.root, stem, domain=domain, audio_codec=self.audio_codec)
+                    downloader.submit(r)
 
-                    if self.root:
-                        source = r.name  # ?
-                        r.name = ""
-                        r.download_(self.root, stem, domain=domain, auth=self.host_creds, audio_codec=self.audio_codec)
+                records.append((url, r, align_path))
 
-                    print(f"  id:{r.name}", file=sys.stderr)
-                    # def from_alignment(self, ja: Dict, recording_id: AnyStr, domain="", start_utterance_id=1) -> List["Utterance"]:
-                    r.from_alignment(aj, recording_id=r.name, domain=domain, start_utterance_id=utt_count)
-                    utt_count += len(r.utterances)
-                    print(f"  loaded {len(r.utterances)}, total {utt_count} utterances", file=sys.stderr)
-
-                    self.url2record[url] = r
+            # in ordered mode utterance counts and speaker ids match a serial run
+            utt_count = 0
+            for r in self.segment_records(records, domain, ordered=ordered):
+                if self.root:
+                    downloader.submit(r).result()
+                self.globalize_record(r)
+                utt_count += len(r.utterances)
+                print(f"  {r.name}: loaded {len(r.utterances)}, total {utt_count} utterances", file=sys.stderr)
+                yield r
 
-            self.globalize_speaker_ids()  # update speaker ids
         if len(missing_alignments):
             print(f"Found {len(missing_alignments)} missing alignments", file=sys.stderr)
             for i, path in enumerate(missing_alignments):
                 print(f" [{i}]\t{path}", file=sys.stderr)
         
+    def segment_records(self, records: List[Tuple[str, Record, str]], domain: str, ordered=True) -> Iterable[Record]:
+        "run from_alignment for every record, in a process pool when segment_jobs > 1"
+        if self.segment_jobs <= 1:
+            for _, r, align_path in records:
+                yield segment_record(r, align_path, domain)
+            return
+
+        # spawn: forking while downloader threads hold locks is not safe
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.segment_jobs, mp_context=context) as pool:
+            if ordered:
+                results = pool.map(segment_record, [r for _, r, _ in records], [p for _, _, p in records],
+                                   itertools.repeat(domain), chunksize=8)
+            else:
+                results = (future.result() for future in
+                           as_completed([pool.submit(segment_record, r, p, domain) for _, r, p in records]))
+            yield from results
+
     def from_csv(self, lines: Iterable[List[AnyStr]]):
-        for i, line in enumerate(lines):
-            if i == 0: # ignore header
-                continue
+        for r in self.iter_csv(lines):
+            pass
+
+    def iter_csv(self, lines: Iterable[List[AnyStr]], ordered=True) -> Iterable[Record]:
+        """
+        Yield records with their utterances as soon as their audio is on disk.
+
+        Speaker ids are allocated in the order of rows upfront, so they do not depend on ordered.
+        """
+        rows = {}  # recording url -> rows of that record with their global speaker ids
+        futures = {}  # recording url -> download
+        with Downloader(self.jobs, auth=self.host_creds, cache=self.cache) as downloader:
+            for i, line in enumerate(lines):
+                if i == 0: # ignore header
+                    continue
 
+                r = self.record_by_utterance_url(line[-1])
+                if r.name == "":  # a new record
+                    domain, source = line[1], line[2]
+                    r.locate_(self.root, source, domain=domain, audio_codec=self.audio_codec)
+                    futures[r.recording_url] = downloader.submit(r)
+                    rows[r.recording_url] = []
+                rows[r.recording_url].append((self.get_global_speaker_id(r.name, line[5]), line))
+
+            assert len(self.speakers) < 1e5
+            assert i < 1e7
+
+            waiting = {}  # download -> urls of records sharing it
+            for url, future in futures.items():
+                waiting.setdefault(future, []).append(url)
+
+            for future in (waiting if ordered else as_completed(waiting)):
+                future.result()
+                for url in waiting[future]:
+                    r = self.url2record[url]
+                    self.add_csv_utterances(r, rows.pop(url))
+                    yield r
+
+    def add_csv_utterances(self, r: Record, rows: List[Tuple[str, List[AnyStr]]]):
+        for speaker_id, line in rows:
             rowid, domain, source, utterance_id, start_time, \
                 local_speaker_id, text, normalized_text, start, end, utterance_url = line
 
-            r = self.record_by_utterance_url(utterance_url)
-            r.download_(self.root, source, domain=domain, auth=self.host_creds, audio_codec=self.audio_codec)
-
             if end == "":
                 end = r.compute_duration() # end is missing for some final utterances: guess from file duration
                 
@@ -467,16 +653,21 @@ class Corpus:
                  #start, end = max(0., float(start) - 0.5), min(float(end) + 0.5, float(end))
 
             s = Utterance(recording_id=r.name, text=text, normalized_text=normalized_text, start=start, end=end,
-                          speaker_id=self.get_global_speaker_id(r.name, local_speaker_id),
+                          speaker_id=speaker_id,
                           utterance_id=f'U{int(utterance_id):07d}', domain=domain, source=source,
                           utterance_url=utterance_url, recording_path=str(r.path))
 
             r.add_utterance(s)
-            
-        assert len(self.speakers) < 1e5
-        assert i < 1e7
 
-def download_file(url: str, target_audio_path: Path, auth=None):
+def segment_record(r: Record, align_path: str, domain: str) -> Record:
+    "segment one recording by its alignment"
+    with open(align_path) as f:
+        aj = json.loads(f.read())  # alignment json
+    r.from_alignment(aj, recording_id=r.name, domain=domain)
+    return r
+
+
+def download_file(url: str, target_audio_path: Path, auth=None, session=None, cache: MediaCache = None):
     target_audio_path.parent.mkdir(exist_ok=True)
 
     if target_audio_path.exists():
@@ -485,17 +676,11 @@ def download_file(url: str, target_audio_path: Path, auth=None):
     filename = url.split('/')[-1].replace(" ", "_")  # be careful with file names
     file_path = target_audio_path.parent / filename
     if not file_path.exists():
-        r = requests.get(url, stream=True, auth=auth)
-        if r.ok:
-            print("saving to:", file_path.absolute(), file=sys.stderr)
-            with open(file_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024 * 1024 * 2):  # 1024 * 8
-                    if chunk:
-                        f.write(chunk)
-                        f.flush()
-                        os.fsync(f.fileno())
+        if cache is not None:
+            cache.fetch(url, file_path, lambda path: fetch_url(url, path, auth=auth, session=session),
+                        session=session, auth=auth)
         else:
-            raise ConnectionError("Download failed: status code {}\n{}".format(r.status_code, r.text))
+            fetch_url(url, file_path, auth=auth, session=session)
 
     if target_audio_path.exists():
         return
@@ -505,6 +690,25 @@ def download_file(url: str, target_audio_path: Path, auth=None):
     file_path.unlink()
 
 
+def fetch_url(url: str, file_path: Path, auth=None, session=None, chunk_size=1024 * 1024 * 2):
+    "download url to file_path, resuming a partial .part file left behind by an interrupted run"
+    part = file_path.with_name(file_path.name + '.part')
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with (session or requests).get(url, stream=True, auth=auth, headers=headers) as r:
+        if offset and r.status_code == 416:  # nothing left to fetch
+            pass
+        elif r.ok:
+            mode = 'ab' if r.status_code == 206 else 'wb'  # servers may ignore Range and send everything
+            print(f"saving to: {part.absolute()} from byte {offset if mode == 'ab' else 0}", file=sys.stderr)
+            with open(part, mode) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        else:
+            raise ConnectionError("Download failed: status code {}\n{}".format(r.status_code, r.text))
+    os.replace(part, file_path)
+
+
 def yt_dl(url, dir: Path):
     ydl_opts = {
         'format': 'm4a/bestaudio/best',
@@ -523,23 +727,24 @@ def yt_dl(url, dir: Path):
         return error_code
 
 
-def to_wav(v: Path, a: Path):
-    cl = ["ffmpeg", "-loglevel", "quiet", "-i", str(v), "-vn", "-ac", "1"]
-    if a.suffix.endswith("wav"):
-        cl += ["-acodec", "pcm_s16le"]
-    cl += ["-ar", "16000", "--", str(a)]
-    print(f"Extracting audio by command: {' '.join(cl)}", file=sys.stderr)
-    subprocess.check_output(cl)
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("csv_path", help="Input path of either cvs-file or directory", default="utterances.csv")
     parser.add_argument("corpus_dir", nargs="?", help="Store corpus to this directory", default="")
     parser.add_argument("-a", "--authorization", default="oco:mykolynapohoda")
-    parser.add_argument("-ur", "--upper_records", help="Read at most records", default=-1)
+    parser.add_argument("-ur", "--upper_records", type=int, help="Read at most records", default=-1)
     parser.add_argument("-wt", "--write_text", help="Output file path for labeled text: <record_label> <text>", default="")
     parser.add_argument("-ac", "--audio_codec", help="Format of audio to be stored", default="wav")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of recordings to download in parallel", default=8)
+    parser.add_argument("--cache_dir", help="Share downloaded media between runs through this directory", default="")
+    parser.add_argument("--cache_size", type=float, help="Evict least recently used media above this many GB (0 is unbounded)", default=0)
+    parser.add_argument("--cache_revalidate", action="store_true", help="Check ETag and size of cached media with the server")
+    parser.add_argument("--cache_verify", action="store_true", help="Rehash cached media on every hit and refetch corrupted files")
+    parser.add_argument("-pq", "--parquet", help="Also store utterances to this parquet file", default="")
+    parser.add_argument("--stream", action="store_true", help="Print utterances of each record as soon as it is ready")
+    parser.add_argument("--unordered", action="store_true", help="With --stream, print records in order of completion")
+    parser.add_argument("-sj", "--segment_jobs", type=int, default=1,
+                        help="Processes segmenting alignments; 1 segments them in this process, more start a pool")
     args = parser.parse_args()
 
     #csv_path = Path(sys.argv[1] if len(sys.argv) > 1 else "utterances.csv")
@@ -553,9 +758,20 @@ def main():
     max_records = args.upper_records  # 1  # -1
     
     print(f"Reading {csv_path} and storing downloaded audio in '{corpus_dir}'", file=sys.stderr)
-    corpus = Corpus(corpus_dir)
+    corpus = Corpus(corpus_dir, jobs=args.jobs)
     corpus.host_creds = (host_creds.split(":", 1)[0], host_creds.split(":", 1)[1]) if ":" in host_creds else None
     corpus.audio_codec = args.audio_codec
+    corpus.segment_jobs = args.segment_jobs
+    if args.cache_dir:
+        corpus.cache = MediaCache(args.cache_dir, max_bytes=int(args.cache_size * 1e9),
+                                  verify=args.cache_verify, revalidate=args.cache_revalidate)
+    if args.stream:
+        table = stream(corpus, csv_path, max_records=max_records, ordered=not args.unordered, write_text=args.write_text,
+                       table=UtteranceTable() if args.parquet else None)
+        if args.parquet:
+            table.to_parquet(args.parquet)
+        return
+
     if os.path.isfile(csv_path):
         with open(csv_path) as csv_file:
             corpus.from_csv(csv.reader(csv_file, delimiter=','))
@@ -567,7 +783,7 @@ def main():
  
     for _, record in corpus.url2record.items():
         for segment in record.utterances:
-            print(json.dumps(asdict(segment), ensure_ascii=False))
+            print(segment.to_json())
  
     if args.write_text:
         print(f"Storing {len(corpus.url2record)} records to: {args.write_text}...", file=sys.stderr)
@@ -576,6 +792,36 @@ def main():
                 text = record.to_text(allow_multiline=False, enable_decoration=True)
                 print(record.name, text, file=f)
 
+    if args.parquet:
+        corpus.to_table().to_parquet(args.parquet)
+
+
+def stream(corpus: Corpus, csv_path: Path, *, max_records=-1, ordered=True, write_text="", table=None):
+    """
+    Print utterances of every record as soon as it is ready, without keeping them around.
+
+    Utterances are also appended to table, when given.
+    """
+    text_file = open(write_text, "wt") if write_text else None
+    try:
+        with open(csv_path) if os.path.isfile(csv_path) else nullcontext() as csv_file:
+            if csv_file is not None:
+                records = corpus.iter_csv(csv.reader(csv_file, delimiter=','), ordered=ordered)
+            else:
+                records = corpus.iter_dir(csv_path, domain="news", max_records=max_records, ordered=ordered)
+            for record in records:
+                sys.stdout.write("".join(segment.to_json() + "\n" for segment in record.utterances))
+                sys.stdout.flush()
+                if text_file is not None:
+                    print(record.name, record.to_text(allow_multiline=False, enable_decoration=True), file=text_file)
+                if table is not None:
+                    table.extend(record.utterances)
+                record.utterances = []
+    finally:
+        if text_file is not None:
+            text_file.close()
+    return table
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,4 @@
+from .evaluate import main
+
+
+main()
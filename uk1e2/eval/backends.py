@@ -0,0 +1,267 @@
+"""
+Models that python -m uk1e2.eval runs on the test set, by name.
+
+A backend loads its model on a device, predicts a batch of an audio store
+on the main thread and finishes predictions on the writer thread, where
+pyctcdecode search runs in a pool of processes. A new model family is a
+subclass of Backend registered with @register('name'); its default model
+and result file are class attributes and its own options go to
+add_arguments.
+
+Frameworks are imported when a backend is made, so merging results and
+--help work without torch.
+"""
+
+from pathlib import Path
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Type
+
+import numpy as np
+
+
+BACKENDS: Dict[str, Type['Backend']] = {}
+
+# the language model of Yehor/wav2vec2-xls-r-300m-uk-with-3gram-news-lm
+LANGUAGE_MODEL = './w2v2/wav2vec2-xls-r-300m-uk-with-3gram-news-lm/language_model'
+
+
+def register(name: str) -> Callable[[Type['Backend']], Type['Backend']]:
+    "a class decorator that makes a backend available to python -m uk1e2.eval as name"
+    def add(cls):
+        BACKENDS[name] = cls
+        cls.name = name
+        return cls
+    return add
+
+
+def torch_device(name: Optional[str] = None):
+    "the device of name, or the first GPU when there is one and the CPU otherwise"
+    import torch
+
+    if name is None:
+        name = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    return torch.device(name)
+
+
+class Backend:
+    "a model of the test set: predict runs it on a batch of an audio store, finish decodes on the writer thread"
+
+    name = ''
+    # what python -m uk1e2.eval runs and where it writes results without --model and --save_to
+    model_name = ''
+    save_to = ''
+    # added to the name of results of other models
+    suffix = ''
+    # whether outputs of the model can be kept in a logit store
+    ctc = False
+
+    @classmethod
+    def add_arguments(cls, parser):
+        "options of this backend only"
+
+    @classmethod
+    def results_file(cls, model_name: str) -> str:
+        "save_to of the default model, a file named after any other model"
+        if model_name == cls.model_name:
+            return cls.save_to
+        return f'{Path(model_name).stem if model_name.endswith((".nemo", ".pt")) else model_name.split("/")[-1]}{cls.suffix}.txt'
+
+    def __init__(self, model_name: str, device, options):
+        self.model_name = model_name
+        self.device = device
+        self.options = options
+
+    def forward(self, speech: Sequence[np.ndarray]) -> List[np.ndarray]:
+        "frames of every utterance of a batch, for backends that keep them in a logit store"
+        raise NotImplementedError
+
+    def predict(self, batch: Dict[str, List], logits: Optional[List[np.ndarray]] = None) -> Dict[str, List]:
+        "columns to add to a batch, logits are the frames of its utterances when the backend is ctc"
+        raise NotImplementedError
+
+    def finish(self, results: Dict[str, List]) -> Dict[str, List]:
+        "turn columns of predict into predicted texts, on the writer thread"
+        return results
+
+    def close(self, complete: bool = True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(complete=exc_type is None)
+
+
+@register('wav2vec2')
+class Wav2Vec2(Backend):
+    "greedy decoding of a wav2vec2 CTC model"
+
+    model_name = 'Yehor/wav2vec2-xls-r-300m-uk-with-3gram-news-lm'
+    save_to = 'wav2vec2_300m.txt'
+    ctc = True
+
+    def __init__(self, model_name, device, options):
+        super().__init__(model_name, device, options)
+        from transformers import Wav2Vec2ForCTC
+
+        self.model = Wav2Vec2ForCTC.from_pretrained(model_name).to(device)
+        self.processor = self.load_processor(model_name)
+
+    def load_processor(self, model_name):
+        from transformers import Wav2Vec2Processor
+
+        return Wav2Vec2Processor.from_pretrained(model_name)
+
+    def forward(self, speech):
+        from .frontend import wav2vec2_logits
+
+        return wav2vec2_logits(self.model, self.processor, speech, self.device)
+
+    def predict(self, batch, logits=None):
+        return {'predicted': self.processor.batch_decode([it.argmax(axis=-1) for it in logits])}
+
+
+@register('wav2vec2_lm')
+class Wav2Vec2LM(Wav2Vec2):
+    "a wav2vec2 CTC model decoded by Wav2Vec2ProcessorWithLM with the language model of its repository"
+
+    save_to = 'wav2vec2_300m_LM.txt'
+    suffix = '_LM'
+
+    def load_processor(self, model_name):
+        from transformers import Wav2Vec2ProcessorWithLM
+
+        return Wav2Vec2ProcessorWithLM.from_pretrained(model_name)
+
+    def predict(self, batch, logits=None):
+        from .logits import pad_logits
+
+        return {'predicted': self.processor.batch_decode(pad_logits(logits)).text}
+
+
+@register('nemo')
+class NeMo(Backend):
+    "greedy decoding of a NeMo CTC model"
+
+    # possible models:
+    # - theodotus/stt_uk_squeezeformer_ctc_ml
+    # - nvidia/stt_uk_citrinet_1024_gamma_0_25
+    # - theodotus/stt_uk_contextnet_512
+    # - a .nemo file
+    model_name = 'nvidia/stt_uk_citrinet_1024_gamma_0_25'
+    save_to = 'stt_uk_citrinet_1024_gamma_0_25.txt'
+    ctc = True
+
+    def __init__(self, model_name, device, options):
+        super().__init__(model_name, device, options)
+        import nemo.collections.asr as nemo_asr
+
+        if model_name.endswith('.nemo'):
+            self.asr_model = nemo_asr.models.EncDecCTCModel.restore_from(model_name, map_location=device)
+        else:
+            self.asr_model = nemo_asr.models.EncDecCTCModel.from_pretrained(model_name, map_location=device)
+
+    def forward(self, speech):
+        from .frontend import nemo_log_probs
+
+        return nemo_log_probs(self.asr_model, speech)
+
+    def predict(self, batch, logits=None):
+        from .frontend import nemo_decode
+
+        # fix apostrophe in predictions
+        return {'predicted': [it.replace('’', "'") for it in nemo_decode(self.asr_model, logits)]}
+
+
+@register('nemo_lm')
+class NeMoLM(NeMo):
+    "a NeMo CTC model decoded by pyctcdecode with a KenLM model in a pool of processes"
+
+    save_to = 'stt_uk_citrinet_1024_gamma_0_25_LM.txt'
+    suffix = '_LM'
+
+    @classmethod
+    def add_arguments(cls, parser):
+        from .decode import ALPHA, BEAM_WIDTH, BETA
+
+        parser.add_argument('--lm', default=f'{LANGUAGE_MODEL}/lm.binary', help='KenLM model')
+        parser.add_argument('--unigrams', default=f'{LANGUAGE_MODEL}/unigrams.txt', help='words of the language model')
+        parser.add_argument('--beam_width', type=int, default=BEAM_WIDTH)
+        parser.add_argument('--alpha', type=float, nargs='+', default=[ALPHA],
+                            help='language model weight; several alphas or betas search them instead of writing results')
+        parser.add_argument('--beta', type=float, nargs='+', default=[BETA], help='word insertion bonus')
+        parser.add_argument('--decoders', type=int, help='processes of the search, all CPUs by default')
+
+    def __init__(self, model_name, device, options):
+        super().__init__(model_name, device, options)
+        from pyctcdecode import build_ctcdecoder
+
+        from .decode import DecoderPool
+
+        with open(options.unigrams) as x:
+            unigrams = [it.strip() for it in x.readlines()]
+        self.decoder = build_ctcdecoder(self.asr_model.decoder.vocabulary, kenlm_model_path=options.lm,
+                                        unigrams=unigrams, alpha=options.alpha[0], beta=options.beta[0])
+        self.pool = None if self.searching else \
+            DecoderPool(self.decoder, options.decoders, alpha=options.alpha[0], beta=options.beta[0])
+
+    @property
+    def searching(self) -> bool:
+        return len(self.options.alpha) * len(self.options.beta) > 1
+
+    def search(self, targets: Sequence[str], log_probs: Sequence[np.ndarray]):
+        "print WER of every alpha and beta over log probabilities of the test set"
+        from .decode import DecoderPool
+
+        with DecoderPool(self.decoder, self.options.decoders, log_probs=log_probs) as pool:
+            for alpha, beta, wer in pool.search(targets, self.options.alpha, self.options.beta, self.options.beam_width):
+                print(f'alpha={alpha} beta={beta} beam_width={self.options.beam_width} WER={wer:.4f}', flush=True)
+
+    def predict(self, batch, logits=None):
+        # log probabilities are decoded on the writer thread
+        return {'log_probs': logits}
+
+    def finish(self, results):
+        # fix apostrophe in predictions
+        texts = self.pool.decode(results.pop('log_probs'), self.options.beam_width)
+        results['predicted'] = [it.replace('’', "'") for it in texts]
+        return results
+
+    def close(self, complete=True):
+        if self.pool is None:
+            pass
+        elif complete:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+
+
+UK_CHARACTERS = set('абвгґдеєжзиіїйклмнопрстуфхцчшщьюя'.upper() + 'абвгґдеєжзиіїйклмнопрстуфхцчшщьюя' + "—,!?' ")
+
+
+@register('whisper')
+class Whisper(Backend):
+    "the official Whisper package with Ukrainian as the language; predictions with digits or other letters are left out"
+
+    model_name = 'large-v2'
+    save_to = 'whisper_large_v2.txt'
+
+    def __init__(self, model_name, device, options):
+        super().__init__(model_name, device, options)
+        import whisper
+
+        self.model = whisper.load_model(model_name, device=device)
+
+    def predict(self, batch, logits=None):
+        # Whisper takes 16 kHz float32 arrays as they are, fp16 only runs on a GPU
+        results = [self.model.transcribe(speech, language='uk', fp16=self.device.type == 'cuda')['text']
+                   for speech in batch['speech']]
+
+        # some corrections
+        predicted = [it.replace('’', "'").strip().lower().replace(',', '').replace('.', '').replace('?', '').replace('!', '')
+                     for it in results]
+
+        # mark incorrect samples to filter them out
+        checked = [not re.search(r'\d', pred) and all(x in UK_CHARACTERS for x in pred) for pred in predicted]
+        return {'predicted': predicted, 'checked': checked}
@@ -0,0 +1,100 @@
+"""
+Batches of utterances of similar length, formed by a budget of padded samples.
+
+Utterances are sorted by length, longest first, and a batch grows while
+its size times its longest utterance fits the budget. Short utterances
+then go in large batches and long ones in small batches, and little of
+any batch is padding. The result writer puts outputs back in dataset order.
+
+    python -m uk1e2.eval.batching benchmark segment.audio
+"""
+
+from pathlib import Path
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+# 16 utterances of 10 seconds at 16 kHz
+MAX_SAMPLES = 16 * 10 * 16_000
+
+
+def length_batches(lengths: Sequence[int], max_samples: int = MAX_SAMPLES,
+                   max_batch_size: Optional[int] = None) -> List[np.ndarray]:
+    "indices of utterances in every batch; an utterance longer than the budget gets a batch of its own"
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind='stable')
+    batches = []
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, max_samples // longest)
+        if max_batch_size:
+            size = min(size, max_batch_size)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def fixed_batches(count: int, batch_size: int) -> List[np.ndarray]:
+    "indices of batches of batch_size utterances in dataset order"
+    return [np.arange(start, min(start + batch_size, count)) for start in range(0, count, batch_size)]
+
+
+def padded_samples(lengths: Sequence[int], batches: List[np.ndarray]) -> int:
+    lengths = np.asarray(lengths)
+    return sum(len(batch) * int(lengths[batch].max()) for batch in batches if len(batch))
+
+
+def tiny_wav2vec2():
+    "a randomly initialized wav2vec2 CTC model with two small layers, enough to time padding"
+    from transformers import Wav2Vec2Config, Wav2Vec2ForCTC
+
+    config = Wav2Vec2Config(hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128,
+                            conv_dim=(32,) * 7, vocab_size=40, num_conv_pos_embeddings=16,
+                            feat_extract_norm='layer', do_stable_layer_norm=True)
+    return Wav2Vec2ForCTC(config).eval()
+
+
+def benchmark(store_folder: Path, utterances: int = 1000, batch_size: int = 16, max_samples: int = MAX_SAMPLES):
+    "padding and CPU time of a tiny wav2vec2 model with fixed batches in dataset order and with length batches"
+    import torch
+    from transformers import Wav2Vec2FeatureExtractor
+
+    from .store import AudioStore
+
+    store = AudioStore(store_folder)
+    count = min(utterances, len(store))
+    lengths = store.lengths[:count]
+    model = tiny_wav2vec2()
+    feature_extractor = Wav2Vec2FeatureExtractor(return_attention_mask=True, do_normalize=True)
+    torch.set_num_threads(1)
+
+    for name, batches in [(f'{batch_size} in dataset order', fixed_batches(count, batch_size)),
+                          (f'{max_samples} samples by length', length_batches(lengths, max_samples))]:
+        t0 = time.time()
+        for indices in batches:
+            batch = store.batch(indices)
+            features = feature_extractor(batch['speech'], sampling_rate=16_000, padding=True, return_tensors='pt')
+            with torch.no_grad():
+                model(features.input_values, attention_mask=features.attention_mask)
+        elapsed = time.time() - t0
+        padded = padded_samples(lengths, batches)
+        print(f'{name}: {len(batches)} batches, {1 - lengths.sum() / padded:.1%} of {padded} samples are padding, '
+              f'{elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('benchmark', help='compare fixed batches with length batches on the CPU')
+    bench.add_argument('store', type=Path, help='audio store made by uk1e2.eval.generate_cache_folder')
+    bench.add_argument('-n', '--utterances', type=int, default=1000)
+    bench.add_argument('--batch_size', type=int, default=16)
+    bench.add_argument('--max_samples', type=int, default=MAX_SAMPLES)
+    args = parser.parse_args()
+
+    benchmark(args.store, args.utterances, args.batch_size, args.max_samples)
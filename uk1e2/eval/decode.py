@@ -0,0 +1,188 @@
+"""
+CTC beam search with a language model in worker processes that live for a whole run.
+
+Workers are forked once, after the decoder is built, so every worker has
+the KenLM model without loading it again and a batch only sends its log
+probabilities. Every task carries the language model weights it is
+decoded with, so a grid of alpha and beta is searched in the same pool,
+over log probabilities computed once and forked into the workers.
+
+    python -m uk1e2.eval.decode benchmark
+"""
+
+import multiprocessing
+import os
+from pathlib import Path
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .score import edit_distances, encode, jiwer_words
+
+
+BEAM_WIDTH = 50
+ALPHA, BETA = 0.5, 1.5
+# utterances sent to a worker at a time
+CHUNK_SIZE = 4
+
+# the decoder and log probabilities of worker processes, inherited when the pool forks
+_decoder = None
+_log_probs: Sequence[np.ndarray] = ()
+
+
+def _decode(task: Tuple) -> str:
+    log_probs, beam_width, alpha, beta = task
+    if isinstance(log_probs, (int, np.integer)):
+        log_probs = _log_probs[log_probs]
+    # frames of a logit store may be float16
+    log_probs = np.asarray(log_probs, dtype=np.float32)
+    _decoder.reset_params(alpha=float(alpha), beta=float(beta))
+    return _decoder.decode(log_probs, beam_width=beam_width)
+
+
+class DecoderPool:
+    "a pool of processes forked with a pyctcdecode decoder and, for searches, log probabilities of a test set"
+
+    def __init__(self, decoder, processes: Optional[int] = None, log_probs: Sequence[np.ndarray] = (),
+                 alpha: float = ALPHA, beta: float = BETA):
+        global _decoder, _log_probs
+        _decoder, _log_probs = decoder, log_probs
+        self.size = len(log_probs)
+        self.alpha, self.beta = alpha, beta
+        self.pool = multiprocessing.get_context('fork').Pool(processes)
+
+    def decode(self, log_probs: Sequence[np.ndarray], beam_width: int = BEAM_WIDTH,
+               alpha: Optional[float] = None, beta: Optional[float] = None) -> List[str]:
+        "texts of a batch of log probabilities of shape (frames, vocabulary)"
+        alpha, beta = self.alpha if alpha is None else alpha, self.beta if beta is None else beta
+        return self.pool.map(_decode, [(lp, beam_width, alpha, beta) for lp in log_probs], chunksize=CHUNK_SIZE)
+
+    def search(self, targets: Sequence[str], alphas: Sequence[float], betas: Sequence[float],
+               beam_width: int = BEAM_WIDTH) -> List[Tuple[float, float, float]]:
+        "WER of the log probabilities the pool was made with for every alpha and beta, all tasks of the grid at once"
+        grid = [(alpha, beta) for alpha in alphas for beta in betas]
+        tasks = [(i, beam_width, alpha, beta) for alpha, beta in grid for i in range(self.size)]
+        texts = self.pool.map(_decode, tasks, chunksize=CHUNK_SIZE)
+        return [(alpha, beta, word_error_rate(targets, texts[n * self.size:(n + 1) * self.size]))
+                for n, (alpha, beta) in enumerate(grid)]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        "stop the workers without waiting for their tasks"
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def word_error_rate(references: Sequence[str], predictions: Sequence[str]) -> float:
+    "errors of all utterances over words of all references"
+    vocabulary = {}
+    refs = encode(map(jiwer_words, references), vocabulary)
+    hyps = encode(map(jiwer_words, predictions), vocabulary)
+    return int(edit_distances(refs, hyps).sum()) / max(sum(len(ref) for ref in refs), 1)
+
+
+def synthetic_lm(folder: Path, words: Sequence[str]) -> Path:
+    "a bigram ARPA model of words, every bigram equally likely"
+    lm = folder / 'lm.arpa'
+    unigram, bigram = np.log10(1 / (len(words) + 2)), np.log10(1 / len(words))
+    with open(lm, 'w') as f:
+        f.write(f'\\data\\\nngram 1={len(words) + 3}\nngram 2={len(words) ** 2}\n\n\\1-grams:\n')
+        f.write(f'{unigram:.4f}\t<unk>\t0\n0\t<s>\t-0.3\n{unigram:.4f}\t</s>\t0\n')
+        f.writelines(f'{unigram:.4f}\t{w}\t-0.3\n' for w in words)
+        f.write('\n\\2-grams:\n')
+        f.writelines(f'{bigram:.4f}\t{a} {b}\n' for a in words for b in words)
+        f.write('\n\\end\\\n')
+    return lm
+
+
+def benchmark(utterances: int = 256, batch_size: int = 16, processes: Optional[int] = None, resident: int = 4096):
+    """
+    Decode noisy log probabilities of random texts with a bigram model over 300 words, forking a pool
+    for every batch like before and with a DecoderPool, while this process holds resident megabytes
+    the way it holds an acoustic model; then search a 3x3 grid of weights and try narrower beams.
+    """
+    from tempfile import TemporaryDirectory
+
+    from pyctcdecode import build_ctcdecoder
+
+    labels = [''] + list(" 'абвгґдеєжзиіїйклмнопрстуфхцчшщьюя")
+    rng = np.random.default_rng(0)
+    words = sorted({''.join(rng.choice(labels[3:], 5)) for _ in range(300)})
+    targets = [' '.join(rng.choice(words, 5)) for _ in range(utterances)]
+    log_probs = []
+    for target in targets:
+        # a frame of every character between two blank frames, blurred by noise
+        spikes = np.zeros((len(target) * 3, len(labels)), dtype=np.float32)
+        spikes[:, 0] = 6
+        spikes[np.arange(len(target)) * 3 + 1, [labels.index(c) for c in target]] = 7
+        logits = spikes + rng.normal(size=spikes.shape).astype(np.float32)
+        log_probs.append(logits - np.log(np.exp(logits).sum(axis=1, keepdims=True)))
+
+    model = np.ones(resident << 18, dtype=np.float32)  # noqa: F841, forked with every pool
+    with TemporaryDirectory() as tmp:
+        decoder = build_ctcdecoder(labels, kenlm_model_path=str(synthetic_lm(Path(tmp), words)), unigrams=words,
+                                   alpha=ALPHA, beta=BETA)
+        batches = [log_probs[start:start + batch_size] for start in range(0, utterances, batch_size)]
+
+        t0 = time.time()
+        before = []
+        for batch in batches:
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                before += decoder.decode_batch(pool, batch, beam_width=BEAM_WIDTH)
+        t1 = time.time()
+        with DecoderPool(decoder, processes) as pool:
+            after = [text for batch in batches for text in pool.decode(batch)]
+        t2 = time.time()
+        print(f'{utterances} utterances on {processes or os.cpu_count()} processes: a pool for every batch {t1 - t0:.2f}s, '
+              f'one pool {t2 - t1:.2f}s, same texts: {before == after}')
+
+        alphas, betas = [0.3, 0.5, 0.7], [0.5, 1.0, 1.5]
+        t0 = time.time()
+        grid = []
+        for alpha in alphas:
+            for beta in betas:
+                decoder.reset_params(alpha=alpha, beta=beta)
+                texts = []
+                for batch in batches:
+                    with multiprocessing.get_context('fork').Pool(processes) as pool:
+                        texts += decoder.decode_batch(pool, batch, beam_width=BEAM_WIDTH)
+                grid.append((alpha, beta, word_error_rate(targets, texts)))
+        t1 = time.time()
+        with DecoderPool(decoder, processes, log_probs=log_probs) as pool:
+            searched = pool.search(targets, alphas, betas)
+        t2 = time.time()
+        print(f'3x3 grid: a pool for every batch {t1 - t0:.2f}s, one search {t2 - t1:.2f}s, same WER: {grid == searched}')
+
+        with DecoderPool(decoder, processes, log_probs=log_probs) as pool:
+            for beam_width in (BEAM_WIDTH, 16, 4):
+                t0 = time.time()
+                (_, _, wer), = pool.search(targets, [ALPHA], [BETA], beam_width=beam_width)
+                print(f'beam width {beam_width}: {time.time() - t0:.2f}s, WER {wer:.4f}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('benchmark', help='compare a pool for every batch with a DecoderPool')
+    bench.add_argument('-n', '--utterances', type=int, default=256)
+    bench.add_argument('--batch_size', type=int, default=16)
+    bench.add_argument('-j', '--processes', type=int)
+    bench.add_argument('--resident', type=int, default=4096, help='megabytes this process holds while it forks')
+    args = parser.parse_args()
+
+    benchmark(args.utterances, args.batch_size, args.processes, args.resident)
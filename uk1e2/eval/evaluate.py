@@ -0,0 +1,227 @@
+"""
+Evaluate a model of uk1e2.eval.backends on the test set audio store.
+
+    python -m uk1e2.eval nemo
+    python -m uk1e2.eval wav2vec2_lm --device cpu --threads 4 --max_samples 1280000
+    python -m uk1e2.eval nemo_lm --alpha 0.3 0.5 0.7 --beta 0.5 1.0 1.5
+    python -m uk1e2.eval whisper --model medium --save_to whisper_medium.txt
+
+Results go to save_to, a line per utterance: id|target|predicted|wer|cer.
+A run that is stopped resumes with the utterances it has not written.
+
+A test set is split into shards of about the same amount of audio.
+python -m uk1e2.eval nemo --shard 2/4 evaluates the third of four shards
+into save_to.2-of-4, on this machine or any other, and merge puts the
+shards of save_to together in dataset order. -j 4 runs all four shards
+as processes here, splits the CPU threads between them and merges.
+
+A shard of a CTC model keeps its outputs in a logit store of its own,
+reading those the store of the model already has. Merging with --model
+moves them into the store of the model, so later runs of any shard count
+and other decoders of the model read them.
+
+    python -m uk1e2.eval whisper --device cpu -j 4
+    python -m uk1e2.eval merge whisper_large_v2.txt --shards 4
+    python -m uk1e2.eval merge stt_uk_citrinet_1024_gamma_0_25.txt --shards 4 --model nvidia/stt_uk_citrinet_1024_gamma_0_25
+"""
+
+import argparse
+import os
+from pathlib import Path
+import subprocess
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .backends import BACKENDS, Backend, torch_device
+from .batching import MAX_SAMPLES, length_batches
+from .logits import DTYPES, logits_of, merge_logits, open_logits
+from .results import ResultWriter, result_id, sort_lines
+from .score import error_rates
+from .store import AudioStore
+
+
+CACHED_DATASET = 'segment.audio'
+LOGITS_FOLDER = 'logits'
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    "a shard as index/count, counted from 0"
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'a shard is index/count like 0/4, not {value}')
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard {index} of {count} does not exist, they are 0/{count} to {count - 1}/{count}')
+    return index, count
+
+
+def shard_indices(lengths: np.ndarray, index: int, count: int) -> np.ndarray:
+    "utterances of a shard in dataset order, every count-th by length so shards get about the same audio"
+    return np.sort(np.argsort(lengths, kind='stable')[index::count])
+
+
+def shard_file(save_to: Path, index: int, count: int) -> Path:
+    return Path(f'{save_to}.{index}-of-{count}') if count > 1 else Path(save_to)
+
+
+def format_results(results: Dict[str, List]):
+    "ids and result lines of a batch, predictions checked as False are left out with a line of None"
+    # count metrics of the whole batch at once
+    wers, cers = error_rates(results['target'], results['predicted'])
+    checked = results.get('checked', [True] * len(wers))
+
+    for path, target, row, wer, cer, ok in zip(results['path'], results['target'], results['predicted'], wers, cers, checked):
+        utterance_id = result_id(path)
+        yield utterance_id, f'{utterance_id}|{target}|{row}|{round(float(wer), 4)}|{round(float(cer), 4)}\n' if ok else None
+
+
+def evaluate(backend: Backend, store: AudioStore, save_to: Path, max_samples: int = MAX_SAMPLES,
+             shard: Tuple[int, int] = (0, 1), logits_folder: Optional[Path] = None, logits_dtype: str = 'float32'):
+    """
+    Write results of a shard of the store while a thread decodes, scores and writes them,
+    skipping utterances already in the file; the model of a ctc backend runs only on utterances
+    that are not in the logit store.
+    """
+    indices = shard_indices(store.lengths, *shard)
+    ids = [result_id(store.rows[i]['path']) for i in indices]
+
+    # processes of other shards keep stores of their own
+    with open_logits(logits_folder if backend.ctc else None, backend.model_name, logits_dtype, store.folder, shard) as logit_store, \
+            ResultWriter(shard_file(save_to, *shard), lambda results: format_results(backend.finish(results)), order=ids) as writer:
+        todo = indices[writer.pending()]
+        for batch_indices in length_batches(store.lengths[todo], max_samples):
+            batch = store.batch(todo[batch_indices])
+            logits = logits_of(logit_store, batch['id'], batch['speech'], backend.forward) if backend.ctc else None
+            results = backend.predict(batch, logits)
+            results['path'] = batch['path']
+            results['target'] = [it.strip() for it in batch['text']]
+            writer.put(results)
+
+
+def search(backend: Backend, store: AudioStore, max_samples: int = MAX_SAMPLES,
+           logits_folder: Optional[Path] = None, logits_dtype: str = 'float32'):
+    "run the model once over the store and print WER of every language model weight of a nemo_lm backend"
+    # with a store log probabilities stay on disk, mapped into the workers, and the next search does not run the model
+    with open_logits(logits_folder, backend.model_name, logits_dtype, store.folder) as logit_store:
+        log_probs = [None] * len(store)
+        for indices in length_batches(store.lengths, max_samples):
+            batch = store.batch(indices)
+            for i, lp in zip(indices, logits_of(logit_store, batch['id'], batch['speech'], backend.forward, views=True)):
+                log_probs[i] = lp
+        backend.search([row['text'].strip() for row in store.rows], log_probs)
+
+
+def merge(save_to: Path, shards: int, dataset: Optional[Path] = None) -> int:
+    "put result files of all shards together into save_to, in the order of the dataset when it is given; the number of lines"
+    files = [shard_file(save_to, index, shards) for index in range(shards)]
+    missing = [str(f) for f in files if not f.exists()]
+    if missing:
+        raise FileNotFoundError(f'shards of {save_to} are missing: {" ".join(missing)}')
+    order = [result_id(row['path']) for row in AudioStore(dataset).rows] if dataset is not None else None
+
+    lines, seen = [], set()
+    for f in files:
+        for line in f.read_text(encoding='utf-8').splitlines(keepends=True):
+            if not line.endswith('\n'):
+                continue  # torn by a stopped shard
+            utterance_id = line.split('|', 1)[0]
+            if utterance_id in seen:
+                raise ValueError(f'{utterance_id} is in more than one shard of {save_to}, were they made with the same --shard count?')
+            seen.add(utterance_id)
+            lines.append(line)
+
+    tmp = Path(f'{save_to}.tmp')
+    tmp.write_text(''.join(lines), encoding='utf-8')
+    os.replace(tmp, save_to)
+    if order is not None:
+        sort_lines(save_to, order)
+    return len(lines)
+
+
+def run_jobs(argv: Sequence[str], jobs: int, threads: Optional[int]):
+    "run every shard of a command line as a process of its own and wait for them all"
+    threads = threads or max(1, (os.cpu_count() or 1) // jobs)
+    processes = [subprocess.Popen([sys.executable, '-m', 'uk1e2.eval', *argv, '--jobs', '1',
+                                   '--shard', f'{index}/{jobs}', '--threads', str(threads)])
+                 for index in range(jobs)]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise SystemExit(f'shards {" ".join(map(str, failed))} of {jobs} failed, run them again with --shard to resume')
+
+
+def parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--model', help="the backend's model, see its help")
+    common.add_argument('--dataset', type=Path, default=Path(CACHED_DATASET),
+                        help='audio store made by uk1e2.eval.generate_cache_folder')
+    common.add_argument('--save_to', type=Path, help="where to save results, the backend's file of its model by default")
+    common.add_argument('--device', help='cpu, cuda or cuda:N, the first GPU when there is one by default')
+    common.add_argument('--threads', type=int, help='CPU threads of torch')
+    common.add_argument('--max_samples', type=int, default=MAX_SAMPLES,
+                        help='samples of padded audio in a batch, 16 utterances of 10 seconds by default')
+    common.add_argument('--shard', type=parse_shard, default=(0, 1), help='evaluate shard index/count into save_to.index-of-count')
+    common.add_argument('-j', '--jobs', type=int, default=1, help='run this many shards as processes and merge them')
+    common.add_argument('--logits', type=Path, default=Path(LOGITS_FOLDER),
+                        help='folder to keep outputs of CTC models in, so other decoders and resumed runs read them')
+    common.add_argument('--no_logits', dest='logits', action='store_const', const=None, help='run the model every time')
+    common.add_argument('--logits_dtype', choices=DTYPES, default='float32',
+                        help='float32 keeps exactly what the model outputs, float16 halves the store but can change results')
+
+    parser = argparse.ArgumentParser(prog='python -m uk1e2.eval', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, cls in BACKENDS.items():
+        backend = subparsers.add_parser(name, parents=[common], help=cls.__doc__,
+                                        description=f'{cls.__doc__}; the model is {cls.model_name} by default.')
+        cls.add_arguments(backend)
+    merge = subparsers.add_parser('merge', help='put results of shards together')
+    merge.add_argument('save_to', type=Path)
+    merge.add_argument('--shards', type=int, required=True, help='the count of --shard')
+    merge.add_argument('--dataset', type=Path, default=Path(CACHED_DATASET), help='audio store to order results by')
+    merge.add_argument('--model', help='also move outputs of this CTC model that the shards kept into its logit store')
+    merge.add_argument('--logits', type=Path, default=Path(LOGITS_FOLDER), help='folder of logit stores')
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parser().parse_args(argv)
+
+    if args.command == 'merge':
+        try:
+            count = merge(args.save_to, args.shards, args.dataset)
+        except (FileNotFoundError, ValueError) as e:
+            raise SystemExit(e)
+        print(f'{args.save_to}: {count} results of {args.shards} shards', file=sys.stderr)
+        if args.model:
+            moved = merge_logits(args.logits, args.model, args.shards, args.dataset)
+            print(f'{args.logits}: {moved} utterances of {args.model} from {args.shards} shards', file=sys.stderr)
+        return
+
+    cls = BACKENDS[args.command]
+    model_name = args.model or cls.model_name
+    save_to = args.save_to or cls.results_file(model_name)
+    searching = len(getattr(args, 'alpha', ())) * len(getattr(args, 'beta', ())) > 1
+    if (args.jobs > 1 or args.shard[1] > 1) and searching:
+        raise SystemExit('a search of language model weights needs the whole test set, it does not run in shards')
+    if args.jobs > 1:
+        run_jobs(argv, args.jobs, args.threads)
+        count = merge(save_to, args.jobs, args.dataset)
+        print(f'{save_to}: {count} results of {args.jobs} shards', file=sys.stderr)
+        if cls.ctc and args.logits:
+            moved = merge_logits(args.logits, model_name, args.jobs, args.dataset)
+            print(f'{args.logits}: {moved} utterances of {model_name} from {args.jobs} shards', file=sys.stderr)
+        return
+
+    if args.threads:
+        import torch
+
+        torch.set_num_threads(args.threads)
+    store = AudioStore(args.dataset)
+    with cls(model_name, torch_device(args.device), args) as backend:
+        if searching:
+            search(backend, store, args.max_samples, args.logits, args.logits_dtype)
+        else:
+            evaluate(backend, store, save_to, args.max_samples, args.shard, args.logits, args.logits_dtype)
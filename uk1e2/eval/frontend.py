@@ -0,0 +1,189 @@
+"""
+Feed test set audio to models straight from memory.
+
+NeMo models are run on padded batches of arrays with the settings
+asr_model.transcribe uses, Whisper takes arrays as they are.
+
+    python -m uk1e2.eval.frontend benchmark segment.audio -n 1000
+"""
+
+from contextlib import contextmanager
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+import time
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+
+def pad_batch(speech: Sequence[np.ndarray], device=None) -> Tuple[torch.Tensor, torch.Tensor]:
+    "a zero-padded float32 batch of shape (batch, samples) and the length of every utterance"
+    lengths = torch.tensor([len(s) for s in speech], dtype=torch.long)
+    signal = torch.zeros(len(speech), int(lengths.max()) if len(speech) else 0, dtype=torch.float32)
+    for row, s in zip(signal, speech):
+        row[:len(s)] = torch.from_numpy(np.asarray(s, dtype=np.float32))
+    return signal.to(device), lengths.to(device)
+
+
+@contextmanager
+def nemo_inference(asr_model):
+    "no dither and no padding of features, like asr_model.transcribe"
+    featurizer = getattr(asr_model.preprocessor, 'featurizer', None)
+    dither, pad_to = getattr(featurizer, 'dither', None), getattr(featurizer, 'pad_to', None)
+    if dither is not None:
+        featurizer.dither = 0.0
+    if pad_to is not None:
+        featurizer.pad_to = 0
+    training = asr_model.training
+    asr_model.eval()
+    try:
+        with torch.inference_mode():
+            yield
+    finally:
+        asr_model.train(training)
+        if dither is not None:
+            featurizer.dither = dither
+        if pad_to is not None:
+            featurizer.pad_to = pad_to
+
+
+def nemo_forward(asr_model, speech: Sequence[np.ndarray]) -> Tuple[torch.Tensor, torch.Tensor]:
+    "log probabilities of shape (batch, frames, vocabulary) and the number of frames of every utterance"
+    signal, lengths = pad_batch(speech, asr_model.device)
+    with nemo_inference(asr_model):
+        log_probs, encoded_len, _ = asr_model.forward(input_signal=signal, input_signal_length=lengths)
+    return log_probs, encoded_len
+
+
+def nemo_log_probs(asr_model, speech: Sequence[np.ndarray]) -> List[np.ndarray]:
+    "log probabilities of every utterance, like asr_model.transcribe(paths, logprobs=True)"
+    log_probs, encoded_len = nemo_forward(asr_model, speech)
+    log_probs, encoded_len = log_probs.cpu().numpy(), encoded_len.cpu().numpy()
+    return [log_probs[i, :encoded_len[i]] for i in range(len(speech))]
+
+
+def nemo_greedy(asr_model, log_probs: torch.Tensor, encoded_len: torch.Tensor) -> List[str]:
+    "greedy transcripts of log probabilities of shape (batch, frames, vocabulary)"
+    hypotheses = asr_model.decoding.ctc_decoder_predictions_tensor(log_probs, decoder_lengths=encoded_len)
+    if isinstance(hypotheses, tuple):  # NeMo 1.x returns best and all hypotheses
+        hypotheses = hypotheses[0]
+    return [getattr(hypothesis, 'text', hypothesis) for hypothesis in hypotheses]
+
+
+def nemo_transcribe(asr_model, speech: Sequence[np.ndarray]) -> List[str]:
+    "greedy transcripts of a batch, like asr_model.transcribe(paths)"
+    return nemo_greedy(asr_model, *nemo_forward(asr_model, speech))
+
+
+def nemo_decode(asr_model, log_probs: Sequence[np.ndarray]) -> List[str]:
+    "greedy transcripts of log probabilities of every utterance, like nemo_transcribe"
+    lengths = torch.tensor([len(lp) for lp in log_probs], dtype=torch.long)
+    padded = torch.zeros(len(log_probs), int(lengths.max()), log_probs[0].shape[-1])
+    for row, lp in zip(padded, log_probs):
+        row[:len(lp)] = torch.from_numpy(np.asarray(lp, dtype=np.float32))
+    return nemo_greedy(asr_model, padded, lengths)
+
+
+def wav2vec2_logits(model, processor, speech: Sequence[np.ndarray], device=None) -> List[np.ndarray]:
+    "logits of every utterance of a batch, without the frames of padding"
+    features = processor(speech, sampling_rate=16_000, padding=True, return_tensors='pt')
+    attention_mask = features.attention_mask.to(device)
+    with torch.no_grad():
+        logits = model(features.input_values.to(device), attention_mask=attention_mask).logits
+    frames = model._get_feat_extract_output_lengths(attention_mask.sum(-1)).cpu().numpy()
+    logits = logits.float().cpu().numpy()
+    return [logits[i, :frames[i]] for i in range(len(speech))]
+
+
+def write_temp_wavs(speech: Sequence[np.ndarray]) -> List[str]:
+    "what the test scripts did before: every utterance goes through a temporary wav file"
+    import scipy.io.wavfile as wavfile
+
+    tmp_files = []
+    for s in speech:
+        with NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
+            wavfile.write(tmp.name, 16_000, np.asarray(s))
+            tmp_files.append(tmp.name)
+    return tmp_files
+
+
+def tiny_nemo_model():
+    "a randomly initialized character CTC model with a small Jasper encoder, enough to time the front end"
+    from omegaconf import OmegaConf
+    import nemo.collections.asr as nemo_asr
+
+    labels = list(" 'абвгґдеєжзиіїйклмнопрстуфхцчшщьюя")
+    block = {'filters': 64, 'repeat': 1, 'kernel': [11], 'stride': [1], 'dilation': [1], 'dropout': 0.0, 'residual': False}
+    cfg = OmegaConf.create({
+        'sample_rate': 16000,
+        'labels': labels,
+        'preprocessor': {'_target_': 'nemo.collections.asr.modules.AudioToMelSpectrogramPreprocessor',
+                         'sample_rate': 16000, 'features': 64, 'normalize': 'per_feature'},
+        'encoder': {'_target_': 'nemo.collections.asr.modules.ConvASREncoder', 'feat_in': 64, 'activation': 'relu',
+                    'jasper': [{**block, 'stride': [2]}, block]},
+        'decoder': {'_target_': 'nemo.collections.asr.modules.ConvASRDecoder', 'feat_in': 64,
+                    'num_classes': len(labels), 'vocabulary': labels},
+    })
+    return nemo_asr.models.EncDecCTCModel(cfg=cfg).to('cpu').eval()
+
+
+def benchmark(store_folder: Path, utterances: int = 1000, batch_size: int = 16):
+    """
+    Time 1000 utterances through a tiny NeMo model and the Whisper front end on the CPU,
+    through temporary wav files like before and from memory.
+    """
+    import whisper
+
+    from .store import AudioStore
+
+    store = AudioStore(store_folder)
+    batches = [store.batch(range(start, min(start + batch_size, utterances, len(store))))
+               for start in range(0, min(utterances, len(store)), batch_size)]
+    count = sum(len(batch['speech']) for batch in batches)
+    torch.set_num_threads(1)
+    asr_model = tiny_nemo_model()
+
+    def nemo_files(speech):
+        tmp_files = write_temp_wavs(speech)
+        results = asr_model.transcribe(tmp_files, batch_size=batch_size, verbose=False)
+        for tf in tmp_files:
+            os.unlink(tf)
+        return results
+
+    def whisper_files(speech):
+        tmp_files = write_temp_wavs(speech)
+        mels = [whisper.log_mel_spectrogram(f) for f in tmp_files]
+        for tf in tmp_files:
+            os.unlink(tf)
+        return mels
+
+    def whisper_arrays(speech):
+        return [whisper.log_mel_spectrogram(s) for s in speech]
+
+    for name, files, arrays in [('nemo', nemo_files, lambda speech: nemo_transcribe(asr_model, speech)),
+                                ('whisper', whisper_files, whisper_arrays)]:
+        timings = []
+        for run in (files, arrays):
+            t0 = time.time()
+            for batch in batches:
+                run(batch['speech'])
+            timings.append(time.time() - t0)
+        per_1000 = [t / count * 1000 for t in timings]
+        print(f'{name}: temporary wavs {per_1000[0]:.2f}s, arrays {per_1000[1]:.2f}s per 1000 utterances, '
+              f'saving {per_1000[0] - per_1000[1]:.2f}s')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('benchmark', help='compare temporary wav files with arrays on the CPU')
+    bench.add_argument('store', type=Path, help='audio store made by uk1e2.eval.generate_cache_folder')
+    bench.add_argument('-n', '--utterances', type=int, default=1000)
+    bench.add_argument('--batch_size', type=int, default=16)
+    args = parser.parse_args()
+
+    benchmark(args.store, args.utterances, args.batch_size)
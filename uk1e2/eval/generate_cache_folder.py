@@ -1,13 +1,12 @@
+import argparse
+import json
+import multiprocessing
 import os
-import torchaudio
 
-from datasets import load_dataset
+import torchaudio
 
-# where to save the cached dataset
-cache_folder = 'segment.data'
+from uk1e2.eval.store import AudioStoreWriter, DTYPES, SAMPLING_RATE
 
-# number of processes to use
-processes = os.cpu_count() or 1
 
 def add_paths(example):
     path = f"data/segments/wav/{example['id']}.wav"
@@ -17,24 +16,37 @@ def add_paths(example):
 def path_exists(example):
     return os.path.exists(example["path"]) and example["text"].strip() != ""
 
-def map_to_array(batch):
-    path = batch["path"]
+def map_to_array(example):
+    path = example["path"]
     speech, sampling_rate = torchaudio.load(path)
-    if sampling_rate != 16_000:
-        resampler = torchaudio.transforms.Resample(orig_freq=sampling_rate, new_freq=16_000)
-        batch["speech"] = resampler.forward(speech.squeeze(0)).numpy()
+    if sampling_rate != SAMPLING_RATE:
+        resampler = torchaudio.transforms.Resample(orig_freq=sampling_rate, new_freq=SAMPLING_RATE)
+        speech = resampler.forward(speech.squeeze(0))
     else:
-        batch["speech"] = speech.squeeze(0).numpy()
-    batch["lengths"] = len(batch["speech"])
-    return batch
-
-# load the dataset
-ds = load_dataset('json', data_files={'test': 'local_utterances.jsonl'})['test']
-
-# process the dataset
-ds = ds.map(add_paths).filter(path_exists).map(map_to_array, keep_in_memory=False, num_proc=processes)
-
-# save the cached dataset to the disk
-ds.save_to_disk(cache_folder)
-
-print('Finished.')
+        speech = speech.squeeze(0)
+    return example, speech.numpy()
+
+def read_examples(filename):
+    with open(filename) as f:
+        for line in f:
+            example = add_paths(json.loads(line))
+            if path_exists(example):
+                yield example
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode test set segments into an audio store for uk1e2.eval')
+    parser.add_argument('--utterances', default='local_utterances.jsonl', help='utterances to evaluate on')
+    # where to save the cached dataset
+    parser.add_argument('--cache_folder', default='segment.audio', help='audio store to write')
+    parser.add_argument('--dtype', choices=DTYPES, default='float32', help='int16 halves the size of the store')
+    # number of processes to use
+    parser.add_argument('-j', '--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # decode in parallel, samples are written in order as soon as they are ready
+    with multiprocessing.Pool(args.processes) as pool, AudioStoreWriter(args.cache_folder, dtype=args.dtype) as writer:
+        for example, speech in pool.imap(map_to_array, read_examples(args.utterances), chunksize=16):
+            writer.add(example, speech)
+
+    print('Finished.')
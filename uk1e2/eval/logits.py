@@ -0,0 +1,306 @@
+"""
+Outputs of acoustic models, kept to decode them again without the model.
+
+    logits/<model>/logits.bin   frames of all utterances back to back, float16 or float32
+    logits/<model>/index.tsv    utterance id, offset and number of frames, a line per utterance
+    logits/<model>/meta.json    model name, vocabulary size, value type and source
+
+Every model has a folder of its own, so a store is keyed by model name and
+utterance id. The source in meta.json is the size and modification time of
+a model that is a local file or folder and of the audio store the frames were
+computed on; a store of another source is emptied before it is used.
+
+A test script keeps what the model gives its decoder: log probabilities of
+NeMo models, logits of wav2vec2. Utterances are appended as the model runs,
+frames first and their index lines after, so a stopped run keeps all it has
+indexed. Decoders of the same model (greedy, pyctcdecode,
+Wav2Vec2ProcessorWithLM) then read memory-mapped frames instead of running
+the model again.
+
+A shard i/n of a run appends to logits/<model>.i-of-n, reading frames that
+logits/<model> already has, and merge_logits moves them into logits/<model>.
+
+    python -m uk1e2.eval.logits benchmark segment.audio
+"""
+
+from contextlib import nullcontext, suppress
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# float32 keeps what the model gave, float16 halves the store but can change decoded texts
+DTYPES = ('float32', 'float16')
+# frames of padding that Wav2Vec2ProcessorWithLM.batch_decode drops
+PAD = -100.0
+
+
+def model_folder(folder: Path, model_name: str, shard: Tuple[int, int] = (0, 1)) -> Path:
+    "folder of the store of a model, or of a shard index/count of its run"
+    name = model_name.replace('/', '--')
+    return Path(folder) / (name if shard[1] == 1 else f'{name}.{shard[0]}-of-{shard[1]}')
+
+
+def file_stats(path: Path) -> List:
+    "[relative path, size, mtime_ns] of a file or of every file in a folder"
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    return [[str(p.relative_to(path)) if p != path else '', p.stat().st_size, p.stat().st_mtime_ns] for p in files]
+
+
+def source_of(model_name: str, dataset: Optional[Path] = None) -> Dict:
+    "what frames of a store depend on besides the model name: local model files and the audio store"
+    return {
+        'model': file_stats(model_name) if os.path.exists(model_name) else None,  # a hub model is known by its name
+        'dataset': [str(Path(dataset).resolve()), file_stats(dataset)] if dataset else None,
+    }
+
+
+class LogitStore:
+    """
+    Frames of the utterances a model has run on, appended and read in one process.
+
+    Processes of shards of a run append to stores of their own and read frames
+    of the store of the model as a base: that one is opened with writable=False,
+    which leaves its files alone.
+    """
+
+    def __init__(self, folder: Path, model_name: str, dtype: str = 'float32', dataset: Optional[Path] = None,
+                 shard: Tuple[int, int] = (0, 1), writable: bool = True, base: Optional['LogitStore'] = None):
+        if dtype not in DTYPES:
+            raise ValueError(f'logits can be stored as {" or ".join(DTYPES)}, not {dtype}')
+        self.folder = model_folder(folder, model_name, shard)
+        self.writable = writable
+        self.base = base
+        meta_path = self.folder / 'meta.json'
+        source = source_of(model_name, dataset)
+        self.meta = json.loads(meta_path.read_text()) if meta_path.exists() else None
+        if self.meta is not None and self.meta.get('source') != source:
+            if writable:
+                print(f'{self.folder} has frames of another model file or audio store, starting it over', file=sys.stderr)
+                for name in ('meta.json', 'index.tsv', 'logits.bin'):
+                    with suppress(FileNotFoundError):
+                        (self.folder / name).unlink()
+            self.meta = None
+        # a store that exists keeps its value type
+        if self.meta is None:
+            self.meta = {'model_name': model_name, 'vocabulary': None, 'dtype': dtype, 'source': source}
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.index: Dict[str, Tuple[int, int]] = {}
+        self.frames = 0
+        self.bin_path = self.folder / 'logits.bin'
+        self.bin = self.index_file = None
+        self.pending: List[str] = []
+        self.mapped: Optional[np.ndarray] = None
+        index_path = self.folder / 'index.tsv'
+        if not writable:
+            if self.meta['vocabulary'] is not None and index_path.exists():
+                data = index_path.read_bytes()
+                self._read_index(data[:data.rfind(b'\n') + 1])
+            return
+
+        # cut off a torn index line and frames without one, a stopped run leaves them behind
+        self.folder.mkdir(parents=True, exist_ok=True)
+        index_path.touch()
+        with open(index_path, 'rb+') as f:
+            data = f.read()
+            complete = data.rfind(b'\n') + 1
+            f.truncate(complete)
+        self._read_index(data[:complete])
+        with open(self.bin_path, 'ab') as f:
+            f.truncate(self.frames * (self.meta['vocabulary'] or 0) * self.dtype.itemsize)
+
+        self.bin = open(self.bin_path, 'ab')
+        self.index_file = open(index_path, 'a', encoding='utf-8')
+
+    def _read_index(self, data: bytes):
+        for line in data.decode('utf-8').splitlines():
+            utterance_id, offset, frames = line.split('\t')
+            self.index[utterance_id] = int(offset), int(frames)
+            self.frames = max(self.frames, int(offset) + int(frames))
+
+    def __contains__(self, utterance_id: str) -> bool:
+        return utterance_id in self.index or (self.base is not None and utterance_id in self.base)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, utterance_id: str, logits: np.ndarray):
+        "frames of shape (frames, vocabulary), indexed by flush"
+        if not self.writable:
+            raise ValueError(f'{self.folder} is opened to read frames only')
+        if self.meta['vocabulary'] is None:
+            self.meta['vocabulary'] = int(logits.shape[-1])
+            (self.folder / 'meta.json').write_text(json.dumps(self.meta))
+        elif logits.shape[-1] != self.meta['vocabulary']:
+            raise ValueError(f'{self.folder} keeps frames of {self.meta["vocabulary"]} values, not {logits.shape[-1]}')
+        self.bin.write(np.ascontiguousarray(logits, dtype=self.dtype).tobytes())
+        self.index[utterance_id] = self.frames, len(logits)
+        self.pending.append(f'{utterance_id}\t{self.frames}\t{len(logits)}\n')
+        self.frames += len(logits)
+
+    def flush(self):
+        if not self.writable:
+            return
+        self.bin.flush()
+        self.index_file.writelines(self.pending)
+        self.index_file.flush()
+        self.pending = []
+
+    def view(self, utterance_id: str) -> np.ndarray:
+        "frames of an utterance as stored, mapped from disk"
+        if utterance_id not in self.index and self.base is not None and utterance_id in self.base:
+            return self.base.view(utterance_id)
+        offset, frames = self.index[utterance_id]
+        if self.mapped is None or offset + frames > len(self.mapped):
+            if self.bin is not None:
+                self.bin.flush()
+            self.mapped = np.memmap(self.bin_path, dtype=self.dtype, mode='r').reshape(-1, self.meta['vocabulary'])
+        return self.mapped[offset:offset + frames]
+
+    def get(self, utterance_id: str) -> np.ndarray:
+        "float32 frames of an utterance"
+        return self.view(utterance_id).astype(np.float32)
+
+    def compute(self, ids: Sequence[str], speech: Sequence[np.ndarray],
+                forward: Callable[[Sequence[np.ndarray]], List[np.ndarray]], views: bool = False) -> List[np.ndarray]:
+        "frames of utterances of a batch, the model runs only on those not in the store"
+        missing = [i for i, utterance_id in enumerate(ids) if utterance_id not in self]
+        if missing:
+            for i, logits in zip(missing, forward([speech[i] for i in missing])):
+                self.add(ids[i], logits)
+            self.flush()
+        return [self.view(utterance_id) if views else self.get(utterance_id) for utterance_id in ids]
+
+    def close(self):
+        if self.writable:
+            self.flush()
+            self.bin.close()
+            self.index_file.close()
+        if self.base is not None:
+            self.base.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_logits(folder: Optional[Path], model_name: str, dtype: str = 'float32', dataset: Optional[Path] = None,
+                shard: Tuple[int, int] = (0, 1)):
+    "a store of a model, or of a shard of its run, in folder to use in a with statement, or None when there is no folder"
+    if not folder:
+        return nullcontext()
+    base = LogitStore(folder, model_name, dtype, dataset, writable=False) if shard[1] > 1 else None
+    return LogitStore(folder, model_name, dtype, dataset, shard, base=base)
+
+
+def merge_logits(folder: Path, model_name: str, shards: int, dataset: Optional[Path] = None) -> int:
+    "move frames of the stores of shards of a model into the store of the model; the number of utterances moved"
+    moved = 0
+    store = None
+    try:
+        for index in range(shards):
+            shard_folder = model_folder(folder, model_name, (index, shards))
+            if not shard_folder.exists():
+                continue
+            with LogitStore(folder, model_name, dataset=dataset, shard=(index, shards), writable=False) as shard:
+                if store is None:
+                    store = LogitStore(folder, model_name, shard.meta['dtype'], dataset)
+                for utterance_id in shard.index:
+                    if utterance_id not in store:
+                        store.add(utterance_id, shard.view(utterance_id))
+                        moved += 1
+                store.flush()
+            shutil.rmtree(shard_folder)
+    finally:
+        if store is not None:
+            store.close()
+    return moved
+
+
+def logits_of(store: Optional[LogitStore], ids: Sequence[str], speech: Sequence[np.ndarray],
+              forward: Callable[[Sequence[np.ndarray]], List[np.ndarray]], views: bool = False) -> List[np.ndarray]:
+    "frames of utterances of a batch from a store, or from the model when there is no store"
+    if store is None:
+        return forward(speech)
+    return store.compute(ids, speech, forward, views)
+
+
+def pad_logits(logits: Sequence[np.ndarray]) -> np.ndarray:
+    "a float32 batch of shape (batch, frames, vocabulary), padded with frames of PAD"
+    padded = np.full((len(logits), max(len(x) for x in logits), logits[0].shape[-1]), PAD, dtype=np.float32)
+    for row, x in zip(padded, logits):
+        row[:len(x)] = x
+    return padded
+
+
+def benchmark(store_folder: Path, logits_folder: Path, utterances: int = 1000, max_samples: int = 16 * 10 * 16_000):
+    """
+    Time a tiny wav2vec2 model over the audio, writing its logits to a store and reading them back,
+    and count the greedy and beam search texts that stored logits keep.
+    """
+    import torch
+    from pyctcdecode import build_ctcdecoder
+    from transformers import Wav2Vec2FeatureExtractor
+
+    from .batching import length_batches, tiny_wav2vec2
+    from .frontend import wav2vec2_logits
+    from .store import AudioStore
+
+    store = AudioStore(store_folder)
+    count = min(utterances, len(store))
+    batches = length_batches(store.lengths[:count], max_samples)
+    model = tiny_wav2vec2()
+    feature_extractor = Wav2Vec2FeatureExtractor(return_attention_mask=True, do_normalize=True)
+    torch.set_num_threads(1)
+    labels = [''] + [chr(ord('а') + i) for i in range(model.config.vocab_size - 1)]
+    beam_search = build_ctcdecoder(labels)
+
+    def forward(speech):
+        return wav2vec2_logits(model, feature_extractor, speech)
+
+    def decoders(logits):
+        greedy = [''.join(labels[i] for i in np.argmax(x, axis=-1)) for x in logits]
+        return greedy, [beam_search.decode(np.asarray(x, dtype=np.float32), beam_width=4) for x in logits[:100]]
+
+    t0 = time.time()
+    logits = [x for indices in batches for x in forward(store.batch(indices)['speech'])]
+    print(f'{count} utterances: the model {time.time() - t0:.2f}s')
+    texts = decoders(logits)
+    for dtype in DTYPES:
+        shutil.rmtree(model_folder(logits_folder, 'tiny'), ignore_errors=True)
+        timings = []
+        with LogitStore(logits_folder, 'tiny', dtype) as logit_store:
+            for run in range(2):
+                t0 = time.time()
+                stored = []
+                for indices in batches:
+                    batch = store.batch(indices)
+                    stored += logit_store.compute(batch['id'], batch['speech'], forward)
+                timings.append(time.time() - t0)
+            size = logit_store.bin_path.stat().st_size
+        same = [sum(a == b for a, b in zip(before, after)) for before, after in zip(texts, decoders(stored))]
+        print(f'{dtype} store of {size / 2**20:.1f} MB: the model into the store {timings[0]:.2f}s, '
+              f'read back {timings[1]:.2f}s; same greedy texts {same[0]} of {count}, beam search {same[1]} of 100')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('benchmark', help='compare running a tiny model for every decoder with a store')
+    bench.add_argument('store', type=Path, help='audio store made by uk1e2.eval.generate_cache_folder')
+    bench.add_argument('--logits', type=Path, default=Path('logits.benchmark'))
+    bench.add_argument('-n', '--utterances', type=int, default=1000)
+    args = parser.parse_args()
+
+    benchmark(args.store, args.logits, args.utterances)
@@ -0,0 +1,222 @@
+"""
+Result files of the test scripts, written on a background thread.
+
+Inference puts the columns of every finished batch on a queue, and a
+writer thread scores them, formats lines and appends them to the result
+file, so the model never waits for metrics or the disk. A line is
+
+    id|target|predicted|wer|cer
+
+and ids already in the file are known when a writer opens it, so a run
+that was stopped resumes with the utterances it has not written yet.
+Utterances whose predictions are left out of results, like Whisper's
+that fail the checks, have their ids in a .skipped file next to it, so
+they are not run again either. A line torn by a crash is cut off first.
+Once a run is complete the file is rewritten in dataset order.
+
+    python -m uk1e2.eval.results benchmark segment.audio
+"""
+
+from contextlib import suppress
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+
+
+# batches waiting for the writer before inference blocks
+MAX_PENDING = 8
+
+
+def result_id(path: str) -> str:
+    "the id of an utterance in result lines: the name of its wav file"
+    return path.split('/')[-1].replace('.wav', '')
+
+
+def skipped_file(filename: Path) -> Path:
+    "ids of utterances left out of a result file, a line each"
+    return Path(f'{filename}.skipped')
+
+
+def complete_lines(filename: Path) -> List[str]:
+    "complete lines of a file, a torn last line is cut off"
+    if not filename.exists():
+        return []
+    with open(filename, 'rb+') as f:
+        data = f.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            f.truncate(complete)
+    return data[:complete].decode('utf-8').splitlines()
+
+
+def written_ids(filename: Path) -> Set[str]:
+    "ids of complete lines of a result file and of utterances it has left out"
+    filename = Path(filename)
+    return {line.split('|', 1)[0] for line in complete_lines(filename)} | set(complete_lines(skipped_file(filename)))
+
+
+def sort_lines(filename: Path, order: Sequence[str]):
+    "rewrite a result file in the order of ids, lines of other ids go first as they are"
+    position = {utterance_id: i for i, utterance_id in enumerate(order)}
+    with open(filename, encoding='utf-8') as f:
+        lines = f.readlines()
+    lines.sort(key=lambda line: position.get(line.split('|', 1)[0], -1))
+    tmp = Path(f'{filename}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    os.replace(tmp, filename)
+
+
+class ResultWriter:
+    """
+    Format and append the results of batches on a thread.
+
+    format_lines turns columns of a batch into (id, line) pairs, a line of None leaves
+    the utterance out of the file and records its id as skipped.
+    """
+
+    def __init__(self, filename: Path, format_lines: Callable[[Dict[str, List]], Iterable[str]],
+                 order: Sequence[str] = (), max_pending: int = MAX_PENDING):
+        self.filename = Path(filename)
+        self.format_lines = format_lines
+        self.order = order
+        self.written = written_ids(self.filename)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.run, name='ResultWriter', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            while True:
+                results = self.queue.get()
+                if results is None:
+                    break
+                if self.error:
+                    continue  # drain the queue so put never blocks
+                try:
+                    skipped = []
+                    for utterance_id, line in self.format_lines(results):
+                        if line is None:
+                            skipped.append(f'{utterance_id}\n')
+                        else:
+                            f.write(line)
+                    f.flush()
+                    if skipped:
+                        with open(skipped_file(self.filename), 'a', encoding='utf-8') as s:
+                            s.writelines(skipped)
+                except BaseException as e:
+                    self.error = e
+
+    def pending(self) -> np.ndarray:
+        "indices of utterances of order that are not in the file yet"
+        return np.array([i for i, utterance_id in enumerate(self.order) if utterance_id not in self.written], dtype=np.int64)
+
+    def put(self, results: Dict[str, List]):
+        "queue columns of a batch, raises what went wrong with an earlier batch"
+        if self.error:
+            raise self.error
+        self.queue.put(results)
+
+    def close(self, complete: bool = True):
+        "wait for queued batches, rewrite the file in order if the run is complete"
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        if complete and self.order:
+            sort_lines(self.filename, self.order)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(complete=exc_type is None)
+
+
+def benchmark(store_folder: Path, save_to: Path, utterances: int = 2000, inference: float = 0.05,
+              max_samples: int = 16 * 10 * 16_000):
+    """
+    Time a run where inference takes a fixed time per batch, standing in for a GPU,
+    with every batch scored and written in the loop and by a ResultWriter; then stop a run halfway
+    and resume it, and check the file has every utterance once.
+    """
+    from .batching import length_batches
+    from .score import error_rates
+    from .store import AudioStore
+
+    store = AudioStore(store_folder)
+    count = min(utterances, len(store))
+    ids = [result_id(row['path']) for row in store.rows[:count]]
+
+    # sentences of 30 words, every fifth prediction loses its last word
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f'слово{i}' for i in range(5000)])
+    targets = [' '.join(words) for words in vocabulary[rng.integers(0, len(vocabulary), (count, 30))]]
+
+    def predict(indices):
+        time.sleep(inference)
+        batch = store.batch(indices)
+        target = [targets[i] for i in indices]
+        predicted = [text if i % 5 else text.rsplit(' ', 1)[0] for i, text in zip(indices, target)]
+        return {'path': batch['path'], 'target': target, 'predicted': predicted}
+
+    def format_lines(results):
+        wers, cers = error_rates(results['target'], results['predicted'])
+        for path, target, row, wer, cer in zip(results['path'], results['target'], results['predicted'], wers, cers):
+            yield result_id(path), f'{result_id(path)}|{target}|{row}|{round(float(wer), 4)}|{round(float(cer), 4)}\n'
+
+    def run(stop_after: Optional[int] = None):
+        with ResultWriter(save_to, format_lines, order=ids) as writer:
+            todo = writer.pending()
+            for n, indices in enumerate(length_batches(store.lengths[todo], max_samples)):
+                if n == stop_after:
+                    raise KeyboardInterrupt
+                writer.put(predict(todo[indices]))
+
+    with suppress(FileNotFoundError):
+        Path(save_to).unlink()
+    t0 = time.time()
+    batches = length_batches(store.lengths[:count], max_samples)
+    with open(save_to, 'w') as f:
+        for indices in batches:
+            f.writelines(format_lines(predict(indices)))
+            f.flush()
+    t1 = time.time()
+    sort_lines(save_to, ids)
+    expected = Path(save_to).read_text()
+    Path(save_to).unlink()
+    run()
+    t2 = time.time()
+    same = Path(save_to).read_text() == expected
+    Path(save_to).unlink()
+    try:
+        run(stop_after=len(batches) // 2)
+    except KeyboardInterrupt:
+        pass
+    stopped = len(written_ids(save_to))
+    run()
+    resumed = Path(save_to).read_text() == expected
+    print(f'{count} utterances in {len(batches)} batches: writing in the loop {t1 - t0:.2f}s, '
+          f'on a thread {t2 - t1:.2f}s, same file: {same}; '
+          f'stopped with {stopped} written, resumed to the same file: {resumed}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('benchmark', help='time writing results on a thread and resuming a stopped run')
+    bench.add_argument('store', type=Path, help='audio store made by uk1e2.eval.generate_cache_folder')
+    bench.add_argument('--save_to', type=Path, default=Path('results.benchmark.txt'))
+    bench.add_argument('-n', '--utterances', type=int, default=2000)
+    bench.add_argument('--inference', type=float, default=0.05, help='seconds of inference per batch')
+    args = parser.parse_args()
+
+    benchmark(args.store, args.save_to, args.utterances, args.inference)
@@ -0,0 +1,366 @@
+"""
+Word and character error rates of whole test sets at once.
+
+Utterances are encoded as integer arrays, grouped by length, and the edit
+distance matrices of a whole group are filled together with NumPy, one
+anti-diagonal at a time. Insertions, deletions and substitutions are
+counted with the tie-breaking of Kaldi's LevenshteinEditDistance, so the
+report is what compute-wer --mode=present prints for every pair of
+reference and hypothesis files.
+
+    python -m uk1e2.eval.score --ref data/local/text.interview data/local/text.news --hyp exp/whisper.hyp
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+import re
+import sys
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+
+BATCH_SIZE = 512
+WORD = 64
+KALDI_WHITESPACE = re.compile('[ \t\r]+')
+JIWER_SPACES = re.compile(r'\s\s+')
+# an alignment cell packs its cost, insertions and deletions in 21 bits each
+INS_SHIFT, COST_SHIFT = 21, 42
+COUNT_MASK = (1 << INS_SHIFT) - 1
+COST, INS, DEL = 1 << COST_SHIFT, 1 << INS_SHIFT, 1
+
+
+def read_text(filename: Path) -> List[Tuple[str, List[str]]]:
+    "utterance ids and words of a Kaldi text archive, in file order"
+    utterances = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            fields = [field for field in KALDI_WHITESPACE.split(line.rstrip('\n')) if field]
+            if fields:
+                utterances.append((fields[0], fields[1:]))
+    return utterances
+
+
+def encode(sequences: Iterable[Sequence], vocabulary: Dict) -> List[np.ndarray]:
+    "sequences of tokens as arrays of integers, new tokens are added to vocabulary"
+    return [np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for token in sequence), dtype=np.int32)
+            for sequence in sequences]
+
+
+def encode_chars(texts: Iterable[str]) -> List[np.ndarray]:
+    "texts as arrays of code points"
+    return [np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32) for text in texts]
+
+
+def kaldi_edit_distance(ref: Sequence, hyp: Sequence) -> Tuple[int, int, int, int]:
+    "errors, insertions, deletions and substitutions, a line by line port of Kaldi's LevenshteinEditDistance"
+    e = [(i, 0, i, 0) for i in range(len(ref) + 1)]  # total cost, ins, del, sub
+    for h in range(1, len(hyp) + 1):
+        cur = [(e[0][0] + 1, e[0][1] + 1, e[0][2], e[0][3])]
+        for r in range(1, len(ref) + 1):
+            ins_err = e[r][0] + 1
+            del_err = cur[r - 1][0] + 1
+            mismatch = hyp[h - 1] != ref[r - 1]
+            sub_err = e[r - 1][0] + mismatch
+            if sub_err < ins_err and sub_err < del_err:
+                total, ins, dele, sub = e[r - 1]
+                cur.append((sub_err, ins, dele, sub + mismatch))
+            elif del_err < ins_err:
+                total, ins, dele, sub = cur[r - 1]
+                cur.append((del_err, ins, dele + 1, sub))
+            else:
+                total, ins, dele, sub = e[r]
+                cur.append((ins_err, ins + 1, dele, sub))
+        e = cur
+    return e[-1]
+
+
+def align_batch(refs: Sequence[np.ndarray], hyps: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Errors, insertions, deletions and substitutions of every pair, shape (4, batch).
+
+    Cell (h, r) of an edit distance matrix depends on cells of the two previous
+    anti-diagonals only, so every anti-diagonal of every pair is filled at once.
+    Diagonals are indexed by r, the position in the reference, and a cell holds
+    its cost, insertions and deletions packed in one integer (see COST, INS, DEL).
+    """
+    batch = len(refs)
+    ref_lengths = np.array([len(ref) for ref in refs], dtype=np.int64)
+    hyp_lengths = np.array([len(hyp) for hyp in hyps], dtype=np.int64)
+    R, H = int(ref_lengths.max(initial=0)), int(hyp_lengths.max(initial=0))
+    ref_tokens = np.full((batch, max(R, 1)), -1, dtype=np.int64)
+    hyp_tokens = np.full((batch, max(H, 1)), -2, dtype=np.int64)
+    for i, (ref, hyp) in enumerate(zip(refs, hyps)):
+        ref_tokens[i, :len(ref)] = ref
+        hyp_tokens[i, :len(hyp)] = hyp
+    # reversed, hypothesis tokens along a diagonal are a slice
+    hyp_tokens = np.ascontiguousarray(hyp_tokens[:, ::-1])
+
+    cells = np.zeros(batch, dtype=np.int64)
+    ends = ref_lengths + hyp_lengths
+    previous, current = None, np.zeros((batch, R + 1), dtype=np.int64)  # diagonal 0 is cell (0, 0)
+    for d in range(1, R + H + 1):
+        previous, before = current, previous
+        current = np.empty_like(previous)
+        if d <= H:
+            current[:, 0] = d * (COST + INS)
+        if d <= R:
+            current[:, d] = d * (COST + DEL)
+        lo, hi = max(1, d - H), min(d - 1, R)
+        if lo <= hi:
+            mismatch = hyp_tokens[:, H - d + lo:H - d + hi + 1] != ref_tokens[:, lo - 1:hi]
+            sub = before[:, lo - 1:hi] + mismatch * COST
+            dele = previous[:, lo - 1:hi] + (COST + DEL)
+            ins = previous[:, lo:hi + 1] + (COST + INS)
+            sub_cost, del_cost, ins_cost = sub >> COST_SHIFT, dele >> COST_SHIFT, ins >> COST_SHIFT
+            take_sub = (sub_cost < ins_cost) & (sub_cost < del_cost)
+            current[:, lo:hi + 1] = np.where(take_sub, sub, np.where(del_cost < ins_cost, dele, ins))
+        done = np.flatnonzero(ends == d)
+        cells[done] = current[done, ref_lengths[done]]
+
+    errors, ins, dele = cells >> COST_SHIFT, (cells >> INS_SHIFT) & COUNT_MASK, cells & COUNT_MASK
+    return np.stack([errors, ins, dele, errors - ins - dele])
+
+
+def distance_batch(refs: Sequence[np.ndarray], hyps: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Edit distance of every pair, bit-parallel (Myers, in the blocks of Hyyrö).
+
+    A column of the edit distance matrix is kept as bits of its vertical deltas,
+    64 rows to a word, and every token of the hypotheses updates the columns of
+    the whole batch with a few operations per word.
+    """
+    batch = len(refs)
+    ref_lengths = np.array([len(ref) for ref in refs], dtype=np.int64)
+    hyp_lengths = np.array([len(hyp) for hyp in hyps], dtype=np.int64)
+    R, H = int(ref_lengths.max(initial=0)), int(hyp_lengths.max(initial=0))
+    words = max(1, -(-R // WORD))
+    ref_tokens = np.full((batch, words * WORD), -1, dtype=np.int64)
+    hyp_tokens = np.full((batch, max(H, 1)), -2, dtype=np.int64)
+    for i, (ref, hyp) in enumerate(zip(refs, hyps)):
+        ref_tokens[i, :len(ref)] = ref
+        hyp_tokens[i, :len(hyp)] = hyp
+
+    # bits of the positions of every token in its reference, 64 positions to a word, are
+    # rows of a table, keyed by utterance and token; the last row is for tokens not in the reference
+    size = int(max(ref_tokens.max(initial=0), hyp_tokens.max(initial=0))) + 1
+    utterance = np.arange(batch, dtype=np.int64)[:, None]
+    in_ref = np.arange(words * WORD) < ref_lengths[:, None]
+    symbols, rows = np.unique((utterance * size + ref_tokens)[in_ref], return_inverse=True)
+    positions = np.nonzero(in_ref)[1]
+    table = np.zeros((len(symbols) + 1, words), dtype=np.uint64)
+    np.bitwise_or.at(table, (rows, positions // WORD), np.uint64(1) << (positions % WORD).astype(np.uint64))
+    hyp_keys = utterance * size + hyp_tokens
+    hyp_rows = np.minimum(np.searchsorted(symbols, hyp_keys), len(symbols))
+    known = (symbols[np.minimum(hyp_rows, len(symbols) - 1)] == hyp_keys) if len(symbols) else False
+    hyp_rows = np.where(known & (np.arange(hyp_tokens.shape[1]) < hyp_lengths[:, None]), hyp_rows, len(symbols))
+
+    # block w of the column of hypothesis token j needs block w - 1 of the same column,
+    # so blocks go by anti-diagonals t = j + w too, all words of a diagonal at once
+    positive = np.full((batch, words), ~np.uint64(0))  # vertical deltas of +1
+    negative = np.zeros((batch, words), dtype=np.uint64)  # and of -1
+    h_out_positive = np.zeros((batch, words), dtype=np.uint64)  # horizontal deltas at the bottom of blocks
+    h_out_negative = np.zeros((batch, words), dtype=np.uint64)
+    last_word = np.maximum(ref_lengths - 1, 0) // WORD
+    last_bit = np.uint64(1) << (np.maximum(ref_lengths - 1, 0) % WORD).astype(np.uint64)
+    distances = ref_lengths.copy()
+    high, one, zero = np.uint64(WORD - 1), np.ones((batch, 1), dtype=np.uint64), np.zeros((batch, 1), dtype=np.uint64)
+    block = np.arange(words)
+    for t in range(H + words - 1):
+        lo, hi = max(0, t - H + 1), min(words, t + 1)
+        w = block[lo:hi]
+        j = t - w
+        eq = table[hyp_rows[:, j], w]
+        if lo == 0:  # the top of a column is one more than the top of the previous one
+            h_in_positive = np.concatenate([one, h_out_positive[:, :hi - 1]], axis=1)
+            h_in_negative = np.concatenate([zero, h_out_negative[:, :hi - 1]], axis=1)
+        else:
+            h_in_positive, h_in_negative = h_out_positive[:, lo - 1:hi - 1].copy(), h_out_negative[:, lo - 1:hi - 1].copy()
+        pv, mv = positive[:, lo:hi], negative[:, lo:hi]
+        xv = eq | mv
+        eq |= h_in_negative
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        at_end = (last_word[:, None] == w) & (j < hyp_lengths[:, None])
+        distances += (at_end & ((ph & last_bit[:, None]) != 0)).sum(axis=1)
+        distances -= (at_end & ((mh & last_bit[:, None]) != 0)).sum(axis=1)
+        h_out_positive[:, lo:hi], h_out_negative[:, lo:hi] = ph >> high, mh >> high
+        ph = (ph << np.uint64(1)) | h_in_positive
+        mh = (mh << np.uint64(1)) | h_in_negative
+        positive[:, lo:hi] = mh | ~(xv | ph)
+        negative[:, lo:hi] = ph & xv
+    return np.where(ref_lengths == 0, hyp_lengths, distances)
+
+
+def edit_distances(refs: Sequence[np.ndarray], hyps: Sequence[np.ndarray],
+                   batch_size: int = BATCH_SIZE) -> np.ndarray:
+    "edit distance of every pair, without the breakdown of edit_stats"
+    distances = np.zeros(len(refs), dtype=np.int64)
+    order = np.argsort([len(ref) for ref in refs], kind='stable')
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        distances[indices] = distance_batch([refs[i] for i in indices], [hyps[i] for i in indices])
+    return distances
+
+
+def edit_stats(refs: Sequence[np.ndarray], hyps: Sequence[np.ndarray], batch_size: int = BATCH_SIZE) -> np.ndarray:
+    "errors, insertions, deletions and substitutions of every pair, shape (4, pairs)"
+    stats = np.zeros((4, len(refs)), dtype=np.int64)
+    order = np.argsort([len(ref) + len(hyp) for ref, hyp in zip(refs, hyps)], kind='stable')
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        stats[:, indices] = align_batch([refs[i] for i in indices], [hyps[i] for i in indices])
+    return stats
+
+
+@dataclass
+class Report:
+    "the totals compute-wer prints"
+    errors: int = 0
+    words: int = 0
+    ins: int = 0
+    dele: int = 0
+    sub: int = 0
+    sentence_errors: int = 0
+    sentences: int = 0
+    absent: int = 0
+
+    @staticmethod
+    def percent(errors: int, total: int) -> str:
+        "100.0 * float(errors) / float(total) in double, stored in a float and printed with std::fixed and precision 2"
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.float32(np.float64(100.0) * np.float32(errors) / np.float64(np.float32(total)))
+        if np.isnan(percent):
+            return '-nan' if np.signbit(percent) else 'nan'
+        return f'{float(percent):.2f}'
+
+    def __str__(self):
+        partial = ' [PARTIAL]' if self.absent else ''
+        return (f'%WER {self.percent(self.errors, self.words)} [ {self.errors} / {self.words}, '
+                f'{self.ins} ins, {self.dele} del, {self.sub} sub ]{partial}\n'
+                f'%SER {self.percent(self.sentence_errors, self.sentences)} [ {self.sentence_errors} / {self.sentences} ]\n'
+                f'Scored {self.sentences} sentences, {self.absent} not present in hyp.\n')
+
+
+def score(ref: List[Tuple[str, List[str]]], hyp: Dict[str, List[str]]) -> Tuple[Report, List[str], np.ndarray]:
+    """
+    compute-wer --mode=present: utterances missing from hyp are skipped.
+    Returns the report, ids of scored utterances and their stats (see edit_stats).
+    """
+    present = [(utterance_id, words) for utterance_id, words in ref if utterance_id in hyp]
+    ids = [utterance_id for utterance_id, _ in present]
+    ref_words = [words for _, words in present]
+    hyp_words = [hyp[utterance_id] for utterance_id in ids]
+    vocabulary = {}
+    stats = edit_stats(encode(ref_words, vocabulary), encode(hyp_words, vocabulary))
+    errors, ins, dele, sub = stats.sum(axis=1)
+    report = Report(errors=int(errors), words=sum(map(len, ref_words)), ins=int(ins), dele=int(dele), sub=int(sub),
+                    sentence_errors=sum(r != h for r, h in zip(ref_words, hyp_words)), sentences=len(present),
+                    absent=len(ref) - len(present))
+    return report, ids, stats
+
+
+def char_errors(ref_texts: Sequence[str], hyp_texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    "character errors and reference characters of every pair"
+    refs, hyps = encode_chars(ref_texts), encode_chars(hyp_texts)
+    return edit_distances(refs, hyps), np.array([len(ref) for ref in refs], dtype=np.int64)
+
+
+def format_cer(errors: int, chars: int) -> str:
+    "a line in the manner of %SER, characters are those of words joined with spaces"
+    return f'%CER {Report.percent(errors, chars)} [ {errors} / {chars} ]\n'
+
+
+def jiwer_words(text: str) -> List[str]:
+    "words of a text the way jiwer's default WER transform makes them"
+    text = JIWER_SPACES.sub(' ', text).strip()
+    return text.split(' ') if text else []
+
+
+def jiwer_chars(text: str) -> str:
+    return JIWER_SPACES.sub(' ', text).strip()
+
+
+def error_rates(references: Sequence[str], predictions: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    "per utterance WER and CER, like the wer and cer metrics of Hugging Face on one pair at a time"
+    vocabulary = {}
+    refs = encode(map(jiwer_words, references), vocabulary)
+    hyps = encode(map(jiwer_words, predictions), vocabulary)
+    words = np.array([len(ref) for ref in refs], dtype=np.float64)
+    errors, chars = char_errors([jiwer_chars(text) for text in references], [jiwer_chars(text) for text in predictions])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return edit_distances(refs, hyps) / words, errors / chars
+
+
+def benchmark(ref: Path, hyp: Path):
+    "time scoring against the line by line port of Kaldi's edit distance, check the numbers are the same"
+    references, hypotheses = read_text(ref), dict(reversed(read_text(hyp)))
+    t0 = time.time()
+    report, ids, _ = score(references, hypotheses)
+    words = dict(references)
+    errors, chars = char_errors([' '.join(words[i]) for i in ids], [' '.join(hypotheses[i]) for i in ids])
+    cer = format_cer(int(errors.sum()), int(chars.sum()))
+    t1 = time.time()
+    slow = Report()
+    slow_errors = slow_chars = 0
+    for utterance_id, words in references:
+        if utterance_id not in hypotheses:
+            slow.absent += 1
+            continue
+        errors, ins, dele, sub = kaldi_edit_distance(words, hypotheses[utterance_id])
+        slow.errors += errors
+        slow.ins += ins
+        slow.dele += dele
+        slow.sub += sub
+        slow.words += len(words)
+        slow.sentences += 1
+        slow.sentence_errors += words != hypotheses[utterance_id]
+        slow_errors += kaldi_edit_distance(' '.join(words), ' '.join(hypotheses[utterance_id]))[0]
+        slow_chars += len(' '.join(words))
+    t2 = time.time()
+    same = str(report) == str(slow) and cer == format_cer(slow_errors, slow_chars)
+    print(f'{ref} {hyp}: vectorized {t1 - t0:.2f}s, line by line {t2 - t1:.2f}s, same numbers: {same}',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ref', type=Path, nargs='+', required=True, help='reference texts, one per domain')
+    parser.add_argument('--hyp', type=Path, nargs='+', required=True, help='hypothesis texts')
+    parser.add_argument('--cer', action='store_true', help='print character error rates after every report')
+    parser.add_argument('--utterances', type=Path,
+                        help='write hypothesis, domain, utterance id, WER and CER of every scored utterance here')
+    parser.add_argument('--benchmark', action='store_true', help='compare with the line by line edit distance instead')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for hyp in args.hyp:
+            for ref in args.ref:
+                benchmark(ref, hyp)
+        sys.exit(0)
+
+    references = {ref: read_text(ref) for ref in args.ref}
+    details = open(args.utterances, 'w') if args.utterances else None
+    for hyp in args.hyp:
+        hypotheses = dict(reversed(read_text(hyp)))  # the first line of a repeated utterance wins
+        for ref in args.ref:
+            report, ids, stats = score(references[ref], hypotheses)
+            sys.stdout.write(str(report))
+            if not (args.cer or details):
+                continue
+            words = dict(references[ref])
+            errors, chars = char_errors([' '.join(words[i]) for i in ids], [' '.join(hypotheses[i]) for i in ids])
+            if args.cer:
+                sys.stdout.write(format_cer(int(errors.sum()), int(chars.sum())))
+            if details:
+                domain = ref.suffix.lstrip('.') or ref.name
+                for utterance_id, word_errors, char_error, char_count in zip(ids, stats[0], errors, chars):
+                    wer = word_errors / max(len(words[utterance_id]), 1)
+                    cer = char_error / max(char_count, 1)
+                    details.write(f'{hyp}\t{domain}\t{utterance_id}\t{wer:.4f}\t{cer:.4f}\n')
+    if details:
+        details.close()
@@ -0,0 +1,174 @@
+"""
+Decoded test set audio in a single memory-mapped file.
+
+    segment.audio/audio.bin    samples of all utterances back to back, float32 or int16
+    segment.audio/index.npy    offset and length of every utterance, in samples
+    segment.audio/rows.jsonl   everything else about utterances: id, text, path...
+    segment.audio/meta.json    sample type and sampling rate
+
+Opening a store reads the index and the rows only. Utterances are NumPy views
+into the mapped file, so samples are paged in as a model consumes them.
+
+    python -m uk1e2.eval.store convert segment.data segment.audio
+    python -m uk1e2.eval.store benchmark segment.data segment.audio
+"""
+
+from contextlib import suppress
+import json
+from pathlib import Path
+import time
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+
+SAMPLING_RATE = 16_000
+DTYPES = ('float32', 'int16')
+INT16_SCALE = 32768
+
+
+class AudioStoreWriter:
+    "append utterances to a new store, samples go straight to disk"
+
+    def __init__(self, folder: Path, dtype: str = 'float32', sampling_rate: int = SAMPLING_RATE):
+        if dtype not in DTYPES:
+            raise ValueError(f'audio can be stored as {" or ".join(DTYPES)}, not {dtype}')
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.sampling_rate = sampling_rate
+        # a store that is being rewritten is incomplete until close
+        with suppress(FileNotFoundError):
+            (self.folder / 'meta.json').unlink()
+        self.audio = open(self.folder / 'audio.bin', 'wb')
+        self.rows = open(self.folder / 'rows.jsonl', 'w')
+        self.index: List[Sequence[int]] = []
+        self.offset = 0
+
+    def add(self, row: Dict, speech: np.ndarray):
+        "row is what readers get back besides speech, speech is float audio in [-1, 1]"
+        speech = np.asarray(speech, dtype=np.float32).reshape(-1)
+        if self.dtype == np.int16:
+            speech = np.clip(np.round(speech * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+        self.audio.write(speech.tobytes())
+        self.rows.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.index.append((self.offset, len(speech)))
+        self.offset += len(speech)
+
+    def close(self):
+        self.audio.close()
+        self.rows.close()
+        np.save(self.folder / 'index.npy', np.array(self.index, dtype=np.int64).reshape(-1, 2))
+        # meta.json is written last: a store without it is incomplete
+        with open(self.folder / 'meta.json', 'w') as f:
+            json.dump({'dtype': self.dtype.name, 'sampling_rate': self.sampling_rate, 'utterances': len(self.index)}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:  # no index and no meta.json, so readers don't take what was written for a complete store
+            self.audio.close()
+            self.rows.close()
+
+
+class AudioStore:
+    "utterances of a store written by AudioStoreWriter, in the order they were added"
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        meta_path = self.folder / 'meta.json'
+        if not meta_path.exists():
+            raise FileNotFoundError(f'{self.folder} is not a complete audio store, make it with uk1e2.eval.generate_cache_folder')
+        meta = json.loads(meta_path.read_text())
+        self.dtype = np.dtype(meta['dtype'])
+        self.sampling_rate = meta['sampling_rate']
+        index = np.load(self.folder / 'index.npy')
+        self.offsets, self.lengths = index[:, 0], index[:, 1]
+        if self.offsets.size and (self.folder / 'audio.bin').stat().st_size:
+            # copy-on-write pages: views are writable, so torch.from_numpy takes them without copying or warning
+            self.audio = np.memmap(self.folder / 'audio.bin', dtype=self.dtype, mode='c')
+        else:
+            self.audio = np.zeros(0, dtype=self.dtype)
+        with open(self.folder / 'rows.jsonl') as f:
+            self.rows = [json.loads(line) for line in f]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def samples(self, i: int) -> np.ndarray:
+        "a view of utterance i as stored"
+        offset = self.offsets[i]
+        return self.audio[offset:offset + self.lengths[i]]
+
+    def speech(self, i: int) -> np.ndarray:
+        "float32 audio of utterance i: a view for float32 stores, a scaled copy for int16 stores"
+        samples = self.samples(i)
+        if self.dtype == np.int16:
+            return samples.astype(np.float32) / INT16_SCALE
+        return samples
+
+    def batch(self, indices: Sequence[int]) -> Dict[str, List]:
+        "columns of utterances at indices, like a batch of a Hugging Face dataset"
+        batch = {key: [self.rows[i].get(key) for i in indices] for key in self.rows[indices[0]]} if len(indices) else {}
+        batch['speech'] = [self.speech(i) for i in indices]
+        batch['lengths'] = [int(self.lengths[i]) for i in indices]
+        return batch
+
+    def batches(self, batch_size: int) -> Iterator[Dict[str, List]]:
+        for start in range(0, len(self), batch_size):
+            yield self.batch(range(start, min(start + batch_size, len(self))))
+
+
+def convert(dataset_folder: Path, store_folder: Path, dtype: str = 'float32'):
+    "turn a dataset saved by the former generate_cache_folder.py into a store"
+    from datasets import load_from_disk
+
+    ds = load_from_disk(str(dataset_folder))
+    columns = [name for name in ds.column_names if name not in ('speech', 'lengths')]
+    with AudioStoreWriter(store_folder, dtype=dtype) as writer:
+        for example in ds.with_format('numpy', columns=['speech'], output_all_columns=True):
+            writer.add({name: example[name] for name in columns}, example['speech'])
+
+
+def benchmark(dataset_folder: Path, store_folder: Path, batch_size: int = 16):
+    "time reading every batch of speech as float32 arrays from a saved dataset and from a store"
+    from datasets import load_from_disk
+
+    t0 = time.time()
+    ds = load_from_disk(str(dataset_folder))
+    samples = 0
+    for start in range(0, len(ds), batch_size):
+        batch = ds[start:start + batch_size]
+        samples += sum(len(np.array(speech, dtype=np.float32)) for speech in batch['speech'])
+    t1 = time.time()
+    store = AudioStore(store_folder)
+    store_samples = 0
+    for batch in store.batches(batch_size):
+        store_samples += sum(len(speech) for speech in batch['speech'])
+    t2 = time.time()
+    print(f'{len(ds)} utterances, {samples} samples: datasets {t1 - t0:.2f}s, '
+          f'audio store {t2 - t1:.2f}s ({store_samples} samples)')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='convert a saved dataset with a speech column')
+    convert_parser.add_argument('dataset', type=Path)
+    convert_parser.add_argument('store', type=Path)
+    convert_parser.add_argument('--dtype', choices=DTYPES, default='float32')
+    bench = subparsers.add_parser('benchmark', help='compare reading a saved dataset and a store')
+    bench.add_argument('dataset', type=Path)
+    bench.add_argument('store', type=Path)
+    bench.add_argument('--batch_size', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.dataset, args.store, args.dtype)
+    else:
+        benchmark(args.dataset, args.store, args.batch_size)
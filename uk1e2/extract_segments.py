@@ -1,9 +1,181 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
 from pathlib import Path
+import struct
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
 
 from .subprocess import sh
 
 
-def extract_segments(output_data_dir: Path, source_wav_scp: Path, segments_file: Path):
+# same defaults as Kaldi's extract-segments, where they are BaseFloat
+MIN_SEGMENT_LENGTH = 0.1
+MAX_OVERSHOOT = 0.5
+
+
+def f32(x: float) -> float:
+    "round to single precision like Kaldi's BaseFloat"
+    return struct.unpack('f', struct.pack('f', x))[0]
+
+
+def read_scp(filename: Path) -> Dict[str, str]:
+    scp = {}
+    with open(filename) as f:
+        for line in f:
+            key, value = line.strip().split(maxsplit=1)
+            scp[key] = value
+    return scp
+
+
+def read_segments(filename: Path) -> Dict[str, List[Tuple[str, float, float, int]]]:
+    "group segments by recording, keeping the order of the file; times are doubles like in Kaldi"
+    by_recording = defaultdict(list)
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) not in (4, 5):
+                logger.warning('invalid line in segments file: {}', line.strip())
+                continue
+            segment_id, recording_id, start, end = fields[:4]
+            channel = int(fields[4]) if len(fields) == 5 else -1
+            by_recording[recording_id].append((segment_id, float(start), float(end), channel))
+    return by_recording
+
+
+def parse_wav_header(buf) -> Tuple[int, int, int, int]:
+    "returns (sample rate, channels, data offset, data size) of a 16-bit PCM wav"
+    if buf[:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError('not a RIFF/WAVE file')
+    pos = 12
+    sample_rate = channels = None
+    while pos + 8 <= len(buf):
+        chunk_id, chunk_size = buf[pos:pos+4], struct.unpack_from('<I', buf, pos+4)[0]
+        pos += 8
+        if chunk_id == b'fmt ':
+            fmt, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', buf, pos)
+            if fmt not in (1, 0xFFFE) or bits != 16:
+                raise ValueError(f'only 16-bit PCM is supported, got format {fmt} with {bits} bits')
+        elif chunk_id == b'data':
+            if sample_rate is None:
+                raise ValueError('data chunk before fmt chunk')
+            remaining = len(buf) - pos
+            if chunk_size == 0 or chunk_size > remaining:  # streamed wavs don't know their size
+                chunk_size = remaining
+            chunk_size -= chunk_size % (2 * channels)
+            return sample_rate, channels, pos, chunk_size
+        pos += chunk_size + (chunk_size & 1)
+    raise ValueError('no data chunk')
+
+
+def wav_header(sample_rate: int, channels: int, data_size: int) -> bytes:
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16,
+                       b'data', data_size)
+
+
+def open_wav(rxfilename: str):
+    "open a wav.scp entry, running it first if it is a `command |` pipe"
+    if rxfilename.endswith('|'):
+        tmp = tempfile.TemporaryFile()
+        subprocess.run(rxfilename[:-1], shell=True, check=True, stdout=tmp)
+        return tmp
+    return open(rxfilename, 'rb')
+
+
+def extract_recording(recording_id: str, rxfilename: str,
+                      segments: List[Tuple[str, float, float, int]],
+                      targets: Dict[str, str]) -> Tuple[int, int, float, float]:
+    """
+    Cut all segments of a recording out of a single memory map of its wav.
+
+    Follows Kaldi's extract-segments sample arithmetic so that outputs are byte-identical.
+    Returns (written, skipped, seconds of audio written, wall time).
+    """
+    t0 = time.time()
+    written = skipped = 0
+    audio_seconds = 0.
+    with open_wav(rxfilename) as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as buf:
+        sample_rate, channels, offset, size = parse_wav_header(buf)
+        frame = 2 * channels
+        num_samp = size // frame
+        samp_freq = f32(sample_rate)
+        for segment_id, start, end, channel in segments:
+            if start < 0 or (end != -1 and end <= 0) or (start >= end and end > 0):
+                logger.warning('invalid segment times {}: {} {}', segment_id, start, end)
+                skipped += 1
+                continue
+            if channel != -1 and channel >= channels:
+                logger.warning('invalid channel {} >= {} for {}', channel, channels, segment_id)
+                skipped += 1
+                continue
+            # seconds are double and samp_freq BaseFloat, so the product is double and truncated
+            start_samp = int(start * samp_freq)
+            end_samp = int(end * samp_freq) if end != -1 else num_samp
+            if start_samp < 0 or start_samp >= num_samp:
+                logger.warning('start sample out of range {} [length: {}] for {}', start_samp, num_samp, segment_id)
+                skipped += 1
+                continue
+            if end_samp > num_samp:
+                if end_samp >= num_samp + int(f32(MAX_OVERSHOOT * samp_freq)):
+                    logger.warning('end sample too far out of range {} [length: {}] for {}', end_samp, num_samp, segment_id)
+                    skipped += 1
+                    continue
+                end_samp = num_samp  # for small differences, just truncate
+            if end_samp <= start_samp + int(f32(f32(MIN_SEGMENT_LENGTH) * samp_freq)):
+                logger.warning('segment {} too short, skipping it', segment_id)
+                skipped += 1
+                continue
+
+            data_size = (end_samp - start_samp) * frame
+            with open(targets[segment_id], 'wb') as out, \
+                 buf[offset + start_samp * frame : offset + end_samp * frame] as data:
+                out.write(wav_header(sample_rate, channels, data_size))
+                out.write(data)
+            written += 1
+            audio_seconds += (end_samp - start_samp) / sample_rate
+
+    t = time.time() - t0
+    logger.info('{}: {} segments, {:.1f}s of audio in {:.2f}s ({:.0f}x realtime)',
+                recording_id, written, audio_seconds, t, audio_seconds / t if t else float('inf'))
+    return written, skipped, audio_seconds, t
+
+
+def extract_segments_python(output_data_dir: Path, source_wav_scp: Path, segments_file: Path,
+                            jobs: int = os.cpu_count() or 1):
+    wavscp = read_scp(source_wav_scp)
+    targets = read_scp(output_data_dir / 'wav.scp')
+    by_recording = read_segments(segments_file)
+
+    t0 = time.time()
+    written = skipped = 0
+    audio_seconds = 0.
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for recording_id, segments in by_recording.items():
+            if recording_id not in wavscp:
+                logger.warning('no recording {} in {}, skipping {} segments', recording_id, source_wav_scp, len(segments))
+                skipped += len(segments)
+                continue
+            futures.append(pool.submit(extract_recording, recording_id, wavscp[recording_id], segments,
+                                       {segment_id: targets[segment_id] for segment_id, *_ in segments}))
+        for future in futures:
+            w, s, a, _ = future.result()
+            written, skipped, audio_seconds = written + w, skipped + s, audio_seconds + a
+
+    t = time.time() - t0
+    logger.info('extracted {} segments ({:.2f}h of audio) in {:.1f}s, skipped {}',
+                written, audio_seconds / 3600, t, skipped)
+
+
+def extract_segments(output_data_dir: Path, source_wav_scp: Path, segments_file: Path,
+                     engine='python', jobs: int = os.cpu_count() or 1):
     "extract each segment as its own wav into the output"
 
     (output_data_dir / 'wav').mkdir(exist_ok=True, parents=True)
@@ -13,10 +185,13 @@ def extract_segments(output_data_dir: Path, source_wav_scp: Path, segments_file:
                 segment_id = line.split()[0]
                 print(segment_id, output_data_dir / 'wav' / f'{segment_id}.wav', file=out)
 
-    sh('extract-segments',
-       f"scp:{source_wav_scp}",
-       segments_file,
-       f"scp:{output_data_dir / 'wav.scp'}")
+    if engine == 'kaldi':
+        sh('extract-segments',
+           f"scp:{source_wav_scp}",
+           segments_file,
+           f"scp:{output_data_dir / 'wav.scp'}")
+    else:
+        extract_segments_python(output_data_dir, source_wav_scp, segments_file, jobs=jobs)
 
 
 if __name__ == '__main__':
@@ -29,8 +204,13 @@ if __name__ == '__main__':
     """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-o', '--output-data-dir', type=Path)
     parser.add_argument('-i', '--source-wav-scp', type=Path)
+    parser.add_argument('--engine', choices=['python', 'kaldi'], default='python',
+                        help='python memory-maps recordings and needs no Kaldi install')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='recordings to process in parallel with the python engine')
     parser.add_argument('segments', type=Path, help='segments_file')
 
     args = parser.parse_args()
 
-    extract_segments(args.output_data_dir, args.source_wav_scp, args.segments)
+    extract_segments(args.output_data_dir, args.source_wav_scp, args.segments,
+                     engine=args.engine, jobs=args.jobs)
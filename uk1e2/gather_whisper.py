@@ -7,13 +7,14 @@ from .tokenize_text import Verbalizer
 
 parser = argparse.ArgumentParser(__file__, description='gather whisper results into kaldi format',
                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--linguistic', action='store_true', help='split words with Stanza instead of whitespace')
 parser.add_argument('whisper_folder', help='folder where whisper txts are', type=Path)
 args = parser.parse_args()
 
 logger.info('{}', args)
 
 
-verbalizer = Verbalizer()
+verbalizer = Verbalizer(linguistic=args.linguistic)
 
 def verbalize(utt_file: Path):
     whisper_text = utt_file.read_text().replace('\n', ' ')
@@ -0,0 +1,253 @@
+"""
+Bulk load JSON lines into SQLite databases in a single pass per database.
+
+Tables are created with the column types sqlite-utils would choose, rows are
+inserted with executemany in large transactions while the database runs
+without fsyncs, and full text search indexes are built once after the load.
+
+    python -m uk1e2.ingest index uk1e2.db local_utterances.jsonl
+    python -m uk1e2.ingest intermediate intermediate.db uk1e2.jsonl zipytable1.jsonl zipytable2.jsonl
+    python -m uk1e2.ingest benchmark local_utterances.jsonl zipytable1.jsonl zipytable2.jsonl
+"""
+
+from contextlib import suppress
+import json
+from pathlib import Path
+import sqlite3
+import subprocess
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from loguru import logger
+
+
+BATCH_SIZE = 10000
+# sqlite-utils decides the type of a column from the batch where it first appears,
+# batches are 100 rows or fewer when rows have many columns
+TYPE_BATCH_SIZE = 100
+SQLITE_MAX_VARS = 999
+
+# fields of uk1e2.db, the index for https://wilab.org.ua/uk1e2
+INDEX_COLUMNS = ['id', 'domain', 'text', 'normalized_text', 'start', 'end']
+INDEX_FTS = ['id', 'domain', 'text', 'normalized_text']
+UTTERANCE_URL = 'https://a.wilab.org.ua/wav/{}.wav'
+
+
+def column_type(values: Iterable) -> str:
+    "the type sqlite-utils would give a column with these values"
+    types = {type(value) for value in values if value is not None}
+    if not types:
+        return 'TEXT'
+    if types <= {int, bool}:
+        return 'INTEGER'
+    if types <= {int, bool, float}:
+        return 'REAL'
+    if types == {bytes}:
+        return 'BLOB'
+    return 'TEXT'
+
+
+def adapt(value):
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=repr, ensure_ascii=False)
+    return value
+
+
+def jq_number(value):
+    "jq prints whole floats as integers, so the index always had 75 where the jsonl has 75.0"
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def quote(name: str) -> str:
+    return f'[{name}]'
+
+
+class BulkDatabase:
+    "an SQLite database that is being built from scratch"
+
+    def __init__(self, filename: Path, recreate: bool = True):
+        filename = Path(filename)
+        if recreate:
+            for path in (filename, filename.with_name(filename.name + '-wal'), filename.with_name(filename.name + '-shm')):
+                with suppress(FileNotFoundError):
+                    path.unlink()
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, isolation_level=None)
+        # nothing is lost if the build crashes: the database is rebuilt from its sources anyway
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-262144')
+
+    def columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info({quote(table)})')]
+
+    def insert(self, table: str, rows: Iterable[Dict], pk: Optional[str] = None,
+               batch_size: int = BATCH_SIZE) -> int:
+        "insert rows, adding columns for keys that are new, in transactions of batch_size rows"
+        columns = self.columns(table)
+        count = 0
+        rows = iter(rows)
+        type_batch_size = None
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+
+            if type_batch_size is None:
+                type_batch_size = max(1, min(TYPE_BATCH_SIZE, SQLITE_MAX_VARS // max(1, len(batch[0]))))
+            new_columns = {}
+            for i, row in enumerate(batch):
+                for key in row:
+                    if key not in columns and key not in new_columns:
+                        start = (count + i) // type_batch_size * type_batch_size - count
+                        new_columns[key] = column_type(r.get(key) for r in batch[max(start, 0):start + type_batch_size])
+            if not columns:
+                definitions = ', '.join(f'{quote(name)} {type_}' + (' PRIMARY KEY' if name == pk else '')
+                                        for name, type_ in new_columns.items())
+                self.conn.execute(f'CREATE TABLE {quote(table)} ({definitions})')
+            else:
+                for name, type_ in new_columns.items():
+                    self.conn.execute(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {type_}')
+            columns = columns + list(new_columns)
+
+            sql = (f'INSERT INTO {quote(table)} ({", ".join(map(quote, columns))}) '
+                   f'VALUES ({", ".join("?" * len(columns))})')
+            self.conn.execute('BEGIN')
+            self.conn.executemany(sql, ([adapt(row.get(name)) for name in columns] for row in batch))
+            self.conn.execute('COMMIT')
+            count += len(batch)
+        return count
+
+    def enable_fts(self, table: str, columns: List[str], create_triggers: bool = False):
+        "external content FTS5 index named like sqlite-utils does, so datasette finds it"
+        fts = quote(f'{table}_fts')
+        names = ', '.join(map(quote, columns))
+        self.conn.execute('BEGIN')
+        self.conn.execute(f'CREATE VIRTUAL TABLE {fts} USING FTS5 ({names}, content={quote(table)})')
+        self.conn.execute(f'INSERT INTO {fts} (rowid, {names}) SELECT rowid, {names} FROM {quote(table)}')
+        if create_triggers:
+            new = ', '.join(f'new.{quote(c)}' for c in columns)
+            old = ', '.join(f'old.{quote(c)}' for c in columns)
+            self.conn.execute(f'CREATE TRIGGER {quote(table + "_ai")} AFTER INSERT ON {quote(table)} BEGIN '
+                              f'INSERT INTO {fts} (rowid, {names}) VALUES (new.rowid, {new}); END')
+            self.conn.execute(f'CREATE TRIGGER {quote(table + "_ad")} AFTER DELETE ON {quote(table)} BEGIN '
+                              f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES('delete', old.rowid, {old}); END")
+            self.conn.execute(f'CREATE TRIGGER {quote(table + "_au")} AFTER UPDATE ON {quote(table)} BEGIN '
+                              f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES('delete', old.rowid, {old}); "
+                              f'INSERT INTO {fts} (rowid, {names}) VALUES (new.rowid, {new}); END')
+        self.conn.execute('COMMIT')
+
+    def close(self):
+        "leave a single self-contained file with the default journal"
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_jsonl(filename: Path) -> Iterator[Dict]:
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_index(output: Path, local_utterances: Path) -> int:
+    "uk1e2.db: utterances with links to their audio, searchable by id, domain and text"
+    def rows():
+        for row in read_jsonl(local_utterances):
+            indexed = {name: jq_number(row.get(name)) for name in INDEX_COLUMNS}
+            indexed['utterance_url'] = UTTERANCE_URL.format(row.get('id'))
+            yield indexed
+
+    with BulkDatabase(output) as db:
+        count = db.insert('utterances', rows(), pk='id')
+        db.enable_fts('utterances', INDEX_FTS)
+    return count
+
+
+def build_intermediate(output: Path, sources: List[Path]) -> int:
+    "intermediate.db: all transcribed utterances, later columns are added as sources bring them"
+    with BulkDatabase(output) as db:
+        count = sum(db.insert('utterances', read_jsonl(source)) for source in sources)
+        db.enable_fts('utterances', ['text'])
+    return count
+
+
+# what the Makefile did before, for the benchmark
+SQLITE_UTILS_INDEX = """
+< {local_utterances} jq -rc '{{id,domain,text,normalized_text,start,end:.end,utterance_url:"https://a.wilab.org.ua/wav/\\(.id).wav"}}' | sqlite-utils insert {output} utterances - --nl --pk id
+sqlite-utils enable-fts {output} utterances id domain text normalized_text
+"""
+SQLITE_UTILS_INTERMEDIATE = """
+sqlite-utils insert {output} utterances {first} --nl --silent
+for source in {rest}; do sqlite-utils insert {output} utterances $source --nl --alter --silent; done
+sqlite-utils enable-fts {output} utterances text
+"""
+
+
+def dump(filename: Path) -> List:
+    "schema and rows of the utterances table, and what full text search finds"
+    with sqlite3.connect(filename) as conn:
+        schema = [row[1:3] for row in conn.execute('PRAGMA table_info(utterances)')]
+        rows = conn.execute('SELECT rowid, * FROM utterances ORDER BY rowid').fetchall()
+        found = conn.execute("SELECT rowid FROM utterances_fts WHERE utterances_fts MATCH 'не' ORDER BY rowid").fetchall()
+    return [schema, rows, found]
+
+
+def benchmark(local_utterances: Path, sources: List[Path]):
+    "build both databases with the former Makefile recipes and with this module, check they have the same contents"
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for name, old, new in [
+            ('uk1e2.db', SQLITE_UTILS_INDEX.format(local_utterances=local_utterances, output=tmp / 'old.db'),
+             lambda: build_index(tmp / 'new.db', local_utterances)),
+            ('intermediate.db', SQLITE_UTILS_INTERMEDIATE.format(first=sources[0], rest=' '.join(map(str, sources[1:])),
+                                                                 output=tmp / 'old.db'),
+             lambda: build_intermediate(tmp / 'new.db', sources)),
+        ]:
+            with suppress(FileNotFoundError):
+                (tmp / 'old.db').unlink()
+            t0 = time.time()
+            subprocess.run(old, shell=True, check=True)
+            t1 = time.time()
+            count = new()
+            t2 = time.time()
+            same = dump(tmp / 'old.db') == dump(tmp / 'new.db')
+            logger.info('{}: {} utterances, jq and sqlite-utils {:.2f}s, uk1e2.ingest {:.2f}s ({:.1f}x), same contents: {}',
+                        name, count, t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1), same)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    index = subparsers.add_parser('index', help='build uk1e2.db from local_utterances.jsonl')
+    index.add_argument('output', type=Path)
+    index.add_argument('local_utterances', type=Path)
+    intermediate = subparsers.add_parser('intermediate', help='build intermediate.db from utterance jsonl files')
+    intermediate.add_argument('output', type=Path)
+    intermediate.add_argument('sources', type=Path, nargs='+')
+    bench = subparsers.add_parser('benchmark', help='compare with jq and sqlite-utils')
+    bench.add_argument('local_utterances', type=Path)
+    bench.add_argument('sources', type=Path, nargs='+', help='inputs of intermediate.db')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.command == 'benchmark':
+        benchmark(args.local_utterances, args.sources)
+    elif args.command == 'index':
+        count = build_index(args.output, args.local_utterances)
+        logger.info('wrote {} utterances to {} in {:.2f}s', count, args.output, time.time() - t0)
+    else:
+        count = build_intermediate(args.output, args.sources)
+        logger.info('wrote {} utterances to {} in {:.2f}s', count, args.output, time.time() - t0)
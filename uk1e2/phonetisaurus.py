@@ -1,26 +1,91 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
 from pathlib import Path
+import sqlite3
 from subprocess import check_output
+from typing import Dict, List
 
 from loguru import logger
 
+from .transcode import sha256sum
 
-def g2p_batch(words) -> dict[str, dict[str, bool]]:
-    model = Path('data/local/dict/g2p.fst')
-    lexicon = Path('data/local/dict/uk_pron.v3.vcb')
-    if not model.exists() or not lexicon.exists():
-        logger.error('g2p models not found: {} {}', model, lexicon)
-        return {}
+
+NBEST = 2
+
+
+class PronunciationCache:
+    "pronunciations predicted in previous runs, by word and by the g2p model and lexicon that predicted them"
+
+    def __init__(self, filename: Path, model_hash: str):
+        self.db = sqlite3.connect(filename)
+        self.model_hash = model_hash
+        self.db.execute('CREATE TABLE IF NOT EXISTS pronunciations '
+                        '(model TEXT, word TEXT, prons TEXT, PRIMARY KEY (model, word)) WITHOUT ROWID')
+
+    def load(self) -> Dict[str, List[str]]:
+        rows = self.db.execute('SELECT word, prons FROM pronunciations WHERE model = ?', (self.model_hash,))
+        return {word: prons.split('\t') if prons else [] for word, prons in rows}
+
+    def save(self, prons: Dict[str, List[str]]):
+        "words without pronunciations are saved too, so that g2p errors are not predicted again"
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO pronunciations VALUES (?, ?, ?)',
+                                ((self.model_hash, word, '\t'.join(p)) for word, p in prons.items()))
+
+    def close(self):
+        self.db.close()
+
+
+def model_hash(model: Path, lexicon: Path) -> str:
+    key = f'{sha256sum(model)} {sha256sum(lexicon)} nbest={NBEST}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def predict(words: List[str], model: Path, lexicon: Path) -> Dict[str, List[str]]:
     output = check_output(['phonetisaurus', 'predict',
-                           '--nbest', '2',
+                           '--nbest', str(NBEST),
                            '--model', model,
                            '--lexicon', lexicon], input='\n'.join(words).encode('utf-8'))
-    oov = defaultdict(dict)
+    prons = defaultdict(list)
     for line in output.decode('utf-8').splitlines():
         word, *pron = line.split()
         pron = ' '.join(pron)
         #logger.debug('{} {}', word, pron)
-        oov[word][pron] = True
+        if pron not in prons[word]:
+            prons[word].append(pron)
+    return prons
+
+
+def g2p_batch(words, jobs: int = os.cpu_count() or 1,
+              cache_path: Path = Path('data/local/dict/g2p.cache.sqlite')) -> Dict[str, Dict[str, bool]]:
+    "pronunciations of words, only words not seen with the same model before are sent to phonetisaurus"
+    model = Path('data/local/dict/g2p.fst')
+    lexicon = Path('data/local/dict/uk_pron.v3.vcb')
+    if not model.exists() or not lexicon.exists():
+        logger.error('g2p models not found: {} {}', model, lexicon)
+        return {}
+
+    cache = PronunciationCache(cache_path, model_hash(model, lexicon))
+    cached = cache.load()
+    unseen = [word for word in words if word not in cached]
+
+    # phonetisaurus is single-threaded, each thread waits for its own process
+    chunk_size = max(1, -(-len(unseen) // jobs))
+    chunks = [unseen[i:i+chunk_size] for i in range(0, len(unseen), chunk_size)]
+    logger.info('{} words are in the g2p cache, predicting {} in {} processes', len(cached), len(unseen), len(chunks))
+    predicted = {word: [] for word in unseen}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for prons in pool.map(lambda chunk: predict(chunk, model, lexicon), chunks):
+            predicted.update(prons)
+    cache.save(predicted)
+    cache.close()
+
+    oov = defaultdict(dict)
+    for word in words:
+        for pron in cached[word] if word in cached else predicted[word]:
+            oov[word][pron] = True
     return oov
 
 if __name__ == '__main__':
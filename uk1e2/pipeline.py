@@ -0,0 +1,375 @@
+"""
+Turn transcripts into utterance JSON lines in a single process.
+
+Each step of the former Makefile chains of awk, jq, collapse_repeats.py,
+add_urls.py, zip_jsonl_csv.py and csv2jsonl.py is a generator here,
+and the output is byte for byte what those chains wrote, including
+the quirks of pandas that the rest of the tree has seen ever since:
+start_time of youtube utterances becomes milliseconds since the epoch
+of today's date, ends are floats and slashes are escaped.
+
+    python -m uk1e2.pipeline tsv --first_id 20000 youtube2.txt > youtube2.tsv
+    python -m uk1e2.pipeline ytable youtube1.tsv > ytable1.jsonl
+    python -m uk1e2.pipeline youtube youtube1.tsv youtube_normalized.csv > zipytable1.jsonl
+    python -m uk1e2.pipeline uk1e2 uk1e2.csv uk1e2_normalized.csv > uk1e2.jsonl
+    python -m uk1e2.pipeline benchmark youtube1.tsv youtube_normalized.csv youtube2.tsv youtube2_normalized.csv \\
+        --transcript youtube2.txt youtube2.tsv
+"""
+
+import calendar
+import csv
+from datetime import date
+from functools import lru_cache
+import json
+from pathlib import Path
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+
+# columns of uk1e2.jsonl and zipytable*.jsonl
+CSV_COLUMNS = ['domain', 'source', 'utterance_id', 'start_time', 'speaker_id', 'text', 'normalized_text']
+ZIP_COLUMNS = ['domain', 'source', 'utterance_id', 'start_time', 'speaker_id', 'text', 'normalized_text', 'start', 'end', 'url']
+
+# what pandas.read_csv reads as missing values
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+TRUE_VALUES = {'True', 'TRUE', 'true'}
+FALSE_VALUES = {'False', 'FALSE', 'false'}
+INTEGER = re.compile(r'\s*[+-]?\d+\s*')
+FLOAT = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*')
+
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def transcript_rows(lines: Iterable[str], first_id: int) -> Iterator[str]:
+    """
+    TSV lines of utterances in a transcript dump from brushlyk, like the awk script did:
+    __file__ lines name the video, "# " lines the speaker, 0-prefixed lines the time,
+    utterances after Метадані: are metadata and skipped but still numbered.
+    """
+    c, file, ts, spk = first_id, '', '', ''
+    for line in lines:
+        line = line.rstrip('\n')
+        if '__file__' in line:
+            fields = line.split()
+            file = fields[1] if len(fields) > 1 else ''
+            spk = 'Спікер'
+            continue
+        if line.startswith('# '):
+            spk = line[2:]
+            continue
+        if re.match(r'0[0-9-]', line):
+            ts = line.replace('-', ':')
+            continue
+        if 'Метадані:' in line:
+            spk = '__meta__'
+        if len(line) >= 2:
+            row = f'{c}\t{file}\t{ts}\t{spk}\t{line}'
+            c += 1
+            if '__meta__' not in row:
+                yield row
+
+
+def tsv_utterances(lines: Iterable[str]) -> Iterator[Dict]:
+    "youtube utterances from TSV lines of id, video, start time, speaker and text"
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        fields += [None] * (5 - len(fields))
+        yield {'domain': 'youtube', 'source': fields[1], 'utterance_id': jq_tonumber(fields[0]) + 100000,
+               'start_time': fields[2], 'speaker_id': fields[3], 'text': fields[4]}
+
+
+def jq_tonumber(s: str):
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+def collapse_repeats(utterances: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Join texts of consecutive utterances of the same speaker at the same time of the same source.
+
+    Like collapse_repeats.py, the last utterance is written as it was read,
+    even when it has been collapsed into the one before.
+    """
+    previous = utterance = None
+    for utterance in utterances:
+        if previous is not None and (utterance['source'], utterance['start_time'], utterance['speaker_id']) == \
+                (previous['source'], previous['start_time'], previous['speaker_id']):
+            previous['text'] += "\n" + utterance['text']
+            logger.debug('collapsing {} {}', previous['utterance_id'], utterance['utterance_id'])
+        else:
+            if previous is not None:
+                yield previous
+            previous = utterance
+    if utterance is not None:
+        yield utterance
+
+
+def read_timestamp(x: str) -> int:
+    hh, mm, ss = map(int, x.split(':'))
+    return ss + mm*60 + hh*60*60
+
+
+def add_url(utterance: Dict, end_time: Optional[str]) -> Dict:
+    "start, and end when the next utterance of the same source is known, and a link to the video"
+    t = read_timestamp(utterance['start_time'])
+    utterance['start'] = t
+    if end_time:
+        end_time = read_timestamp(end_time)
+        utterance['end'] = end_time
+        query = f'?start={t}&end={end_time}'
+    else:
+        query = f'?start={t}'
+
+    if utterance['domain'] == 'youtube':
+        utterance['url'] = 'https://www.youtube.com/embed/' + utterance['source'] + query
+    else:
+        utterance['url'] = f"https://a.wilab.org.ua/uk1e2/mp4/{utterance['source']}.mp4" + query
+    return utterance
+
+
+def add_urls(utterances: Iterable[Dict]) -> Iterator[Dict]:
+    "utterances end where the next one of the same source starts"
+    previous = None
+    for utterance in utterances:
+        if previous is not None:
+            end_time = utterance['start_time'] if utterance['source'] == previous['source'] else None
+            try:
+                yield add_url(previous, end_time)
+            except Exception as e:
+                raise ValueError(previous, end_time) from e
+        previous = utterance
+    if previous is not None:
+        yield add_url(previous, None)
+
+
+def csv_value_type(value: str) -> type:
+    if value in NA_VALUES:
+        return type(None)
+    if value in TRUE_VALUES or value in FALSE_VALUES:
+        return bool
+    if INTEGER.fullmatch(value):
+        return int
+    if FLOAT.fullmatch(value):
+        return float
+    return str
+
+
+def column_kind(types: set) -> str:
+    "the dtype pandas.read_csv infers from the types of values in a column: int, float, bool or object"
+    present = types - {type(None)}
+    if not present:
+        return 'float'
+    if present == {int}:
+        return 'float' if type(None) in types else 'int'
+    if present <= {int, float}:
+        return 'float'
+    if present == {bool}:
+        return 'bool'
+    return 'object'
+
+
+def convert_csv_value(value: str, kind: str):
+    if value in NA_VALUES:
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    if kind == 'bool':
+        return value in TRUE_VALUES
+    return value
+
+
+def read_csv_rows(filename: Path, delimiter: str) -> Iterator[List[str]]:
+    "rows of a CSV file without blank lines, the header first"
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f, delimiter=delimiter):
+            if row:
+                yield row
+
+
+def csv_kinds(filename: Path, delimiter: str) -> Tuple[Dict[str, str], int]:
+    "column kinds and the number of rows, from a first pass over the file"
+    rows = read_csv_rows(filename, delimiter)
+    header = next(rows)
+    types = [set() for _ in header]
+    count = 0
+    for row in rows:
+        row += [''] * (len(header) - len(row))
+        for column, value in zip(types, row):
+            column.add(csv_value_type(value))
+        count += 1
+    return {name: column_kind(column) for name, column in zip(header, types)}, count
+
+
+def read_csv_typed(filename: Path, delimiter: str, kinds: Dict[str, str], count: int, rows: int) -> Iterator[Dict]:
+    """
+    Rows of a CSV file with values typed like pandas.read_csv types them,
+    padded with missing values to rows, like pandas.concat pads the shorter frame.
+    Only the dtypes of this tree's CSV files are modelled: integers, floats, booleans and text.
+    """
+    if count < rows:
+        kinds = {name: 'float' if kind == 'int' else kind for name, kind in kinds.items()}
+    data = read_csv_rows(filename, delimiter)
+    header = next(data)
+    for row in data:
+        row += [''] * (len(header) - len(row))
+        yield {name: convert_csv_value(value, kinds[name]) for name, value in zip(header, row)}
+    for _ in range(count, rows):
+        yield dict.fromkeys(header)
+
+
+def csv_utterances(unnormalized: Path, normalized: Path) -> Iterator[Dict]:
+    "utterances of the SaturdayTeam CSV side by side with their normalized text, like csv2jsonl.py"
+    unnormalized_kinds, unnormalized_count = csv_kinds(unnormalized, ';')
+    normalized_kinds, normalized_count = csv_kinds(normalized, ';')
+    rows = max(unnormalized_count, normalized_count)
+    for left, right in zip(read_csv_typed(unnormalized, ';', unnormalized_kinds, unnormalized_count, rows),
+                           read_csv_typed(normalized, ';', normalized_kinds, normalized_count, rows)):
+        row = {**left, **right}
+        yield {name: row[name] for name in CSV_COLUMNS}
+
+
+def pandas_value(value) -> str:
+    "a value as DataFrame.to_json(force_ascii=False) writes it"
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value != value:
+            return 'null'
+        return f'{value:.1f}' if value.is_integer() and abs(value) < 1e16 else repr(value)
+    return _json_encode(value).replace('/', '\\/')
+
+
+def pandas_json(record: Dict) -> str:
+    return '{' + ','.join(f'{pandas_key(key)}:{pandas_value(value)}' for key, value in record.items()) + '}'
+
+
+@lru_cache(maxsize=None)
+def pandas_key(key: str) -> str:
+    return pandas_value(key)
+
+
+def midnight_ms(today: date) -> int:
+    "pandas.read_json reads *_time columns as dates, and a time of day falls on today's date"
+    return calendar.timegm(today.timetuple()) * 1000
+
+
+def zip_normalized(utterances: Iterable[Dict], normalized: Path) -> Iterator[Dict]:
+    "utterances side by side with normalized text from a CSV file, like zip_jsonl_csv.py"
+    kinds, count = csv_kinds(normalized, ',')
+    normalized_texts = (row['normalized_text'] for row in read_csv_typed(normalized, ',', kinds, count, count))
+    midnight = midnight_ms(date.today())
+    for utterance in utterances:
+        row = {name: utterance.get(name) for name in ZIP_COLUMNS}
+        row['start_time'] = midnight + read_timestamp(row['start_time'].strip()) * 1000
+        row['normalized_text'] = next(normalized_texts, None)
+        # the last utterance of every video has no end, so pandas always had a float column
+        if row['end'] is not None:
+            row['end'] = float(row['end'])
+        yield row
+    if next(normalized_texts, False) is not False:
+        raise ValueError(f'{normalized} has more rows than there are utterances')
+
+
+def youtube_utterances(tsv: Path) -> Iterator[Dict]:
+    "ytable*.jsonl: utterances of a youtube TSV with repeats collapsed and links added"
+    with open(tsv, encoding='utf-8', errors='replace') as f:
+        yield from add_urls(collapse_repeats(tsv_utterances(f)))
+
+
+def write_lines(lines: Iterable[str], output):
+    output.writelines(f'{line}\n' for line in lines)
+
+
+# what the Makefile did before, for the benchmark
+MAKEFILE_YOUTUBE = """cat {tsv} | jq -Rrc 'split("\\t") | {{domain:"youtube", source:.[1], utterance_id: (.[0]|tonumber + 100000), start_time: .[2], speaker_id: .[3], text: .[4]}}' | python -m collapse_repeats 2>/dev/null | python -m add_urls > {tmp}/ytable.jsonl
+python -m zip_jsonl_csv {tmp}/ytable.jsonl {normalized} > {output}"""
+MAKEFILE_UK1E2 = "python -m csv2jsonl {csv} {normalized} | python -m add_urls > {output}"
+
+
+def benchmark(youtube: List[Tuple[Path, Path]], uk1e2: Optional[Tuple[Path, Path]] = None,
+              transcript: Optional[Tuple[Path, Path]] = None):
+    """
+    Make zipytable*.jsonl from youtube TSVs, and uk1e2.jsonl when its CSVs are given,
+    with the former Makefile recipes and with this module, check the bytes are the same.
+    Run from the root of the repository, where the former scripts are.
+
+    The TSV of a transcript is compared with the one in the tree instead:
+    it was made by an awk that counts characters, not bytes.
+    """
+    if transcript:
+        txt, tsv = transcript
+        with open(txt, encoding='utf-8') as f:
+            same = ''.join(f'{row}\n' for row in transcript_rows(f, first_id=20000)) == tsv.read_text(encoding='utf-8')
+        logger.info('{}: same lines as {}: {}', txt, tsv, same)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        jobs = [(tsv, MAKEFILE_YOUTUBE.format(tsv=tsv, normalized=normalized, tmp=tmp, output=tmp / 'old.jsonl'),
+                 lambda tsv=tsv, normalized=normalized: map(pandas_json, zip_normalized(youtube_utterances(tsv), normalized)))
+                for tsv, normalized in youtube]
+        if uk1e2:
+            csv, normalized = uk1e2
+            jobs.append((csv, MAKEFILE_UK1E2.format(csv=csv, normalized=normalized, output=tmp / 'old.jsonl'),
+                         lambda: map(_json_encode, add_urls(csv_utterances(csv, normalized)))))
+        for name, old, new in jobs:
+            t0 = time.time()
+            subprocess.run(old, shell=True, check=True)
+            t1 = time.time()
+            with open(tmp / 'new.jsonl', 'w') as f:
+                write_lines(new(), f)
+            t2 = time.time()
+            same = (tmp / 'old.jsonl').read_bytes() == (tmp / 'new.jsonl').read_bytes()
+            logger.info('{}: Makefile recipes {:.2f}s, uk1e2.pipeline {:.3f}s ({:.0f}x), same bytes: {}',
+                        name, t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1), same)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    tsv = subparsers.add_parser('tsv', help='TSV of utterances in a transcript dump')
+    tsv.add_argument('--first_id', type=int, default=20000, help='number of the first utterance')
+    tsv.add_argument('txt', type=Path)
+    ytable = subparsers.add_parser('ytable', help='utterances of a youtube TSV with links')
+    ytable.add_argument('tsv', type=Path)
+    youtube = subparsers.add_parser('youtube', help='utterances of a youtube TSV with links and normalized text')
+    youtube.add_argument('tsv', type=Path)
+    youtube.add_argument('normalized', type=Path)
+    uk1e2 = subparsers.add_parser('uk1e2', help='utterances of the SaturdayTeam CSV with links and normalized text')
+    uk1e2.add_argument('csv', type=Path)
+    uk1e2.add_argument('normalized', type=Path)
+    bench = subparsers.add_parser('benchmark', help='compare with the former Makefile recipes')
+    bench.add_argument('youtube', type=Path, nargs='+', help='pairs of youtube TSV and normalized CSV')
+    bench.add_argument('--uk1e2', type=Path, nargs=2, metavar=('CSV', 'NORMALIZED'), help='uk1e2.csv and its normalized CSV')
+    bench.add_argument('--transcript', type=Path, nargs=2, metavar=('TXT', 'TSV'), help='transcript dump and its TSV')
+    args = parser.parse_args()
+
+    if args.command == 'tsv':
+        with open(args.txt, encoding='utf-8') as f:
+            write_lines(transcript_rows(f, args.first_id), sys.stdout)
+    elif args.command == 'ytable':
+        write_lines(map(_json_encode, youtube_utterances(args.tsv)), sys.stdout)
+    elif args.command == 'youtube':
+        write_lines(map(pandas_json, zip_normalized(youtube_utterances(args.tsv), args.normalized)), sys.stdout)
+    elif args.command == 'uk1e2':
+        write_lines(map(_json_encode, add_urls(csv_utterances(args.csv, args.normalized))), sys.stdout)
+    else:
+        if len(args.youtube) % 2:
+            parser.error('youtube TSVs and normalized CSVs go in pairs')
+        benchmark(list(zip(args.youtube[::2], args.youtube[1::2])), args.uk1e2, args.transcript)
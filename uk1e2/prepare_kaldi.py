@@ -3,92 +3,124 @@ Prepare Hugging Face-compatible audio dataset for training using Kaldi
 """
 
 from collections import defaultdict, Counter
+import hashlib
+import heapq
+import itertools
+import json
+import os
 from pathlib import Path
-from typing import Dict, Set, Tuple
+from typing import Dict, Iterable, Set, Tuple
 
-import datasets
 from loguru import logger
 from sqlite_utils import Database
 from tqdm import tqdm
 
 
+from .datadir import DataDirWriter, ExternalSorter, validate_data_dir, write_spk2utt
+from .ingest import BulkDatabase
 from .phonetisaurus import g2p_batch
 #from uk.g2p import g2p_batch
 from .tokenize_text import Verbalizer
 
 
-def write_segments(segments: Dict[str, Tuple[str, float, float]], filename: Path):
-    with open(filename, 'w') as f:
-        for utterance_id in sorted(segments):
-            recording_id, start, end = segments[utterance_id]
-            print(utterance_id, recording_id, start, end, file=f)
-
-
 def write_scp(scp: Dict[str, str], filename: Path):
     with open(filename, 'w') as f:
         for key in sorted(scp):
             print(key, scp[key], file=f)
 
 
-def write_spk2utt(spk2utt: Dict[str, Set[str]], datadir: Path):
-    with open(datadir / 'spk2utt', 'w') as f:
-        for speaker_id in sorted(spk2utt):
-            print(speaker_id, end='', file=f)
-            for utterance_id in sorted(spk2utt[speaker_id]):
-                print('', utterance_id, end='', file=f)
-            print(file=f)
+def read_scp(filename: Path) -> Iterable[Tuple[str, str]]:
+    if filename.exists():
+        with open(filename) as f:
+            for line in f:
+                key, _, value = line.rstrip('\n').partition(' ')
+                yield key, value
+
+
+def merge_scp(filename: Path, drop: Set[str], new: Dict[str, str]):
+    "merge new entries into a sorted scp-like file written earlier, leaving out keys in drop"
+    old = ((key, value) for key, value in read_scp(filename) if key not in drop)
+    merged = heapq.merge(old, ((key, new[key]) for key in sorted(new)), key=lambda item: item[0])
+    tmp = filename.with_name(filename.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.writelines(f'{key} {value}\n' for key, value in merged)
+    os.replace(tmp, filename)
 
 
-verbalizer = Verbalizer()
+def hash_batch(batch):
+    "content hash of every incoming utterance, to find what changed since the previous run"
+    columns = sorted(batch)
+    batch['content_hash'] = [
+        hashlib.sha256(json.dumps(row, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+        for row in zip(*(batch[column] for column in columns))
+    ]
+    return batch
 
-def verbalize(sample):
-    utterance_id = sample['id']
-    normalized_text = sample['normalized_text']
-    sample['words'] = verbalizer.forward(normalized_text, utterance_id=utterance_id)
-    return sample
+
+FTS_COLUMNS = ['text', 'normalized_text', 'kaldi_text']
+
+verbalizer = None
+
+def verbalize_batch(batch, linguistic=False):
+    "fill words of a batch, each map process gets its own verbalizer"
+    global verbalizer
+    if verbalizer is None:
+        verbalizer = Verbalizer(linguistic=linguistic)
+    unk = verbalizer.vocabulary.unk
+    seen = len(unk)
+    batch['words'] = verbalizer.forward_batch(batch['normalized_text'], utterance_ids=batch['id'])
+    # words that became <unk> travel back with their utterances, so that unk.txt counts all processes
+    unk_words = iter(unk[seen:])
+    batch['unk'] = [list(itertools.islice(unk_words, words.count('<unk>'))) for words in batch['words']]
+    del unk[seen:]
+    return batch
 
 
 def prepare(dataset, datadir):
     datadir.mkdir(exist_ok=True, parents=True)
     (datadir / 'wav').mkdir(exist_ok=True)
 
-    db = Database(datadir / 'db.sqlite', recreate=True)
+    db = BulkDatabase(datadir / 'db.sqlite')
 
-    text = {}
-    utt2spk = {}
-    spk2utt = defaultdict(set)
-    wavscp = {}
-    segments = {}
+    # kaldi files are sorted on disk, so only the vocabulary is kept in memory
+    writer = DataDirWriter(datadir)
     lexicon = defaultdict(dict)
+    unk = Counter()
 
-    samples = []
+    def samples():
+        for sample in tqdm(dataset):
+            utterance_id = sample['id']
+            words = sample['words']
+            unk.update(sample.get('unk', ()))
 
-    for sample in tqdm(dataset):
-        utterance_id = sample['id']
-        words = sample['words']
-        
-        if words is None:
-            continue
+            if words is None:
+                continue
 
-        sample['kaldi_text'] = text[utterance_id] = ' '.join(words)
-        utt2spk[utterance_id] = sample['speaker_id']
-        spk2utt[sample['speaker_id']].add(sample['id'])
+            sample['kaldi_text'] = ' '.join(words)
+            recording_id = sample['id'].split('-')[1] # speaker-recoding-utt-start-end
+            writer.add(utterance_id, sample['speaker_id'], sample['kaldi_text'],
+                       recording_id, sample['recording_path'], sample['start'], sample['end'])
 
-        start, end = sample['start'], sample['end']
+            for word in words:
+                if not word in lexicon:
+                    lexicon[word] = {}
 
-        recording_id = sample['id'].split('-')[1] # speaker-recoding-utt-start-end
-        wavscp[recording_id] = sample['recording_path']
-        segments[utterance_id] = (recording_id, start, end)
+            #logger.debug('utt {}', sample)
+            yield sample
 
-        #logger.debug('utt {}', sample)
-        samples.append(sample)
+    db.insert('utterances', samples(), pk='id')
 
-        for word in words:
-            if not word in lexicon:
-                lexicon[word] = {}
+    # triggers keep the index up to date for incremental runs
+    db.enable_fts('utterances', FTS_COLUMNS, create_triggers=True)
+    db.close()
 
-    db['utterances'].insert_all(samples, pk='id')
+    writer.close()
+    write_scp(unk, datadir / 'unk.txt')
+    write_lexicon(lexicon, datadir)
 
+
+def write_lexicon(lexicon: Dict[str, Dict[str, bool]], datadir: Path):
+    "predict pronunciations of words without them, then write lexicon.txt, words.txt and g2p.errors"
     logger.debug("estimating lexicon")
     oov = g2p_batch(lexicon)
     for word in oov:
@@ -96,19 +128,11 @@ def prepare(dataset, datadir):
             lexicon[word][pron] = True
     logger.info('learned {} new words', len(lexicon))
 
-    db['utterances'].enable_fts(['text', 'normalized_text', 'kaldi_text'])
-
-    write_scp(text, datadir / 'text')
-    write_scp(utt2spk, datadir / 'utt2spk')
-    write_spk2utt(spk2utt, datadir)
-    write_scp(wavscp, datadir / 'wav.scp')
-    if segments:
-        write_segments(segments, datadir / 'segments')
-    write_scp(Counter(verbalizer.vocabulary.unk), datadir / 'unk.txt')
     write_scp(Counter([word for word in lexicon if not lexicon[word]]), datadir / 'g2p.errors')
 
+    # sorted, so that incremental and full runs write the same lexicon
     with open(datadir / 'lexicon.txt', 'w') as lexicon_txt:
-        for word in lexicon:
+        for word in sorted(lexicon):
             for pron in lexicon[word]:
                 print(word, pron, file=lexicon_txt)
     
@@ -117,15 +141,90 @@ def prepare(dataset, datadir):
             print(word, file=words_txt)
 
 
+def prepare_incremental(dataset, datadir, map_kwargs):
+    """
+    Update a data directory made by an earlier run, verbalizing only utterances
+    that are new or have a different content hash, and dropping utterances that are gone.
+    """
+    db = Database(datadir / 'db.sqlite')
+    utterances = db['utterances']
+    if not utterances.exists() or 'content_hash' not in utterances.columns_dict:
+        logger.warning('{} has no content hashes, preparing everything', db)
+        return prepare(dataset.map(verbalize_batch, batched=True, **map_kwargs), datadir)
+    previous = dict(db.execute('SELECT id, content_hash FROM utterances').fetchall())
+
+    removed = set(previous) - set(dataset['id'])
+    changed = dataset.filter(lambda batch: [previous.get(utterance_id) != content_hash for utterance_id, content_hash
+                                            in zip(batch['id'], batch['content_hash'])], batched=True)
+    logger.info('{} utterances are new or changed, {} are gone', len(changed), len(removed))
+    changed = changed.map(verbalize_batch, batched=True, **map_kwargs)
+
+    text, utt2spk, wavscp, segments = {}, {}, {}, {}
+    samples = []
+    for sample in tqdm(changed):
+        utterance_id = sample['id']
+        words = sample['words']
+        if words is None:
+            continue
+        sample['kaldi_text'] = text[utterance_id] = ' '.join(words)
+        utt2spk[utterance_id] = sample['speaker_id']
+        recording_id = utterance_id.split('-')[1] # speaker-recoding-utt-start-end
+        wavscp[recording_id] = sample['recording_path']
+        segments[utterance_id] = f'{recording_id} {sample["start"]} {sample["end"]}'
+        samples.append(sample)
+
+    with db.conn:
+        db.conn.executemany('DELETE FROM utterances WHERE id = ?', ((utterance_id,) for utterance_id in removed))
+    # full text search is updated by the triggers made in prepare
+    utterances.upsert_all(samples, pk='id', alter=True)
+
+    # the previous files are sorted, so new lines are merged in a single pass
+    drop = removed | set(changed['id'])
+    merge_scp(datadir / 'text', drop, text)
+    merge_scp(datadir / 'utt2spk', drop, utt2spk)
+    merge_scp(datadir / 'segments', drop, segments)
+
+    utt2spk = ExternalSorter()
+    for utterance_id, speaker_id in read_scp(datadir / 'utt2spk'):
+        utt2spk.add(utterance_id, speaker_id)
+    write_spk2utt(utt2spk, datadir / 'spk2utt')
+    utt2spk.close()
+
+    recordings = {value.split(maxsplit=1)[0] for _, value in read_scp(datadir / 'segments')}
+    wavscp = {**{k: v for k, v in read_scp(datadir / 'wav.scp') if k in recordings}, **wavscp}
+    write_scp(wavscp, datadir / 'wav.scp')
+
+    unk = Counter()
+    for (unk_words,) in db.execute('SELECT unk FROM utterances'):
+        unk.update(json.loads(unk_words or '[]'))
+    write_scp(unk, datadir / 'unk.txt')
+
+    lexicon = {}
+    for _, kaldi_text in read_scp(datadir / 'text'):
+        for word in kaldi_text.split():
+            lexicon.setdefault(word, {})
+    write_lexicon(lexicon, datadir)
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(__file__, description='prepare kaldi data directory with a speech dataset from Hugging Face',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--root', type=Path, default=Path('data'),
                         help='where to put {lang}/test and {lang}/train datadirs')
+    parser.add_argument('-j', '--num_proc', type=int, default=os.cpu_count() or 1,
+                        help='processes to verbalize text with')
+    parser.add_argument('--batch_size', type=int, default=1000, help='utterances to verbalize at once')
+    parser.add_argument('--linguistic', action='store_true',
+                        help='split words with Stanza instead of whitespace (slow)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only verbalize utterances that changed since the previous run into the same directory')
     parser.add_argument('local_utterances', help='make local_utterances.json')
     args = parser.parse_args()
 
+    # datasets takes a while to import, --help should not wait for it
+    import datasets
+
     logger.info('{}', args)
 
     dataset = datasets.load_dataset('json', data_files=args.local_utterances, split='train')
@@ -133,5 +232,12 @@ if __name__ == '__main__':
     datadir = args.root / 'local'
     logger.info('writing to {}', datadir)
 
-    dataset = dataset.map(verbalize, load_from_cache_file=False)
-    prepare(dataset, datadir)
+    dataset = dataset.map(hash_batch, batched=True, load_from_cache_file=False)
+    map_kwargs = dict(batch_size=args.batch_size, num_proc=args.num_proc,
+                      fn_kwargs={'linguistic': args.linguistic}, load_from_cache_file=False)
+    if args.incremental and (datadir / 'db.sqlite').exists():
+        prepare_incremental(dataset, datadir, map_kwargs)
+    else:
+        dataset = dataset.map(verbalize_batch, batched=True, **map_kwargs)
+        prepare(dataset, datadir)
+    validate_data_dir(datadir)
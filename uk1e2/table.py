@@ -0,0 +1,157 @@
+"""
+Columnar utterance storage for large corpora.
+
+Times live in float arrays and strings that repeat across utterances
+(recordings, speakers, domains, paths) are stored once in a string pool,
+so a row costs a few machine words plus its own text and url.
+"""
+
+from array import array
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+
+# the order of fields in JSONL, same as uk1e2.download.Utterance
+COLUMNS = ('recording_id', 'id', 'text', 'normalized_text', 'start', 'end', 'speaker_id',
+           'utterance_id', 'domain', 'source', 'utterance_url', 'recording_path')
+
+# utterance urls carry their own ?start=&end= and would only grow the pool
+POOLED = ('recording_id', 'speaker_id', 'utterance_id', 'domain', 'source', 'recording_path')
+
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class StringPool:
+    def __init__(self):
+        self.strings: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def add(self, s: str) -> int:
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class UtteranceTable:
+    def __init__(self):
+        self.pool = StringPool()
+        self.codes = {name: array('I') for name in POOLED}
+        self.start = array('d')
+        self.end = array('d')
+        self.text: List[str] = []
+        self.normalized_text: List[str] = []
+        self.utterance_url: List[str] = []
+
+    def __len__(self):
+        return len(self.text)
+
+    def append(self, utterance):
+        "add anything that has the attributes of uk1e2.download.Utterance"
+        for name in POOLED:
+            self.codes[name].append(self.pool.add(getattr(utterance, name)))
+        self.start.append(utterance.start)
+        self.end.append(utterance.end)
+        self.text.append(utterance.text)
+        self.normalized_text.append(utterance.normalized_text)
+        self.utterance_url.append(utterance.utterance_url)
+
+    def extend(self, utterances: Iterable):
+        for utterance in utterances:
+            self.append(utterance)
+
+    def column(self, name: str) -> List:
+        if name in self.codes:
+            strings = self.pool.strings
+            return [strings[i] for i in self.codes[name]]
+        if name == 'id':
+            return [self.id(i) for i in range(len(self))]
+        return list(getattr(self, name))
+
+    def id(self, i: int) -> str:
+        "utterance ids are not stored: they are derived like Utterance.update_id does"
+        pool, codes = self.pool, self.codes
+        s, e = self.start[i], self.end[i]
+        return (f'{pool[codes["speaker_id"][i]]}-{pool[codes["recording_id"][i]]}-{pool[codes["utterance_id"][i]]}'
+                f'-{int(s*100):07d}-{int(e*100):07d}')
+
+    def row(self, i: int) -> Dict:
+        pool, codes = self.pool, self.codes
+        return {
+            "recording_id": pool[codes["recording_id"][i]],
+            "id": self.id(i),
+            "text": self.text[i],
+            "normalized_text": self.normalized_text[i],
+            "start": self.start[i],
+            "end": self.end[i],
+            "speaker_id": pool[codes["speaker_id"][i]],
+            "utterance_id": pool[codes["utterance_id"][i]],
+            "domain": pool[codes["domain"][i]],
+            "source": pool[codes["source"][i]],
+            "utterance_url": self.utterance_url[i],
+            "recording_path": pool[codes["recording_path"][i]],
+        }
+
+    def rows(self) -> Iterable[Dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def to_jsonl(self, f):
+        "write rows exactly like uk1e2.download prints them"
+        for i in range(len(self)):
+            f.write(_json_encode(self.row(i)))
+            f.write('\n')
+
+    def to_arrow(self):
+        "pooled columns become dictionary arrays sharing the pool"
+        import pyarrow as pa
+
+        dictionary = pa.array(self.pool.strings, type=pa.string())
+        columns = {}
+        for name in COLUMNS:
+            if name in self.codes:
+                indices = pa.array(self.codes[name], type=pa.uint32())
+                columns[name] = pa.DictionaryArray.from_arrays(indices, dictionary)
+            elif name in ('start', 'end'):
+                columns[name] = pa.array(getattr(self, name), type=pa.float64())
+            else:
+                columns[name] = pa.array(self.column(name), type=pa.string())
+        return pa.table(columns)
+
+    def to_parquet(self, filename: Path):
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), filename)
+
+    def to_kaldi(self, datadir: Path):
+        "write text (normalized), utt2spk, spk2utt, segments and wav.scp sorted by utterance id"
+        datadir.mkdir(parents=True, exist_ok=True)
+        pool, codes = self.pool, self.codes
+        order = sorted(range(len(self)), key=self.id)
+        ids = [self.id(i) for i in order]
+
+        with open(datadir / 'text', 'w') as f:
+            f.writelines(f'{utt} {" ".join(self.normalized_text[i].split())}\n' for utt, i in zip(ids, order))
+        with open(datadir / 'utt2spk', 'w') as f:
+            f.writelines(f'{utt} {pool[codes["speaker_id"][i]]}\n' for utt, i in zip(ids, order))
+        with open(datadir / 'segments', 'w') as f:
+            f.writelines(f'{utt} {pool[codes["recording_id"][i]]} {self.start[i]} {self.end[i]}\n'
+                         for utt, i in zip(ids, order))
+
+        spk2utt: Dict[str, List[str]] = {}
+        wavscp: Dict[str, str] = {}
+        for utt, i in zip(ids, order):
+            spk2utt.setdefault(pool[codes["speaker_id"][i]], []).append(utt)
+            wavscp[pool[codes["recording_id"][i]]] = pool[codes["recording_path"][i]]
+        with open(datadir / 'spk2utt', 'w') as f:
+            f.writelines(f'{spk} {" ".join(spk2utt[spk])}\n' for spk in sorted(spk2utt))
+        with open(datadir / 'wav.scp', 'w') as f:
+            f.writelines(f'{rec} {wavscp[rec]}\n' for rec in sorted(wavscp))
@@ -1,8 +1,11 @@
-import stanza
-
+import json
+import multiprocessing
 import re
+import time
 import unicodedata
+from typing import Iterable, List, Optional
 import ftfy
+from ftfy.badness import is_bad
 
 from loguru import logger
 
@@ -25,13 +28,25 @@ def strip_accents(s):
     return t
 
 
+# ASCII and Cyrillic letters have no combining marks of their own, so their accents
+# can be stripped one character at a time: with a few str.replace calls for the lowercase
+# letters that change, which is much faster than both NFD and str.translate
+accent_free = re.compile(r'[\x00-\x7f\u0400-\u0482\u048a-\u04ff]*')
+accent_replacements = [(c, strip_accents(c)) for c in map(chr, range(0x400, 0x500))
+                       if accent_free.fullmatch(c) and c == c.lower() and strip_accents(c) != c]
+
+# text that ftfy.fix_text leaves alone unless it looks like mojibake, or where it only
+# uncurls quotes that keep_useful_characters replaces anyway: no html entities,
+# no control characters and nothing to normalize
+ftfy_safe = re.compile(r'[\t\n\x20-\x25\x27-\x7e\xa0№А-яЁёЄєІіЇїҐґ«»—–…’“”―]*')
+
+
 class Vocabulary:
     def __init__(self):
         self.unk = []
     
     def resolve(self, x, *, utterance_id):
-        s = alphabet_filter['cyr'].sub('', x)
-        if x != s:
+        if alphabet_filter['cyr'].search(x):
             # ignore a non-cyrillic word for now
             self.unk.append(x)
             return "<unk>"
@@ -39,6 +54,7 @@ class Vocabulary:
 
 
 def keep_useful_characters(sentence):
+    "reference implementation of normalize_batch for a single sentence"
     s = sentence.lower()
     s = s.replace('’', "'")
     s = s.replace('`', "'")
@@ -52,46 +68,135 @@ def keep_useful_characters(sentence):
     return s
 
 
+def fix_text(text: str) -> str:
+    if ftfy_safe.fullmatch(text) and not is_bad(text):
+        return text
+    return ftfy.fix_text(text)
+
+
+def normalize_batch(texts: Iterable[str]) -> List[str]:
+    "keep_useful_characters(ftfy.fix_text(text)) of every text, with fast paths for plain Cyrillic and ASCII"
+    result = []
+    for text in texts:
+        s = fix_text(text).lower()
+        for c in '’`՚':
+            if c in s:
+                s = s.replace(c, "'")
+        s = re_punct.sub(' ', s)
+        if accent_free.fullmatch(s):
+            for c, stripped in accent_replacements:
+                if c in s:
+                    s = s.replace(c, stripped)
+        else:
+            s = strip_accents(s)
+        s = re_whitespace.sub(' ', s)
+        s = re_leading.sub('', s)
+        s = re_trailing.sub('', s)
+        result.append(s.strip())
+    return result
+
+
 class Verbalizer:
-    def __init__(self):
-        self.nlp = stanza.Pipeline('uk', processors='tokenize,pos')
+    def __init__(self, linguistic: bool = False):
+        "linguistic verbalizers split words with a Stanza tokenizer and tagger instead of whitespace"
+        self.linguistic = linguistic
+        self._nlp = None
         self.vocabulary = Vocabulary()
-        
-    def forward(self, text, *, utterance_id='sentence'):
-        text = ftfy.fix_text(text) # unicode
-        text = keep_useful_characters(text)
 
-        if text is None:
-            return None
-        else:
-            words = [self.vocabulary.resolve(t, utterance_id=utterance_id) for t in text.split()]
-            
-            return words
-
-        if False: # this path is way too slow
-            doc = self.nlp(text)
-
-            words = []
-            for sentence in doc.sentences:
-                for word in sentence.words:
-                    if word.upos == "PUNCT":
-                        continue
-                    # XXX: гнат юра юрА Юра
-                    if len(word.text) > 1 and word.text.upper() == word.text:
-                        words.append(word.text)
-                    else:
-                        words.append(word.text.lower())
-
-            return ' '.join(words)
+    @property
+    def nlp(self):
+        "Stanza takes seconds and hundreds of megabytes to load, so it is only loaded when used"
+        if self._nlp is None:
+            import stanza
+            self._nlp = stanza.Pipeline('uk', processors='tokenize,pos')
+        return self._nlp
+
+    def forward(self, text, *, utterance_id='sentence'):
+        return self.forward_batch([text], utterance_ids=[utterance_id])[0]
+
+    def forward_batch(self, texts: List[str], *, utterance_ids: Optional[List[str]] = None) -> List[List[str]]:
+        "words of every text, unknown words become <unk> and are remembered in the vocabulary"
+        if utterance_ids is None:
+            utterance_ids = ['sentence'] * len(texts)
+        resolve = self.vocabulary.resolve
+        if self.linguistic:
+            # this path is way too slow for whole corpora
+            return [[resolve(t, utterance_id=utterance_id) for t in self.tag_words(text)]
+                    for utterance_id, text in zip(utterance_ids, texts)]
+        return [[resolve(t, utterance_id=utterance_id) for t in text.split()]
+                for utterance_id, text in zip(utterance_ids, normalize_batch(texts))]
+
+    def tag_words(self, text: str) -> List[str]:
+        "words that Stanza does not tag as punctuation, abbreviations keep their case"
+        doc = self.nlp(fix_text(text))
+
+        words = []
+        for sentence in doc.sentences:
+            for word in sentence.words:
+                if word.upos == "PUNCT":
+                    continue
+                # XXX: гнат юра юрА Юра
+                if len(word.text) > 1 and word.text.upper() == word.text:
+                    words.append(word.text)
+                else:
+                    words.append(word.text.lower())
+
+        return words
 
 # TODO: БПЛА -> бе пе ел а
 
 
 
+def read_texts(filename: str) -> List[str]:
+    "transcripts of youtube*.tsv or news/text.jsonl"
+    texts = []
+    with open(filename) as f:
+        for line in f:
+            if filename.endswith('.jsonl'):
+                texts.extend(json.loads(line).values())
+            else:
+                texts.append(line.rstrip('\n').split('\t')[-1])
+    return texts
+
+
+def benchmark(filenames: List[str], jobs: int = 1, batch_size: int = 1000):
+    texts = [text for filename in filenames for text in read_texts(filename)]
+
+    t0 = time.time()
+    vocabulary = Vocabulary()
+    before = [[vocabulary.resolve(t, utterance_id='sentence') for t in keep_useful_characters(ftfy.fix_text(text)).split()]
+              for text in texts]
+    t1 = time.time()
+    batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+    with multiprocessing.Pool(jobs) as pool:
+        normalized = [text for batch in pool.imap(normalize_batch, batches) for text in batch]
+    vocabulary = Vocabulary()
+    after = [[vocabulary.resolve(t, utterance_id='sentence') for t in text.split()] for text in normalized]
+    t2 = time.time()
+
+    assert before == after, 'normalize_batch differs from keep_useful_characters'
+    logger.info('{} utterances: {:.0f} utterances/sec one by one, {:.0f} utterances/sec in batches of {} with {} jobs',
+                len(texts), len(texts) / (t1 - t0), len(texts) / (t2 - t1), batch_size, jobs)
+
+
 if __name__ == '__main__':
+    import argparse
     import sys
 
-    for line in sys.stdin:
-        utt_id, text = line.strip().split(maxsplit=1)
-        print(utt_id, keep_useful_characters(text))
+    parser = argparse.ArgumentParser(description="""\
+    Print `<utterance-id> <normalized text>` for every `<utterance-id> <text>` line of stdin,
+    or compare verbalization speed before and after batching:
+
+    python3 -m uk1e2.tokenize_text --benchmark youtube1.tsv news/text.jsonl
+    """, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmark', nargs='+', metavar='TRANSCRIPTS', help='tsv or jsonl files with texts')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='processes for the batched run')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, jobs=args.jobs)
+    else:
+        for line in sys.stdin:
+            utt_id, text = line.strip().split(maxsplit=1)
+            print(utt_id, keep_useful_characters(text))
 
@@ -0,0 +1,162 @@
+"""
+Transcode source media into 16 kHz mono PCM wavs using a pool of ffmpeg processes.
+
+Outputs whose source did not change since the previous run are not decoded again:
+the output directory keeps a manifest with size, mtime and sha256 of every source.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+import hashlib
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from loguru import logger
+
+
+MANIFEST = '.transcode.json'
+
+
+def to_wav(v: Path, a: Path):
+    "decode v into a, replacing a only once ffmpeg has finished successfully"
+    tmp = a.with_name(f'{a.stem}.tmp{a.suffix}')
+    cl = ["ffmpeg", "-y", "-loglevel", "quiet", "-i", str(v), "-vn", "-ac", "1"]
+    if a.suffix.endswith("wav"):
+        cl += ["-acodec", "pcm_s16le"]
+    cl += ["-ar", "16000", "--", str(tmp)]
+    print(f"Extracting audio by command: {' '.join(cl)}", file=sys.stderr)
+    try:
+        subprocess.check_output(cl)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            tmp.unlink()
+        raise
+    os.replace(tmp, a)
+
+
+def sha256sum(path: Path, chunk_size=1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_sources(paths: Iterable[str]) -> List[Tuple[str, Path]]:
+    "accept plain media paths or kaldi-style `<recording-id> <path>` lines"
+    sources = []
+    for line in paths:
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) == 1:
+            path = Path(fields[0])
+            sources.append((path.stem, path))
+        else:
+            sources.append((fields[0], Path(fields[1])))
+    return sources
+
+
+class Transcoder:
+    def __init__(self, output_dir: Path, jobs: int = os.cpu_count() or 1):
+        self.output_dir = output_dir
+        self.jobs = jobs
+        self.manifest_path = output_dir / MANIFEST
+        self.manifest: Dict[str, Dict] = {}
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        self.lock = threading.Lock()
+
+    def is_fresh(self, source: Path, target: Path) -> bool:
+        entry = self.manifest.get(target.name)
+        if entry is None or entry['source'] != str(source) or not target.exists():
+            return False
+        stat = source.stat()
+        if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        if entry['size'] == stat.st_size and entry['sha256'] == sha256sum(source):
+            # touched, but not changed
+            self.update(source, target, entry['sha256'])
+            return True
+        return False
+
+    def update(self, source: Path, target: Path, digest: str):
+        stat = source.stat()
+        with self.lock:
+            self.manifest[target.name] = {
+                'source': str(source),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest,
+            }
+
+    def save(self):
+        tmp = self.manifest_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=1))
+        os.replace(tmp, self.manifest_path)
+
+    def transcode(self, source: Path, target: Path) -> bool:
+        if self.is_fresh(source, target):
+            return False
+        digest = sha256sum(source)
+        to_wav(source, target)
+        self.update(source, target, digest)
+        return True
+
+    def run(self, sources: List[Tuple[str, Path]]) -> Dict[str, Path]:
+        "transcode all sources, returning a recording id to wav path mapping"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        wavscp = {recording_id: self.output_dir / f'{recording_id}.wav' for recording_id, _ in sources}
+
+        # each worker thread spends its time waiting for its own ffmpeg process
+        decoded = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {pool.submit(self.transcode, source, wavscp[recording_id]): source
+                           for recording_id, source in sources}
+                for future in as_completed(futures):
+                    decoded += future.result()
+        finally:
+            # once per run, so that a failed or interrupted run still keeps what it has decoded
+            self.save()
+        logger.info('decoded {} of {} recordings, {} were up to date', decoded, len(sources), len(sources) - decoded)
+        return wavscp
+
+
+def write_wavscp(wavscp: Dict[str, Path], out):
+    for recording_id in sorted(wavscp):
+        print(recording_id, wavscp[recording_id], file=out)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""\
+    Transcode media to 16 kHz mono wavs and write a materialized wav.scp.
+
+    python3 -m uk1e2.transcode -o news/wav --scp news/wav.scp news/webm/*.webm
+    """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output-dir', type=Path, required=True, help='where to put wavs')
+    parser.add_argument('-i', '--input-list', type=Path,
+                        help='file with media paths or `<recording-id> <path>` lines')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='ffmpeg processes to run at once')
+    parser.add_argument('--scp', type=Path, help='write wav.scp here instead of stdout')
+    parser.add_argument('sources', nargs='*', help='media files')
+
+    args = parser.parse_args()
+
+    lines = list(args.sources)
+    if args.input_list:
+        lines.extend(args.input_list.read_text().splitlines())
+
+    wavscp = Transcoder(args.output_dir, jobs=args.jobs).run(read_sources(lines))
+    if args.scp:
+        with open(args.scp, 'w') as out:
+            write_wavscp(wavscp, out)
+    else:
+        write_wavscp(wavscp, sys.stdout)